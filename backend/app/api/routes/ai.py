@@ -1,6 +1,10 @@
 """AI command suggestion endpoints"""
 from fastapi import APIRouter, HTTPException
+from typing import Optional
 from app.core.ai_service import ai_service
+from app.core.local_completion import local_completer
+from app.core.pty_manager import pty_manager
+from app.core.suggestion_cache import suggestion_cache
 from app.models.ai import AutocompleteRequest, CommandContext, SuggestionResponse
 
 router = APIRouter()
@@ -8,7 +12,8 @@ router = APIRouter()
 
 @router.post("/autocomplete", response_model=SuggestionResponse)
 async def get_autocomplete(request: AutocompleteRequest):
-    """Get as-you-type command autocomplete suggestions"""
+    """Get as-you-type command autocomplete suggestions (local ones at once,
+    merged with AI ones when they are ready)"""
     try:
         # This is a simplified context for autocompletion
         context = CommandContext(
@@ -16,7 +21,7 @@ async def get_autocomplete(request: AutocompleteRequest):
             command_history=[],
             current_directory="." 
         )
-        suggestions = await ai_service.get_autocomplete_suggestions(context)
+        suggestions = await ai_service.autocomplete(context, wait_for_ai=request.wait_for_ai)
         return suggestions
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -33,7 +38,31 @@ async def get_next_commands(context: CommandContext):
 
 
 @router.get("/git-status")
-async def get_git_status():
-    """Get current git status"""
-    status = ai_service.get_git_status()
-    return {"status": status}
+async def get_git_status(session_id: Optional[str] = None, directory: Optional[str] = None):
+    """Get the git status of a terminal session's working directory (or the given one)"""
+    if directory is None and session_id is not None:
+        session = pty_manager.get_session(session_id)
+        if session is None:
+            raise HTTPException(status_code=404, detail="Session not found")
+        directory = session.cwd
+    status = await ai_service.get_git_status(directory or ".")
+    return {"status": status, "directory": directory or "."}
+
+
+@router.get("/cache")
+async def get_cache_stats():
+    """Suggestion cache size and hit/miss/eviction counters"""
+    return suggestion_cache.stats()
+
+
+@router.delete("/cache")
+async def clear_cache():
+    """Drop every cached suggestion"""
+    suggestion_cache.clear()
+    return {"status": "success"}
+
+
+@router.get("/status")
+async def get_status():
+    """Whether AI suggestions are available and the local completion index size"""
+    return {"ai_available": ai_service.available, "local": local_completer.stats()}
@@ -1,25 +1,33 @@
-"""Command history endpoints with JSON storage"""
-from fastapi import APIRouter, HTTPException, Query, Depends
+"""Command history endpoints backed by SQLite"""
+from fastapi import APIRouter, HTTPException, Query, Depends, Request, Header
+from fastapi.responses import Response, StreamingResponse
+from sqlalchemy import delete, select
 from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.history_export import EXPORT_FORMATS, iter_export
+from app.core.history_import import HistoryImporter
 from app.core.history_service import history_service
-from app.core.database import get_session
+from app.core.output_store import BlobNotFound, output_store
+from app.core.database import CommandSequence as SequenceTable, get_session
 from app.models.history import CommandRecord, CommandSequence
 from typing import List, Optional, Dict, Any
 from datetime import datetime
+import asyncio
 
 router = APIRouter()
 
 
 @router.post("/commands")
 async def save_command(record: CommandRecord) -> Dict[str, Any]:
-    """Save a command to history in JSON file"""
+    """Save a command to history"""
     try:
-        command_record = history_service.add_command(
+        command_record = await history_service.record_command(
             command=record.command,
             exit_code=record.exit_code or 0,
             duration=record.duration_seconds or 0.0,
             directory=record.directory or "/",
-            output=getattr(record, 'output', "")
+            output=record.output or "",
+            cpu_percent=record.cpu_percent or 0.0,
+            memory_mb=record.memory_mb or 0.0
         )
         return {
             "status": "success",
@@ -32,19 +40,47 @@ async def save_command(record: CommandRecord) -> Dict[str, Any]:
 
 @router.get("/commands")
 async def get_commands(
-    limit: int = Query(100, le=1000),
-    search: Optional[str] = None
+    limit: int = Query(100, ge=1, le=1000),
+    search: Optional[str] = None,
+    favorites_only: bool = False,
+    directory: Optional[str] = None,
+    exit_code: Optional[int] = None,
+    cursor: Optional[str] = Query(None, description="older_cursor or newer_cursor of a previous page"),
+    direction: str = Query("older", pattern="^(older|newer)$")
 ) -> Dict[str, Any]:
-    """Get command history from JSON file"""
+    """Get a page of commands (oldest first); without a cursor the most recent one"""
     try:
-        commands = history_service.get_commands(limit=limit, search=search)
-        return {
-            "status": "success",
-            "data": commands,
-            "total": len(commands)
-        }
+        page = await history_service.get_page(
+            limit=limit, cursor=cursor, direction=direction, search=search,
+            favorites_only=favorites_only, directory=directory, exit_code=exit_code
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to get commands: {str(e)}")
+    return {
+        "status": "success",
+        "data": page["data"],
+        "total": len(page["data"]),
+        "older_cursor": page["older_cursor"],
+        "newer_cursor": page["newer_cursor"]
+    }
+
+
+@router.get("/search")
+async def search_commands(
+    q: str = Query(..., min_length=1, max_length=256),
+    limit: int = Query(20, ge=1, le=100)
+) -> Dict[str, Any]:
+    """Prefix, substring and fuzzy command search ranked by recency and frequency"""
+    results, elapsed_ms = await history_service.search(q, limit)
+    return {
+        "status": "success",
+        "query": q,
+        "data": results,
+        "total": len(results),
+        "elapsed_ms": round(elapsed_ms, 2)
+    }
 
 
 @router.get("/git-commits")
@@ -54,7 +90,7 @@ async def get_git_commits(
 ) -> Dict[str, Any]:
     """Get recent git commits"""
     try:
-        commits = history_service.get_git_commits(limit=limit, repo_path=repo_path)
+        commits = await history_service.get_git_commits(limit=limit, repo_path=repo_path)
         return {
             "status": "success",
             "data": commits,
@@ -68,7 +104,7 @@ async def get_git_commits(
 async def get_statistics() -> Dict[str, Any]:
     """Get command usage statistics"""
     try:
-        stats = history_service.get_statistics()
+        stats = await history_service.get_statistics()
         return {
             "status": "success",
             "data": stats
@@ -81,7 +117,7 @@ async def get_statistics() -> Dict[str, Any]:
 async def export_history() -> Dict[str, Any]:
     """Export all history data"""
     try:
-        export_path = history_service.export_data()
+        export_path = await history_service.export_data()
         return {
             "status": "success",
             "message": "History exported successfully",
@@ -93,9 +129,9 @@ async def export_history() -> Dict[str, Any]:
 
 @router.get("/data")
 async def get_raw_data() -> Dict[str, Any]:
-    """Get raw JSON data"""
+    """Get recent commands, cached git commits and storage metadata"""
     try:
-        data = history_service.load_data()
+        data = await history_service.load_data()
         return {
             "status": "success",
             "data": data
@@ -104,80 +140,101 @@ async def get_raw_data() -> Dict[str, Any]:
         raise HTTPException(status_code=500, detail=f"Failed to get raw data: {str(e)}")
 
 
-@router.get("/commands", response_model=dict)
-async def get_command_history(
-    limit: int = 50,
-    search: str = None,
-    favorites_only: bool = False,
-    session: AsyncSession = Depends(get_session)
-):
-    """Get command history with optional filtering"""
-    query = select(CommandHistory).order_by(CommandHistory.timestamp.desc())
-    
-    if search:
-        query = query.where(CommandHistory.command.contains(search))
-    
-    if favorites_only:
-        query = query.where(CommandHistory.is_favorite == True)
-    
-    query = query.limit(limit).offset(offset)
-    
-    result = await session.execute(query)
-    records = result.scalars().all()
-    
-    return [
-        CommandRecord(
-            id=r.id,
-            command=r.command,
-            exit_code=r.exit_code,
-            duration_seconds=r.duration_seconds,
-            cpu_percent=r.cpu_percent,
-            memory_mb=r.memory_mb,
-            timestamp=r.timestamp,
-            directory=r.directory,
-            is_favorite=r.is_favorite
-        )
-        for r in records
-    ]
+@router.get("/storage")
+async def get_storage_stats() -> Dict[str, Any]:
+    """History database group-commit and output store statistics"""
+    loop = asyncio.get_running_loop()
+    return {
+        "status": "success",
+        "data": {
+            **history_service.writer_stats(),
+            "outputs": await loop.run_in_executor(None, output_store.stats)
+        }
+    }
 
 
-@router.patch("/commands/{command_id}/favorite")
-async def toggle_favorite(
+def _output_range(offset: int, length: Optional[int], range_header: Optional[str]):
+    """(offset, length) from the query or an HTTP ``Range: bytes=`` header;
+    a suffix range (``bytes=-N``) becomes a negative offset"""
+    if not range_header:
+        return offset, length
+    unit, _, spec = range_header.partition("=")
+    start, dash, end = spec.partition("-")
+    try:
+        if unit.strip() != "bytes" or not dash or "," in spec:
+            raise ValueError
+        if not start:
+            return -int(end), None
+        start_at = int(start)
+        return start_at, int(end) - start_at + 1 if end else None
+    except ValueError:
+        raise HTTPException(status_code=416, detail=f"Unsupported range: {range_header}")
+
+
+def _output_response(data: bytes, size: int, offset: int) -> Response:
+    start = max(0, size + offset) if offset < 0 else offset
+    if start >= size > 0:
+        raise HTTPException(status_code=416, detail=f"Output is {size} bytes long")
+    headers = {"Accept-Ranges": "bytes", "X-Output-Size": str(size)}
+    partial = len(data) < size
+    if partial:
+        headers["Content-Range"] = f"bytes {start}-{start + len(data) - 1}/{size}"
+    return Response(
+        content=data,
+        status_code=206 if partial else 200,
+        media_type="text/plain; charset=utf-8",
+        headers=headers
+    )
+
+
+@router.get("/commands/{command_id}/output")
+async def get_command_output(
     command_id: int,
-    session: AsyncSession = Depends(get_session)
+    offset: int = Query(0, description="First byte; negative counts from the end"),
+    length: Optional[int] = Query(None, ge=1, description="Bytes to return (default: to the end)"),
+    range_header: Optional[str] = Header(None, alias="Range")
+):
+    """Full output of a command, or a byte range of it"""
+    offset, length = _output_range(offset, length, range_header)
+    try:
+        data, size = await history_service.read_output(command_id, offset, length)
+    except BlobNotFound:
+        raise HTTPException(status_code=410, detail="Output removed by retention")
+    except LookupError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    return _output_response(data, size, offset)
+
+
+@router.get("/outputs/{key}")
+async def get_output_blob(
+    key: str,
+    offset: int = Query(0, description="First byte; negative counts from the end"),
+    length: Optional[int] = Query(None, ge=1, description="Bytes to return (default: to the end)"),
+    range_header: Optional[str] = Header(None, alias="Range")
 ):
+    """A stored output by its content hash (``output_hash`` of history records)"""
+    offset, length = _output_range(offset, length, range_header)
+    try:
+        data, size = await output_store.read_async(key, offset, length)
+    except BlobNotFound:
+        raise HTTPException(status_code=404, detail="Output not found")
+    return _output_response(data, size, offset)
+
+
+@router.patch("/commands/{command_id}/favorite")
+async def toggle_favorite(command_id: int):
     """Toggle favorite status of a command"""
-    result = await session.execute(
-        select(CommandHistory).where(CommandHistory.id == command_id)
-    )
-    record = result.scalar_one_or_none()
-    
-    if not record:
+    is_favorite = await history_service.set_favorite(command_id)
+    if is_favorite is None:
         raise HTTPException(status_code=404, detail="Command not found")
-    
-    record.is_favorite = not record.is_favorite
-    await session.commit()
-    
-    return {"id": command_id, "is_favorite": record.is_favorite}
+
+    return {"id": command_id, "is_favorite": is_favorite}
 
 
 @router.delete("/commands/old")
-async def cleanup_old_commands(
-    days: int = Query(90, ge=1),
-    session: AsyncSession = Depends(get_session)
-):
+async def cleanup_old_commands(days: int = Query(90, ge=1)):
     """Delete commands older than specified days"""
-    cutoff_date = datetime.utcnow() - timedelta(days=days)
-    
-    result = await session.execute(
-        delete(CommandHistory).where(
-            CommandHistory.timestamp < cutoff_date,
-            CommandHistory.is_favorite == False
-        )
-    )
-    await session.commit()
-    
-    return {"deleted": result.rowcount}
+    return {"deleted": await history_service.delete_older_than(days)}
 
 
 @router.get("/sequences", response_model=List[CommandSequence])
@@ -185,7 +242,7 @@ async def get_sequences(
     session: AsyncSession = Depends(get_session)
 ):
     """Get all saved command sequences"""
-    result = await session.execute(select(CommandSequence))
+    result = await session.execute(select(SequenceTable))
     sequences = result.scalars().all()
     
     return [
@@ -206,7 +263,7 @@ async def save_sequence(
     session: AsyncSession = Depends(get_session)
 ):
     """Save a new command sequence"""
-    db_sequence = CommandSequence(
+    db_sequence = SequenceTable(
         name=sequence.name,
         commands=sequence.commands,
         description=sequence.description
@@ -231,7 +288,7 @@ async def delete_sequence(
 ):
     """Delete a command sequence"""
     result = await session.execute(
-        delete(CommandSequence).where(CommandSequence.id == sequence_id)
+        delete(SequenceTable).where(SequenceTable.id == sequence_id)
     )
     await session.commit()
     
@@ -242,38 +299,37 @@ async def delete_sequence(
 
 
 @router.get("/export")
-async def export_history(
-    format: str = Query("json", regex="^(json|csv)$"),
-    session: AsyncSession = Depends(get_session)
+async def export_history_stream(
+    format: str = Query("json", pattern="^(ndjson|csv|json)$"),
+    since: Optional[datetime] = Query(None, description="Only commands at or after this time"),
+    until: Optional[datetime] = Query(None, description="Only commands before this time"),
+    gzip: bool = Query(False, description="Compress the download")
 ):
-    """Export command history"""
-    result = await session.execute(
-        select(CommandHistory).order_by(CommandHistory.timestamp.desc())
+    """Stream command history as NDJSON, CSV or a JSON array (oldest first)"""
+    await history_service.flush()
+    media_type, extension = EXPORT_FORMATS[format]
+    filename = f"history.{extension}"
+    if gzip:
+        media_type, filename = "application/gzip", filename + ".gz"
+    return StreamingResponse(
+        iter_export(format, since, until, compress=gzip),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
     )
-    records = result.scalars().all()
-    
-    if format == "json":
-        data = [
-            {
-                "command": r.command,
-                "exit_code": r.exit_code,
-                "duration_seconds": r.duration_seconds,
-                "cpu_percent": r.cpu_percent,
-                "memory_mb": r.memory_mb,
-                "timestamp": r.timestamp.isoformat(),
-                "directory": r.directory,
-                "is_favorite": r.is_favorite
-            }
-            for r in records
-        ]
-        return {"format": "json", "data": data}
-    
-    # CSV format
-    csv_lines = ["command,exit_code,duration_seconds,cpu_percent,memory_mb,timestamp,directory,is_favorite"]
-    for r in records:
-        csv_lines.append(
-            f'"{r.command}",{r.exit_code},{r.duration_seconds},{r.cpu_percent},'
-            f'{r.memory_mb},{r.timestamp.isoformat()},"{r.directory}",{r.is_favorite}'
-        )
-    
-    return {"format": "csv", "data": "\n".join(csv_lines)}
+
+
+@router.post("/import")
+async def import_history(
+    request: Request,
+    format: str = Query("auto", pattern="^(auto|bash|zsh|fish)$"),
+    directory: str = Query("/", description="Directory recorded for the imported commands")
+) -> Dict[str, Any]:
+    """Bulk import a bash, zsh (extended) or fish history file sent as the request body"""
+    importer = HistoryImporter(format=format, directory=directory)
+    try:
+        async for chunk in request.stream():
+            await importer.feed(chunk)
+        summary = await importer.finish()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to import history: {str(e)}")
+    return {"status": "success", "data": summary}
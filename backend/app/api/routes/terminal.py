@@ -1,79 +1,166 @@
 """Terminal WebSocket endpoint"""
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+from fastapi import APIRouter, HTTPException, Query, WebSocket, WebSocketDisconnect
+from fastapi.responses import Response
+from app.config import settings
 from app.core.pty_manager import pty_manager
-from app.models.terminal import TerminalMessage
+from app.core.session_recorder import list_recordings, read_recording
+from app.core.output_pipeline import OutputPipeline
+from app.core.terminal_protocol import decode_mux, negotiate_protocol
+from app.core.terminal_mux import TerminalMux
+from app.core.session_limiter import SessionLimitExceeded
+from typing import Optional
 import asyncio
-import json
+import uuid
 
 router = APIRouter()
 
 
+def client_key(websocket: WebSocket) -> str:
+    """Admission-control key of a connection: the peer host, or the first
+    address of the configured forwarded header when behind a reverse proxy"""
+    if settings.terminal_client_header:
+        forwarded = websocket.headers.get(settings.terminal_client_header, "")
+        address = forwarded.split(",")[0].strip()
+        if address:
+            return address
+    return websocket.client.host if websocket.client else "unknown"
+
+
 @router.websocket("/ws")
-async def terminal_websocket(websocket: WebSocket):
-    """WebSocket endpoint for terminal I/O"""
-    await websocket.accept()
-    
-    # Create a new PTY session
-    session = pty_manager.create_session(cols=80, rows=24)
-    
-    print(f"✅ Terminal session created: {session.session_id} (PID: {session.pid})")
-    
-    # Send session info to client
-    await websocket.send_json({
-        "type": "connected",
-        "session_id": session.session_id,
-        "pid": session.pid
-    })
+async def terminal_websocket(
+    websocket: WebSocket,
+    session_id: Optional[str] = None,
+    offset: Optional[int] = None,
+    cols: int = 80,
+    rows: int = 24
+):
+    """WebSocket endpoint for terminal I/O.
 
-    loop = asyncio.get_running_loop()
-    
-    def pty_output_handler():
-        """Handle output from the PTY"""
-        try:
-            data = session.read(1024)
-            if data:
-                # Ensure data is a string, not bytes
-                if isinstance(data, bytes):
-                    data = data.decode('utf-8', errors='replace')
-                
-                # Schedule the send operation on the event loop
-                asyncio.run_coroutine_threadsafe(
-                    websocket.send_json({"type": "output", "data": data}),
-                    loop
-                )
-        except Exception as e:
-            print(f"PTY read error: {e}")
-            if session.fileno() != -1:
-                loop.remove_reader(session.fileno())
-            pty_manager.close_session(session.session_id)
+    Pass ``session_id`` to reattach to a detached session and ``offset`` (the
+    number of output bytes already received) to replay only what was missed.
+    Send ``close`` to end the session, or ``leave`` when the page unloads
+    to end it unless it is reattached within ``terminal_leave_grace``.
+    """
+    protocol, subprotocol = negotiate_protocol(websocket)
+    await websocket.accept(subprotocol=subprotocol)
+
+    client = client_key(websocket)
+    try:
+        session, reattached = await pty_manager.open_session(session_id, cols, rows, client)
+    except SessionLimitExceeded as e:
+        print(f"⛔ Terminal session refused for {client}: {e}")
+        await protocol.send_control(websocket, {"type": "error", "message": str(e)})
+        await websocket.close(code=1013)  # Try again later
+        return
+    if not reattached:
+        offset = None
+
+    pipeline: Optional[OutputPipeline] = None
+    closed_by_client = False
+    left_by_client = False
+
+    async def send_output(data: bytes, end_offset: int, snapshot: bool):
+        """Forward a coalesced output frame (or screen snapshot) to the client"""
+        await protocol.send_output(websocket, data, end_offset, snapshot)
+
+    async def send_control(message: dict):
+        """Forward a control message (throttle state) to the client"""
+        await protocol.send_control(websocket, message)
+
+    def on_pty_eof():
+        """Close the socket once the shell has exited"""
+        asyncio.create_task(websocket.close())
 
-    # Add a reader for the PTY file descriptor
-    if session.fileno() != -1:
-        loop.add_reader(session.fileno(), pty_output_handler)
-    
     try:
+        pipeline = OutputPipeline(
+            session, send_output, on_eof=on_pty_eof, control=send_control, offset=offset
+        )
+
+        # Send session info to client
+        await protocol.send_control(websocket, {
+            "type": "connected",
+            "session_id": session.session_id,
+            "pid": session.pid,
+            "protocol": protocol.name,
+            "reattached": reattached,
+            "offset": pipeline.cursor,
+            "skipped_bytes": pipeline.skipped_bytes,
+            "snapshot": pipeline.starts_with_snapshot
+        })
+
+        # Stream PTY output through the coalescing pipeline
+        pipeline.start()
+
         while True:
             # Wait for client messages
-            message_json = await websocket.receive_text()
-            message = TerminalMessage.parse_raw(message_json)
-            
+            raw = await websocket.receive()
+            if raw["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(raw.get("code", 1000))
+            message = protocol.decode(raw)
+            if message is None:
+                continue
+
             if message.type == "input":
                 session.write(message.data)
+                await session.drain()
             elif message.type == "resize":
                 if message.cols and message.rows:
                     session.resize(message.cols, message.rows)
             elif message.type == "close":
+                closed_by_client = True
+                break
+            elif message.type == "leave":
+                left_by_client = True
                 break
-                
+
     except WebSocketDisconnect:
         print(f"🔌 WebSocket disconnected for session: {session.session_id}")
     except Exception as e:
         print(f"An error occurred: {e}")
     finally:
-        print(f"Closing terminal session: {session.session_id}")
-        if session.fileno() != -1:
-            loop.remove_reader(session.fileno())
-        pty_manager.close_session(session.session_id)
+        if pipeline:
+            pipeline.stop()
+        if closed_by_client or session.eof or not session.is_alive():
+            print(f"Closing terminal session: {session.session_id}")
+            pty_manager.close_session(session.session_id)
+        else:
+            print(f"⏸️  Terminal session detached: {session.session_id}")
+            if left_by_client:
+                pty_manager.leave_session(session.session_id)
+
+
+@router.websocket("/mux")
+async def terminal_mux_websocket(websocket: WebSocket):
+    """Multiplexed WebSocket endpoint: many terminals over one connection.
+
+    Every message carries a ``channel`` id chosen by the client; send
+    ``open`` (optionally with ``session_id``/``offset`` to reattach) before
+    using a channel.
+    """
+    protocol, subprotocol = negotiate_protocol(websocket)
+    await websocket.accept(subprotocol=subprotocol)
+
+    client = client_key(websocket)
+    mux = TerminalMux(websocket, protocol, client)
+    mux.start()
+    try:
+        while True:
+            raw = await websocket.receive()
+            if raw["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(raw.get("code", 1000))
+            try:
+                event = decode_mux(raw)
+            except ValueError as e:
+                print(f"Invalid mux message: {e}")
+                continue
+            if event is not None:
+                await mux.handle(event)
+    except WebSocketDisconnect:
+        print(f"🔌 Multiplexed WebSocket disconnected ({len(mux.channels)} channels)")
+    except Exception as e:
+        print(f"An error occurred: {e}")
+    finally:
+        mux.close()
 
 
 @router.get("/sessions")
@@ -85,6 +172,81 @@ async def list_sessions():
             "session_id": sid,
             "pid": session.pid,
             "created_at": session.created_at.isoformat(),
-            "status": "active" if session.is_alive() else "closed"
+            "status": "active" if session.is_alive() else "closed",
+            "attached": len(session.viewers),
+            "detached_at": session.detached_at.isoformat() if session.detached_at else None,
+            "output": session.output_stats(),
+            "viewers": [viewer.stats() for viewer in session.viewers]
         })
     return {"sessions": sessions}
+
+
+@router.get("/sessions/{session_id}/search")
+async def search_session(
+    session_id: str,
+    q: str = Query(..., min_length=1, max_length=256),
+    limit: int = Query(50, ge=1, le=1000)
+):
+    """Search a session's output, newest matches first.
+
+    Results carry the stream offset of the matching line; queries of three
+    or more characters use the index, shorter ones scan. Output the index
+    dropped while it could not keep up (floods) is never searched; its
+    size is returned as ``unindexed_bytes``.
+    """
+    session = pty_manager.get_session(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Session not found")
+    if session.search_index is None:
+        raise HTTPException(status_code=400, detail="Scrollback search is disabled")
+
+    matches, took_ms = await session.search_index.search(q, limit)
+    return {
+        "session_id": session_id,
+        "query": q,
+        "matches": matches,
+        "took_ms": round(took_ms, 2),
+        "unindexed_bytes": session.search_index.dropped_bytes,
+        "index": session.search_index.stats()
+    }
+
+
+@router.get("/pool")
+async def get_pool_stats():
+    """Warm shell pool hit rate and time-to-first-prompt"""
+    return pty_manager.pool.stats()
+
+
+@router.get("/admission")
+async def get_admission_stats():
+    """Session limits, current usage and queue depth"""
+    return {**pty_manager.limiter.stats(), "reclaimed": pty_manager.reclaimed}
+
+
+@router.get("/recordings")
+async def get_recordings():
+    """List recorded sessions"""
+    loop = asyncio.get_running_loop()
+    return {"recordings": await loop.run_in_executor(None, list_recordings)}
+
+
+@router.get("/recordings/{session_id}")
+async def replay_recording(
+    session_id: str,
+    start: float = Query(0.0, ge=0),
+    end: Optional[float] = Query(None, ge=0),
+    max_bytes: int = Query(4 * 1024 * 1024, gt=0, le=64 * 1024 * 1024)
+):
+    """Asciicast of a recorded session from ``start`` seconds (up to ``end``)"""
+    try:
+        uuid.UUID(session_id)
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Recording not found")
+
+    loop = asyncio.get_running_loop()
+    cast = await loop.run_in_executor(
+        None, read_recording, session_id, start, end, max_bytes
+    )
+    if cast is None:
+        raise HTTPException(status_code=404, detail="Recording not found")
+    return Response(content=cast, media_type="application/x-asciicast")
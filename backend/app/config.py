@@ -18,16 +18,91 @@ class Settings(BaseSettings):
     cors_origins: List[str] = ["http://localhost:5173", "http://localhost:3000"]
     
     # Groq API
-    groq_api_key: str
+    groq_api_key: str = ""  # without one only local autocomplete is offered
     groq_model: str = "llama-3.3-70b-versatile"
+    ai_output_context_chars: int = 2000  # command output quoted in prompts (head and tail)
+    ai_offline_backoff: float = 30.0  # seconds the AI is skipped after a failed request
+
+    # AI Suggestion Cache
+    ai_cache_max_entries: int = 1000  # least recently used dropped beyond this
+    ai_cache_autocomplete_ttl: float = 300.0  # seconds
+    ai_cache_next_command_ttl: float = 60.0  # seconds
+    ai_cache_stale_seconds: float = 0.0  # expired entries served this long while refreshed (0 disables)
+    ai_cache_file: str = ""  # entries persisted across restarts when set, e.g. "suggestion_cache.json"
+
+    # Local Autocomplete (history, $PATH and known subcommands/flags)
+    autocomplete_max_suggestions: int = 5  # local and AI suggestions merged
+    autocomplete_ai_wait_ms: float = 25.0  # AI suggestions not ready by then are marked pending
+    autocomplete_history_size: int = 50000  # most frecent distinct commands indexed
+    autocomplete_rebuild_interval: int = 3600  # seconds between rebuilds (frecency decays)
     
     # Security
     secret_key: str = "change-this-in-production"
     
     # Resource Monitoring
     monitor_interval: int = 2  # seconds
-    max_history_days: int = 90
-    
+
+    # Command History (stored in the database)
+    history_dir: str = "history"  # legacy snapshot + log store, imported on startup
+    history_commit_window_ms: float = 10.0  # commands arriving within this window share one transaction
+    history_fsync: str = "interval"  # SQLite sync level: 'always' (FULL), 'interval' (NORMAL) or 'never' (OFF)
+    history_output_max_bytes: int = 8 * 1024 * 1024  # output captured per terminal command
+    history_segment_days: int = 7  # period per history segment (table); weekly segments start on Mondays
+    max_history_days: int = 90  # segments that ended longer ago are dropped, favorites kept (0 keeps all)
+    history_retention_interval: int = 3600  # seconds between retention runs
+
+    # Command Output (content-addressed, compressed blobs)
+    output_store_dir: str = "outputs"
+    output_store_max_bytes: int = 1024 * 1024 * 1024  # least recently stored removed beyond this (0 = unlimited)
+    output_store_chunk_bytes: int = 64 * 1024  # compressed independently, the unit of range reads
+
+    # Git Metadata
+    git_max_processes: int = 4  # concurrent git subprocesses
+    git_timeout: float = 5.0  # seconds before a git call is abandoned
+    git_status_ttl: float = 10.0  # seconds a status is reused while .git is unchanged
+
+    # Terminal Output
+    terminal_flush_interval_ms: float = 4.0  # coalescing window
+    terminal_max_frame_bytes: int = 65536  # flush early once a frame reaches this size
+    terminal_echo_max_bytes: int = 32  # small idle writes (keystroke echo) skip the window
+    terminal_output_high_water: int = 1024 * 1024  # pause reading the PTY above this
+    terminal_output_low_water: int = 256 * 1024  # resume reading once drained below this
+    terminal_input_high_water: int = 256 * 1024  # stop reading client input while more is unwritten
+
+    # Terminal Sessions
+    terminal_scrollback_bytes: int = 2 * 1024 * 1024  # per-session replay ring
+    terminal_session_idle_ttl: int = 900  # seconds a detached session is kept
+    terminal_leave_grace: float = 10.0  # seconds a page that left has to reattach (reload)
+    terminal_reap_interval: int = 30  # seconds
+    terminal_throttle_bytes_per_sec: int = 4 * 1024 * 1024  # summarise above this (0 disables)
+    terminal_throttle_fps: float = 10.0  # summary frames per second while throttled
+    terminal_pool_size: int = 2  # pre-spawned warm shells (0 disables)
+    terminal_max_sessions: int = 64
+    terminal_max_sessions_per_client: int = 8  # detached sessions are reclaimed first
+    # Clients are keyed by peer host, so everyone behind a reverse proxy shares
+    # one limit; set to the header the proxy puts the client address in
+    # (e.g. "x-forwarded-for"), only if the proxy overwrites it
+    terminal_client_header: str = ""
+    terminal_admission_policy: str = "queue"  # 'queue' or 'reject' when full
+    terminal_admission_timeout: float = 10.0  # seconds a queued connection waits
+    terminal_shell_integration: bool = True  # record commands from bash prompt markers
+
+    # Terminal Screen Model (requires pyte)
+    terminal_screen_model: bool = False  # keep a server-side VT screen per session
+    terminal_snapshot_min_bytes: int = 65536  # reattach gaps above this get a snapshot
+    terminal_screen_skip_bytes: int = 512 * 1024  # lagging viewers jump to a snapshot
+    terminal_screen_catchup_bytes: int = 64 * 1024  # most output replayed into the model
+
+    # Terminal Search
+    terminal_search_index_bytes: int = 64 * 1024 * 1024  # indexed text kept per session (0 disables)
+    terminal_search_backlog_bytes: int = 8 * 1024 * 1024  # unindexed output kept during floods
+
+    # Terminal Recording (asciicast v2)
+    terminal_recording: bool = False  # record every session's output and input
+    terminal_recording_dir: str = "recordings"
+    terminal_recording_flush_interval: float = 0.5  # seconds between background writes
+    terminal_recording_index_interval: float = 1.0  # seconds between time index entries
+
     # Database
     database_url: str = "sqlite+aiosqlite:///./terminal_history.db"
     
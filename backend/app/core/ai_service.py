@@ -1,10 +1,15 @@
 """Groq AI service for command suggestions"""
+import asyncio
 import os
+import time
 from groq import AsyncGroq
 from app.config import settings
+from app.core.git_service import git_service
+from app.core.local_completion import local_completer
+from app.core.output_store import BlobNotFound, output_store
+from app.core.suggestion_cache import prompt_key, suggestion_cache
 from app.models.ai import CommandContext, CommandSuggestion, SuggestionResponse
 from typing import List
-import subprocess
 import json
 
 
@@ -12,9 +17,47 @@ class AIService:
     """Service for generating AI-powered command suggestions"""
     
     def __init__(self):
-        self.client = AsyncGroq(api_key=settings.groq_api_key)
+        self.client = AsyncGroq(api_key=settings.groq_api_key) if settings.groq_api_key else None
         self.model = settings.groq_model
-        
+        self._offline_until = 0.0  # monotonic time before which the AI is not asked
+        self._background: set = set()
+
+    @property
+    def available(self) -> bool:
+        """Whether AI suggestions can be requested (key configured, no recent failure)"""
+        return self.client is not None and time.monotonic() >= self._offline_until
+
+    async def autocomplete(self, context: CommandContext, wait_for_ai: bool = False) -> SuggestionResponse:
+        """Local completions at once, merged with the AI's if they are ready
+        within ``autocomplete_ai_wait_ms`` (or when asked to wait for them).
+
+        AI suggestions that are late keep coming in the background and land
+        in the suggestion cache; the response is marked ``pending`` so the
+        client can ask again with ``wait_for_ai``, which joins that request.
+        Without an API key, or while the AI is unreachable, only local
+        completions are returned.
+        """
+        limit = settings.autocomplete_max_suggestions
+        local = local_completer.complete(context.current_command, limit)
+        if not self.available:
+            return SuggestionResponse(suggestions=local)
+
+        remote = asyncio.ensure_future(self.get_autocomplete_suggestions(context))
+        self._background.add(remote)
+        remote.add_done_callback(self._background.discard)
+        timeout = None if wait_for_ai else settings.autocomplete_ai_wait_ms / 1000
+        await asyncio.wait({remote}, timeout=timeout)
+        if not remote.done():
+            return SuggestionResponse(suggestions=local, pending=True)
+
+        merged = {}
+        for suggestion in local + remote.result().suggestions:
+            kept = merged.get(suggestion.command)
+            if kept is None or suggestion.confidence > kept.confidence:
+                merged[suggestion.command] = suggestion
+        ranked = sorted(merged.values(), key=lambda suggestion: -suggestion.confidence)
+        return SuggestionResponse(suggestions=ranked[:limit])
+
     async def get_autocomplete_suggestions(
         self,
         context: CommandContext,
@@ -23,36 +66,14 @@ class AIService:
         """Get as-you-type command autocomplete suggestions"""
         
         # Build context prompt
+        await self._add_git_status(context)
         prompt = self._build_autocomplete_prompt(context)
-        
-        try:
-            response = await self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "You are a helpful Linux command-line assistant. Provide concise, accurate command suggestions. Return ONLY valid JSON."
-                    },
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ],
-                temperature=0.3,
-                max_tokens=500,
-            )
-            
-            content = response.choices[0].message.content
-            suggestions = self._parse_suggestions(content, max_suggestions)
-            
-            return SuggestionResponse(
-                suggestions=suggestions,
-                reasoning=None
-            )
-            
-        except Exception as e:
-            print(f"AI Service Error: {e}")
-            return SuggestionResponse(suggestions=[])
+        system = "You are a helpful Linux command-line assistant. Provide concise, accurate command suggestions. Return ONLY valid JSON."
+        return await suggestion_cache.get(
+            "autocomplete",
+            prompt_key("autocomplete", prompt, max_suggestions),
+            lambda: self._complete(system, prompt, 0.3, 500, max_suggestions),
+        )
     
     async def get_next_command_suggestions(
         self,
@@ -61,23 +82,36 @@ class AIService:
     ) -> SuggestionResponse:
         """Get suggestions for next commands after execution"""
         
+        await self._add_git_status(context)
+        await self._add_last_output(context)
         prompt = self._build_next_command_prompt(context)
-        
+        system = "You are an expert Linux system administrator. Suggest logical next commands based on what was just executed. Return ONLY valid JSON."
+        return await suggestion_cache.get(
+            "next",
+            prompt_key("next", prompt, max_suggestions),
+            lambda: self._complete(system, prompt, 0.4, 800, max_suggestions),
+        )
+
+    async def _complete(self, system: str, prompt: str, temperature: float,
+                        max_tokens: int, max_suggestions: int) -> SuggestionResponse:
+        """One Groq round-trip (no suggestions if it fails)"""
+        if not self.available:
+            return SuggestionResponse(suggestions=[])
         try:
             response = await self.client.chat.completions.create(
                 model=self.model,
                 messages=[
                     {
                         "role": "system",
-                        "content": "You are an expert Linux system administrator. Suggest logical next commands based on what was just executed. Return ONLY valid JSON."
+                        "content": system
                     },
                     {
                         "role": "user",
                         "content": prompt
                     }
                 ],
-                temperature=0.4,
-                max_tokens=800,
+                temperature=temperature,
+                max_tokens=max_tokens,
             )
             
             content = response.choices[0].message.content
@@ -90,6 +124,8 @@ class AIService:
             
         except Exception as e:
             print(f"AI Service Error: {e}")
+            # Unreachable or rejected: local completion carries on alone for a while
+            self._offline_until = time.monotonic() + settings.ai_offline_backoff
             return SuggestionResponse(suggestions=[])
     
     def _build_autocomplete_prompt(self, context: CommandContext) -> str:
@@ -128,9 +164,7 @@ Provide 3 command completions in JSON format:
         
         output_info = ""
         if context.last_output:
-            # Truncate long output
-            output = context.last_output[:500]
-            output_info = f"\nCommand Output:\n{output}"
+            output_info = f"\nCommand Output:\n{context.last_output}"
         
         return f"""Suggest the next logical commands to run.
 
@@ -179,20 +213,50 @@ Provide up to 5 next command suggestions in JSON format:
             return []
     
     @staticmethod
-    def get_git_status() -> str:
-        """Get git status if in a git repository"""
+    async def get_git_status(directory: str) -> str:
+        """Get git status if directory is in a git repository (cached)"""
         try:
-            result = subprocess.run(
-                ["git", "status", "--short"],
-                capture_output=True,
-                text=True,
-                timeout=2
-            )
-            if result.returncode == 0:
-                return result.stdout
+            return await git_service.status(directory)
         except Exception:
-            pass
-        return ""
+            return ""
+
+    @staticmethod
+    def _excerpt(head: str, tail: str, omitted: int) -> str:
+        if omitted <= 0:
+            return head + tail
+        return f"{head}\n[... {omitted} omitted ...]\n{tail}"
+
+    async def _add_last_output(self, context: CommandContext):
+        """Shorten the output quoted in the prompt to its beginning and end
+        (errors and summaries tend to be at the end); output referenced by
+        hash is range-read from the output store, never loaded in full"""
+        limit = settings.ai_output_context_chars
+        head_size = limit // 4
+        if context.last_output:
+            text = context.last_output
+            omitted = len(text) - limit
+            if omitted > 0:
+                context.last_output = self._excerpt(text[:head_size], text[-(limit - head_size):], omitted)
+            return
+        if not context.last_output_hash:
+            return
+        try:
+            head, size = await output_store.read_async(context.last_output_hash, 0, limit)
+            omitted = size - limit
+            tail = b""
+            if omitted > 0:
+                head = head[:head_size]
+                tail, _ = await output_store.read_async(context.last_output_hash, -(limit - head_size))
+        except (BlobNotFound, OSError):
+            return
+        context.last_output = self._excerpt(
+            head.decode("utf-8", errors="replace"), tail.decode("utf-8", errors="replace"), omitted
+        )
+
+    async def _add_git_status(self, context: CommandContext):
+        """Fill in the git status of the context's directory unless the client sent one"""
+        if context.git_status is None and os.path.isabs(context.current_directory):
+            context.git_status = await self.get_git_status(context.current_directory) or None
 
 
 # Global AI service instance
@@ -1,10 +1,24 @@
 """Database configuration and models"""
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
-from sqlalchemy import String, Integer, Float, DateTime, Boolean, JSON
+from sqlalchemy.schema import CreateIndex
+from sqlalchemy import (
+    String, Integer, Float, DateTime, Boolean, JSON, Index, MetaData, Table, bindparam, event,
+    func, inspect, select, update
+)
 from datetime import datetime
+from typing import IO, List, Optional
+import fcntl
+import os
 from app.config import settings
 
+# Wrappers skipped when normalising a command line to the program it runs
+_COMMAND_PREFIXES = {"sudo", "doas", "time", "nohup", "nice", "env", "command", "builtin", "exec"}
+
+# SQLite 'synchronous' level for each history_fsync policy (in WAL mode
+# NORMAL only syncs at checkpoints; a crash can lose the last commits, never corrupt)
+_SYNCHRONOUS = {"always": "FULL", "interval": "NORMAL", "never": "OFF"}
+
 
 # Create async engine
 engine = create_async_engine(
@@ -12,6 +26,31 @@ engine = create_async_engine(
     echo=settings.debug,
 )
 
+
+@event.listens_for(engine.sync_engine, "connect")
+def _configure_sqlite(dbapi_connection, connection_record):
+    """WAL journal so readers never block the writer, and the configured sync level"""
+    if engine.dialect.name != "sqlite":
+        return
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute(f"PRAGMA synchronous={_SYNCHRONOUS.get(settings.history_fsync, 'NORMAL')}")
+    cursor.execute("PRAGMA busy_timeout=5000")
+    cursor.close()
+
+
+def base_command(command: str) -> str:
+    """The program a command line runs: ``sudo FOO=1 /usr/bin/git log`` -> ``git``"""
+    wrapped = False
+    for token in command.split():
+        if token in _COMMAND_PREFIXES:
+            wrapped = True
+        elif (wrapped and token.startswith("-")) or ("=" in token and not token.startswith("=")):
+            continue
+        else:
+            return os.path.basename(token.strip("'\"")) or token
+    return ""
+
 # Create session factory
 async_session_maker = async_sessionmaker(
     engine,
@@ -26,9 +65,13 @@ class Base(DeclarativeBase):
 
 
 class CommandHistory(Base):
-    """Command history table"""
-    __tablename__ = "command_history"
-    
+    """Command history columns and indexes, shared by every history segment.
+
+    This table itself holds the favorites pinned when retention dropped
+    the segment they were recorded in (see history_segments).
+    """
+    __tablename__ = "command_history_pinned"
+
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     command: Mapped[str] = mapped_column(String, nullable=False)
     exit_code: Mapped[int] = mapped_column(Integer, nullable=False)
@@ -38,6 +81,130 @@ class CommandHistory(Base):
     timestamp: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
     directory: Mapped[str] = mapped_column(String, nullable=False)
     is_favorite: Mapped[bool] = mapped_column(Boolean, default=False)
+    base_command: Mapped[str] = mapped_column(String, nullable=False, default="")
+    output: Mapped[str] = mapped_column(String, nullable=False, default="")  # inline (legacy records)
+    output_hash: Mapped[str] = mapped_column(String, nullable=False, default="")  # output store key
+    output_size: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        # Keyset pages: each filter column leads an index ending in the page key
+        Index("ix_command_history_pinned_timestamp", "timestamp", "id"),
+        Index("ix_command_history_pinned_directory_time", "directory", "timestamp", "id"),
+        Index("ix_command_history_pinned_favorite_time", "is_favorite", "timestamp", "id"),
+        Index("ix_command_history_pinned_exit_code_time", "exit_code", "timestamp", "id"),
+        Index("ix_command_history_pinned_base_command", "base_command"),
+        Index("ix_command_history_pinned_command", "command", "timestamp", "id"),
+    )
+
+
+class HistorySegment(Base):
+    """One period of command history, stored in its own table"""
+    __tablename__ = "history_segments"
+
+    name: Mapped[str] = mapped_column(String, primary_key=True)  # table name
+    start: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+    end: Mapped[datetime] = mapped_column(DateTime, nullable=False)  # exclusive
+
+
+class HistorySequence(Base):
+    """Next history row id. Writers bump it as the first statement of their
+    transaction, so processes sharing the database never hand out the same id"""
+    __tablename__ = "history_sequence"
+
+    name: Mapped[str] = mapped_column(String, primary_key=True)
+    next_id: Mapped[int] = mapped_column(Integer, nullable=False)
+
+
+# The single history table used before history was partitioned
+LEGACY_HISTORY_TABLE = "command_history"
+
+_segment_metadata = MetaData()
+
+
+def segment_table(name: str) -> Table:
+    """A history table by name: CommandHistory's columns and indexes, with
+    the index names following the table name"""
+    table = _segment_metadata.tables.get(name)
+    if table is None:
+        template = CommandHistory.__table__
+        table = Table(name, _segment_metadata, *(column._copy() for column in template.columns))
+        for index in template.indexes:
+            Index(
+                index.name.replace(template.name, name, 1),
+                *(table.c[column.name] for column in index.columns),
+            )
+    return table
+
+
+def history_table_names(connection) -> List[str]:
+    """Every table holding history rows: the segments (oldest first), the
+    pinned favorites and a legacy table not partitioned yet"""
+    names = [
+        row[0] for row in connection.exec_driver_sql(
+            "SELECT name FROM history_segments ORDER BY start"
+        )
+    ]
+    names.append(CommandHistory.__tablename__)
+    if inspect(connection).has_table(LEGACY_HISTORY_TABLE):
+        names.append(LEGACY_HISTORY_TABLE)
+    return names
+
+
+class CommandIndex(Base):
+    """Distinct commands for history search; ids are reassigned on each use,
+    so descending id order is most recently used first"""
+    __tablename__ = "command_index"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    command: Mapped[str] = mapped_column(String, nullable=False, unique=True)
+    directory: Mapped[str] = mapped_column(String, nullable=False, default="")
+    count: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    last_used: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+
+    __table_args__ = (
+        Index("ix_command_index_count", "count"),
+        Index("ix_command_index_lower", func.lower(command)),  # case-insensitive prefixes
+    )
+
+
+class HistoryStat(Base):
+    """Running history counters per base command, directory, hour, day and in total"""
+    __tablename__ = "history_stats"
+
+    kind: Mapped[str] = mapped_column(String, primary_key=True)
+    key: Mapped[str] = mapped_column(String, primary_key=True)
+    count: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    failures: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    duration_sum: Mapped[float] = mapped_column(Float, nullable=False, default=0.0)
+    histogram: Mapped[list] = mapped_column(JSON, nullable=False)
+    last_used: Mapped[datetime] = mapped_column(DateTime, nullable=True)
+
+
+# Indexes replaced by wider ones
+_RETIRED_INDEXES = ("ix_command_history_directory", "ix_command_history_is_favorite")
+
+# Trigram full-text index over command_index, kept in sync by triggers on
+# deletes and updates. New entries are added by their writer in one
+# INSERT ... SELECT per batch: FTS5 flushes its pending terms at every
+# statement, so a per-row insert trigger leaves a segment per row to merge.
+_SEARCH_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS command_search USING fts5(
+        command, directory, content='command_index', content_rowid='id', tokenize='trigram'
+    )""",
+    "DROP TRIGGER IF EXISTS command_index_ai",
+    """CREATE TRIGGER IF NOT EXISTS command_index_ad AFTER DELETE ON command_index BEGIN
+        INSERT INTO command_search(command_search, rowid, command, directory)
+        VALUES ('delete', old.id, old.command, old.directory);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS command_index_au AFTER UPDATE OF command, directory
+    ON command_index BEGIN
+        INSERT INTO command_search(command_search, rowid, command, directory)
+        VALUES ('delete', old.id, old.command, old.directory);
+        INSERT INTO command_search(rowid, command, directory)
+        VALUES (new.id, new.command, new.directory);
+    END""",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS command_search_terms USING fts5vocab(command_search, row)",
+]
 
 
 class CommandSequence(Base):
@@ -51,10 +218,90 @@ class CommandSequence(Base):
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
 
 
+# Columns added to the history tables after their first release
+_ADDED_COLUMNS = {
+    "base_command": "VARCHAR NOT NULL DEFAULT ''",
+    "output": "VARCHAR NOT NULL DEFAULT ''",
+    "output_hash": "VARCHAR NOT NULL DEFAULT ''",
+    "output_size": "INTEGER NOT NULL DEFAULT 0",
+}
+
+
+def lock_database(exclusive: bool = False, blocking: bool = True) -> Optional[IO]:
+    """Hold an advisory lock on the SQLite database until the returned file is
+    closed: the server holds it shared, offline writers (the history import
+    command) exclusively, as both keep counters and caches in memory.
+    Raises BlockingIOError if not ``blocking`` and the lock is taken; None
+    for other engines and in-memory databases."""
+    path = engine.url.database
+    if engine.dialect.name != "sqlite" or not path or path == ":memory:":
+        return None
+    lock = open(path + ".lock", "a")
+    try:
+        fcntl.flock(
+            lock, (fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH) | (0 if blocking else fcntl.LOCK_NB)
+        )
+    except OSError:
+        lock.close()
+        raise
+    return lock
+
+
 async def init_db():
     """Initialize database tables"""
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(_upgrade_schema)
+
+
+def _upgrade_schema(connection):
+    """Add the columns and indexes that tables created by older versions lack"""
+    for table_name in history_table_names(connection):
+        table = segment_table(table_name)
+        columns = {column["name"] for column in inspect(connection).get_columns(table_name)}
+        for name, ddl in _ADDED_COLUMNS.items():
+            if name not in columns:
+                connection.exec_driver_sql(f"ALTER TABLE {table_name} ADD COLUMN {name} {ddl}")
+        if "base_command" not in columns:
+            rows = connection.execute(select(table.c.id, table.c.command)).all()
+            if rows:
+                print(f"🔧 Normalising base commands of {len(rows)} history entries")
+                connection.execute(
+                    update(table).where(table.c.id == bindparam("row_id")).values(
+                        base_command=bindparam("base")
+                    ),
+                    [{"row_id": row.id, "base": base_command(row.command)} for row in rows],
+                )
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+    # Reflection skips expression indexes, so checkfirst cannot be used
+    for index in CommandIndex.__table__.indexes:
+        connection.execute(CreateIndex(index, if_not_exists=True))
+    for name in _RETIRED_INDEXES:
+        connection.exec_driver_sql(f"DROP INDEX IF EXISTS {name}")
+    if connection.dialect.name == "sqlite":
+        for ddl in _SEARCH_DDL:
+            connection.exec_driver_sql(ddl)
+        if connection.exec_driver_sql("SELECT 1 FROM command_index LIMIT 1").first() is None:
+            build_command_index(connection)
+
+
+def build_command_index(connection):
+    """(Re)build the distinct-command search index from the history tables"""
+    connection.exec_driver_sql("DELETE FROM command_index")
+    rows = " UNION ALL ".join(
+        f"SELECT command, directory, timestamp FROM {name}"
+        for name in history_table_names(connection)
+    )
+    result = connection.exec_driver_sql(
+        # The bare directory column comes from the row holding max(timestamp)
+        "INSERT INTO command_index (command, directory, count, last_used) "
+        f"SELECT command, directory, count(*), max(timestamp) FROM ({rows}) "
+        "GROUP BY command ORDER BY max(timestamp)"
+    )
+    connection.exec_driver_sql("INSERT INTO command_search(command_search) VALUES ('rebuild')")
+    if result.rowcount:
+        print(f"🔎 Indexed {result.rowcount} distinct commands for history search")
 
 
 async def get_session() -> AsyncSession:
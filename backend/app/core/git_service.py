@@ -0,0 +1,197 @@
+"""Cached git metadata (status and recent commits) per repository"""
+import asyncio
+import os
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.config import settings
+
+_FIELD = "\x1f"
+_RECORD = "\x1e"
+_LOG_FORMAT = _FIELD.join(("%H", "%an", "%ae", "%ai", "%s")) + _RECORD
+_LOG_FIELDS = ("hash", "author", "email", "date", "message")
+_LOG_DEPTH = 50  # commits fetched per log call; smaller limits are slices of it
+
+
+def _read_line(path: str) -> str:
+    try:
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            return f.readline().strip()
+    except OSError:
+        return ""
+
+
+def _stamp(path: str) -> Optional[Tuple[int, int]]:
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_ino
+
+
+class Repository:
+    """A work tree and its git directories, located without running git"""
+
+    def __init__(self, root: str, git_dir: str):
+        self.root = root
+        self.git_dir = git_dir
+        # Linked worktrees keep HEAD and index apart from the shared refs
+        common = _read_line(os.path.join(git_dir, "commondir"))
+        self.common_dir = os.path.normpath(os.path.join(git_dir, common)) if common else git_dir
+
+    @classmethod
+    def find(cls, path: str) -> Optional["Repository"]:
+        """The repository containing path (None outside one)"""
+        path = os.path.abspath(path)
+        while True:
+            dot_git = os.path.join(path, ".git")
+            if os.path.isdir(dot_git):
+                return cls(path, dot_git)
+            if os.path.isfile(dot_git):
+                # Submodules and worktrees: "gitdir: <path>"
+                line = _read_line(dot_git)
+                if line.startswith("gitdir: "):
+                    return cls(path, os.path.normpath(os.path.join(path, line[8:])))
+                return None
+            parent = os.path.dirname(path)
+            if parent == path:
+                return None
+            path = parent
+
+    def fingerprint(self) -> tuple:
+        """Modification stamps of HEAD, the index and the refs.
+
+        Git replaces these files by renaming a lock file over them, so any
+        commit, checkout, stage, fetch or branch update changes the stamp
+        of the file or of the directory it was renamed in.
+        """
+        head = _read_line(os.path.join(self.git_dir, "HEAD"))
+        paths = [
+            os.path.join(self.git_dir, "HEAD"),
+            os.path.join(self.git_dir, "index"),
+            os.path.join(self.common_dir, "packed-refs"),
+            os.path.join(self.common_dir, "refs", "heads"),
+        ]
+        if head.startswith("ref: "):
+            paths.append(os.path.join(self.common_dir, head[5:]))
+        return (head,) + tuple(_stamp(path) for path in paths)
+
+
+class GitService:
+    """Git status and log shared by every caller, with as few forks as possible.
+
+    Results are cached per repository and reused until its fingerprint
+    (HEAD, index, refs) changes, which costs a few stat calls instead of a
+    process. Status also depends on the work tree, which can change without
+    touching ``.git``: it is reused for at most ``status_ttl`` seconds, and
+    dropped when a terminal command finishes in the repository. Concurrent
+    callers share one git run, and at most ``max_processes`` run at a time.
+    """
+
+    def __init__(
+        self,
+        max_processes: Optional[int] = None,
+        status_ttl: Optional[float] = None,
+        timeout: Optional[float] = None,
+    ):
+        self.max_processes = max_processes or settings.git_max_processes
+        self.status_ttl = settings.git_status_ttl if status_ttl is None else status_ttl
+        self.timeout = timeout or settings.git_timeout
+        self._semaphore = asyncio.Semaphore(self.max_processes)
+        # (root, kind) -> (fingerprint, monotonic time, value)
+        self._cache: Dict[Tuple[str, str], Tuple[tuple, float, Any]] = {}
+        self._inflight: Dict[Tuple[str, str], asyncio.Future] = {}
+
+    async def status(self, path: str) -> str:
+        """``git status --short`` of the repository containing path ('' outside one)"""
+        repo = Repository.find(path)
+        if repo is None:
+            return ""
+        # --no-optional-locks: status would otherwise refresh the index,
+        # changing the fingerprint it is cached under
+        status = await self._cached(
+            repo, "status", self.status_ttl,
+            lambda: self._git(repo.root, "--no-optional-locks", "status", "--short"),
+        )
+        return status or ""
+
+    async def commits(self, path: str, limit: int = 10) -> List[Dict[str, Any]]:
+        """Most recent non-merge commits of the repository containing path"""
+        repo = Repository.find(path)
+        if repo is None:
+            return []
+        commits = await self._cached(repo, "log", None, lambda: self._log(repo.root))
+        return [dict(commit) for commit in (commits or [])[:limit]]
+
+    def invalidate(self, path: str):
+        """Forget cached results of the repository containing path"""
+        repo = Repository.find(path)
+        if repo is not None:
+            for kind in ("status", "log"):
+                self._cache.pop((repo.root, kind), None)
+
+    async def _cached(self, repo: Repository, kind: str, ttl: Optional[float], fetch):
+        key = (repo.root, kind)
+        fingerprint = repo.fingerprint()
+        entry = self._cache.get(key)
+        if entry is not None and entry[0] == fingerprint and (
+            ttl is None or time.monotonic() - entry[1] < ttl
+        ):
+            return entry[2]
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            return await asyncio.shield(inflight)
+
+        future = asyncio.ensure_future(fetch())
+        self._inflight[key] = future
+        try:
+            value = await asyncio.shield(future)
+        finally:
+            self._inflight.pop(key, None)
+        if value is not None:
+            # Stamped with the fingerprint taken before git ran, so changes
+            # made meanwhile are picked up by the next call
+            self._cache[key] = (fingerprint, time.monotonic(), value)
+        return value
+
+    async def _log(self, root: str) -> Optional[List[Dict[str, Any]]]:
+        output = await self._git(
+            root, "log", f"--max-count={_LOG_DEPTH}", f"--pretty=format:{_LOG_FORMAT}", "--no-merges"
+        )
+        if output is None:
+            return None
+        commits = []
+        for record in output.split(_RECORD):
+            fields = record.strip("\n").split(_FIELD)
+            if len(fields) == len(_LOG_FIELDS):
+                commit = dict(zip(_LOG_FIELDS, fields))
+                commit["short_hash"] = commit["hash"][:7]
+                commits.append(commit)
+        return commits
+
+    async def _git(self, root: str, *args: str) -> Optional[str]:
+        """Output of a git command run in root (None if it failed)"""
+        async with self._semaphore:
+            try:
+                process = await asyncio.create_subprocess_exec(
+                    "git", *args, cwd=root,
+                    stdin=asyncio.subprocess.DEVNULL,
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.DEVNULL,
+                )
+            except OSError:
+                return None
+            try:
+                stdout, _ = await asyncio.wait_for(process.communicate(), self.timeout)
+            except asyncio.TimeoutError:
+                process.kill()
+                await process.wait()
+                return None
+        if process.returncode != 0:
+            return None
+        return stdout.decode("utf-8", errors="replace")
+
+
+# Global instance
+git_service = GitService()
@@ -0,0 +1,87 @@
+"""Streaming command history export (NDJSON, CSV, JSON; optionally gzipped)"""
+import csv
+import io
+import json
+import zlib
+from datetime import datetime
+from typing import AsyncIterator, List, Optional
+
+from app.core.database import engine
+from app.core.history_segments import history_segments
+
+_BATCH = 1000  # rows read and encoded per chunk
+
+EXPORT_FIELDS = [
+    "id", "command", "exit_code", "duration_seconds", "cpu_percent", "memory_mb",
+    "timestamp", "directory", "is_favorite", "output_hash", "output_size"
+]
+
+# format -> (media type, file extension)
+EXPORT_FORMATS = {
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "csv": ("text/csv; charset=utf-8", "csv"),
+    "json": ("application/json", "json"),
+}
+
+
+def _local(value: Optional[datetime]) -> Optional[datetime]:
+    """Timestamps are stored as naive local time"""
+    if value is not None and value.tzinfo is not None:
+        return value.astimezone().replace(tzinfo=None)
+    return value
+
+
+def _encode(format: str, rows: List[dict], first: bool) -> str:
+    if format == "ndjson":
+        return "".join(json.dumps(row, ensure_ascii=False) + "\n" for row in rows)
+    if format == "json":
+        body = ",\n".join(json.dumps(row, ensure_ascii=False) for row in rows)
+        return ("" if first else ",\n") + body
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator="\n").writerows(
+        [row[field] for field in EXPORT_FIELDS] for row in rows
+    )
+    return buffer.getvalue()
+
+
+async def iter_export(
+    format: str = "ndjson",
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    compress: bool = False,
+) -> AsyncIterator[bytes]:
+    """Encode history rows oldest first as they are read from the database.
+
+    Rows are fetched through a server-side cursor ``_BATCH`` at a time and
+    each batch is encoded (and gzip-compressed on the fly) into one chunk,
+    so memory use does not depend on the size of the history. Only the
+    history segments overlapping [since, until) are read.
+    """
+    gzip = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+
+    def emit(text: str) -> bytes:
+        data = text.encode("utf-8")
+        return gzip.compress(data) if gzip else data
+
+    if format == "csv":
+        yield emit(",".join(EXPORT_FIELDS) + "\n")
+    elif format == "json":
+        yield emit("[\n")
+
+    first = True
+    async with engine.connect() as conn:
+        partitions = history_segments.stream(conn, EXPORT_FIELDS, _local(since), _local(until), _BATCH)
+        async for partition in partitions:
+            rows = [
+                {**row, "timestamp": row["timestamp"].isoformat(), "is_favorite": bool(row["is_favorite"])}
+                for row in partition
+            ]
+            chunk = emit(_encode(format, rows, first))
+            first = False
+            if chunk:
+                yield chunk
+
+    if format == "json":
+        yield emit("\n]\n")
+    if gzip:
+        yield gzip.flush()
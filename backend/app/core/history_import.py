@@ -0,0 +1,372 @@
+"""Bulk import of shell history files (bash, zsh extended history, fish)
+
+Usable from the API (``POST /api/history/import``) and from the command line:
+
+    python -m app.core.history_import ~/.bash_history ~/.zsh_history
+
+The command line writes the database directly, so it refuses to run while
+the server uses it; import through the API then.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import select, text
+
+from app.core.database import CommandIndex, base_command, engine, init_db
+from app.core.history_segments import history_segments
+from app.core.history_service import history_service
+
+_index = CommandIndex.__table__
+
+IMPORT_FORMATS = ("bash", "zsh", "fish")
+_BATCH = 50000  # new commands stored per transaction
+_CHUNK = 500  # keys per duplicate lookup
+_READ_SIZE = 1 << 20  # bytes read from a file at a time
+_ZSH_META = b"\x83"
+
+# (command, start time as epoch seconds or None, duration in seconds)
+Entry = Tuple[str, Optional[int], float]
+
+# Raw SQL compares timestamps as stored text, skipping per-row type processing
+_RANGE_SQL = "SELECT command, timestamp FROM {table} WHERE timestamp BETWEEN :low AND :high"
+
+
+def _stored_time(value: datetime) -> str:
+    """A timestamp as SQLAlchemy's SQLite DateTime type stores it"""
+    return value.isoformat(" ", "microseconds")
+
+
+def _decode(line: bytes) -> str:
+    return line.decode("utf-8", "replace")
+
+
+class _BashParser:
+    """One command per line; with HISTTIMEFORMAT set each command follows a
+    ``#<epoch>`` line and may span the lines up to the next one"""
+
+    def __init__(self):
+        self.stamp: Optional[int] = None
+        self.lines: List[bytes] = []
+
+    def feed(self, lines: List[bytes]) -> List[Entry]:
+        entries: List[Entry] = []
+        for line in lines:
+            if line[:1] == b"#" and line[1:].isdigit():
+                self._emit(entries)
+                self.stamp = int(line[1:])
+            elif self.stamp is not None:
+                self.lines.append(line)
+            elif line.strip():
+                entries.append((_decode(line), None, 0.0))
+        return entries
+
+    def finish(self) -> List[Entry]:
+        entries: List[Entry] = []
+        self._emit(entries)
+        return entries
+
+    def _emit(self, entries: List[Entry]):
+        if self.lines:
+            command = _decode(b"\n".join(self.lines))
+            if command.strip():
+                entries.append((command, self.stamp, 0.0))
+            self.lines = []
+
+
+def _unmetafy(line: bytes) -> bytes:
+    """Undo zsh's escaping of special bytes (0x83 followed by the byte XOR 32)"""
+    parts = line.split(_ZSH_META)
+    return parts[0] + b"".join(bytes((part[0] ^ 32,)) + part[1:] for part in parts[1:] if part)
+
+
+class _ZshParser:
+    """``: <start>:<elapsed>;<command>`` lines (EXTENDED_HISTORY) or plain
+    ones; a trailing backslash continues the command on the next line"""
+
+    def __init__(self):
+        self.parts: Optional[List[bytes]] = None
+        self.stamp: Optional[int] = None
+        self.elapsed = 0.0
+
+    def feed(self, lines: List[bytes]) -> List[Entry]:
+        entries: List[Entry] = []
+        for line in lines:
+            if _ZSH_META in line:
+                line = _unmetafy(line)
+            if self.parts is None:
+                self.parts, self.stamp, self.elapsed = [], None, 0.0
+                if line[:2] == b": ":
+                    head, found, rest = line.partition(b";")
+                    start, _, elapsed = head[2:].partition(b":")
+                    if found and start.isdigit() and elapsed.isdigit():
+                        self.stamp, self.elapsed, line = int(start), float(elapsed), rest
+            if line[-1:] == b"\\":
+                self.parts.append(line[:-1])
+                continue
+            self.parts.append(line)
+            self._emit(entries)
+        return entries
+
+    def finish(self) -> List[Entry]:
+        entries: List[Entry] = []
+        self._emit(entries)
+        return entries
+
+    def _emit(self, entries: List[Entry]):
+        if self.parts:
+            command = _decode(b"\n".join(self.parts))
+            if command.strip():
+                entries.append((command, self.stamp, self.elapsed))
+        self.parts = None
+
+
+def _fish_unescape(value: bytes) -> bytes:
+    if b"\\" not in value:
+        return value
+    return value.replace(b"\\\\", b"\0").replace(b"\\n", b"\n").replace(b"\0", b"\\")
+
+
+class _FishParser:
+    """``- cmd: <command>`` entries with an optional ``  when: <epoch>`` line"""
+
+    def __init__(self):
+        self.command: Optional[bytes] = None
+        self.stamp: Optional[int] = None
+
+    def feed(self, lines: List[bytes]) -> List[Entry]:
+        entries: List[Entry] = []
+        for line in lines:
+            if line[:7] == b"- cmd: ":
+                self._emit(entries)
+                self.command = _fish_unescape(line[7:])
+            elif line[:8] == b"  when: " and self.command is not None:
+                value = line[8:].strip()
+                if value.isdigit():
+                    self.stamp = int(value)
+        return entries
+
+    def finish(self) -> List[Entry]:
+        entries: List[Entry] = []
+        self._emit(entries)
+        return entries
+
+    def _emit(self, entries: List[Entry]):
+        if self.command is not None and self.command.strip():
+            entries.append((_decode(self.command), self.stamp, 0.0))
+        self.command, self.stamp = None, None
+
+
+_PARSERS = {"bash": _BashParser, "zsh": _ZshParser, "fish": _FishParser}
+
+
+def detect_format(line: bytes) -> str:
+    """Guess the history format from the first non-empty line"""
+    if line.startswith(b"- cmd:"):
+        return "fish"
+    if line[:2] == b": ":
+        head, found, _ = line.partition(b";")
+        start, _, elapsed = head[2:].partition(b":")
+        if found and start.isdigit() and elapsed.isdigit():
+            return "zsh"
+    return "bash"
+
+
+class HistoryImporter:
+    """Streams a shell history file into the history store.
+
+    Bytes are fed in chunks of any size and split into lines, which the
+    format's parser turns into commands as they arrive. Commands are
+    deduplicated on (command, start time), within the file and against
+    the stored history, and stored ``_BATCH`` at a time in one transaction
+    each. Commands without a start time (plain bash history) are dated
+    ``default_time`` and kept once per distinct command.
+    """
+
+    def __init__(self, format: str = "auto", directory: str = "/",
+                 default_time: Optional[datetime] = None):
+        if format != "auto" and format not in _PARSERS:
+            raise ValueError(f"Unknown history format: {format}")
+        self.format = format
+        self.directory = directory
+        self.default_time = default_time or datetime.now()
+        self._parser = None if format == "auto" else _PARSERS[format]()
+        self._partial = b""
+        self._pending: List[Entry] = []
+        self._seen: Set[Tuple[str, Optional[int]]] = set()
+        self._started = time.perf_counter()
+
+        # Counters
+        self.lines = 0
+        self.commands = 0
+        self.imported = 0
+        self.duplicates = 0
+
+    async def feed(self, chunk: bytes):
+        """Parse the complete lines in a chunk; store a batch when one is full"""
+        lines = (self._partial + chunk).split(b"\n")
+        self._partial = lines.pop()
+        self._parse(lines)
+        if len(self._pending) >= _BATCH:
+            await self._store()
+
+    async def finish(self) -> Dict[str, Any]:
+        """Parse what is left, store it and return the import summary"""
+        if self._partial:
+            self._parse([self._partial])
+            self._partial = b""
+        if self._parser is not None:
+            self._collect(self._parser.finish())
+        await self._store()
+        seconds = time.perf_counter() - self._started
+        return {
+            "format": self.format,
+            "lines": self.lines,
+            "commands": self.commands,
+            "imported": self.imported,
+            "duplicates": self.duplicates,
+            "seconds": round(seconds, 3),
+            "lines_per_second": round(self.lines / seconds) if seconds else 0,
+        }
+
+    def _parse(self, lines: List[bytes]):
+        self.lines += len(lines)
+        if self._parser is None:
+            first = next((line for line in lines if line.strip()), None)
+            if first is None:
+                return
+            self.format = detect_format(first)
+            self._parser = _PARSERS[self.format]()
+        self._collect(self._parser.feed(lines))
+
+    def _collect(self, entries: List[Entry]):
+        self.commands += len(entries)
+        seen = self._seen
+        for entry in entries:
+            key = entry[:2]
+            if key in seen:
+                self.duplicates += 1
+            else:
+                seen.add(key)
+                self._pending.append(entry)
+
+    async def _store(self):
+        entries, self._pending = self._pending, []
+        if not entries:
+            return
+        async with engine.connect() as conn:
+            stored, known = await _existing(conn, entries)
+
+        rows = []
+        for command, stamp, duration in entries:
+            if stamp is None:
+                if command in known:
+                    self.duplicates += 1
+                    continue
+                timestamp = self.default_time
+            else:
+                timestamp = datetime.fromtimestamp(stamp)
+                if (command, _stored_time(timestamp)) in stored:
+                    self.duplicates += 1
+                    continue
+            rows.append({
+                "command": command,
+                "base_command": base_command(command),
+                "exit_code": 0,
+                "duration_seconds": duration,
+                "cpu_percent": 0.0,
+                "memory_mb": 0.0,
+                "directory": self.directory,
+                "output": "",
+                "timestamp": timestamp,
+                "is_favorite": False,
+            })
+        await history_service.add_many(rows)
+        self.imported += len(rows)
+
+
+async def _existing(conn, entries: List[Entry]) -> Tuple[set, set]:
+    """(command, timestamp text) pairs already stored in the time range of
+    the timed entries (one index range scan per overlapping segment), and
+    the already known commands among untimed ones"""
+    stamps = [stamp for _, stamp, _ in entries if stamp is not None]
+    untimed = [command for command, stamp, _ in entries if stamp is None]
+    stored: set = set()
+    known: set = set()
+    if stamps:
+        low, high = datetime.fromtimestamp(min(stamps)), datetime.fromtimestamp(max(stamps))
+        await history_segments.ready(conn)
+        for table in history_segments.tables(low, high):
+            result = await conn.stream(text(_RANGE_SQL.format(table=table.name)), {
+                "low": _stored_time(low), "high": _stored_time(high),
+            })
+            async for partition in result.partitions(_BATCH):
+                stored.update(map(tuple, partition))
+    for i in range(0, len(untimed), _CHUNK):
+        rows = await conn.execute(
+            select(_index.c.command).where(_index.c.command.in_(untimed[i:i + _CHUNK]))
+        )
+        known.update(row.command for row in rows)
+    return stored, known
+
+
+async def import_file(path: str, format: str = "auto", directory: str = "/") -> Dict[str, Any]:
+    """Import one history file ("-" for stdin); untimed commands are dated by its mtime"""
+    if path == "-":
+        importer = HistoryImporter(format, directory)
+        source = sys.stdin.buffer
+    else:
+        mtime = datetime.fromtimestamp(os.path.getmtime(path))
+        importer = HistoryImporter(format, directory, default_time=mtime)
+        source = open(path, "rb")
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            chunk = await loop.run_in_executor(None, source.read, _READ_SIZE)
+            if not chunk:
+                break
+            await importer.feed(chunk)
+    finally:
+        if source is not sys.stdin.buffer:
+            source.close()
+    return await importer.finish()
+
+
+async def _main(args: argparse.Namespace) -> int:
+    await init_db()
+    try:
+        await history_service.start(exclusive=True)
+    except BlockingIOError:
+        print(
+            "⚠️  The server is using the history database; import through it instead:\n"
+            "    curl --data-binary @FILE http://HOST:PORT/api/history/import",
+            file=sys.stderr,
+        )
+        return 1
+    try:
+        for path in args.files:
+            summary = await import_file(os.path.expanduser(path), args.format, args.directory)
+            print(
+                f"📥 {path} ({summary['format']}): {summary['imported']} imported, "
+                f"{summary['duplicates']} duplicates, {summary['lines']} lines "
+                f"in {summary['seconds']}s ({summary['lines_per_second']} lines/s)"
+            )
+    finally:
+        await history_service.close()
+    return 0
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Import shell history files into the command history")
+    parser.add_argument("files", nargs="+", help="history files (- for stdin)")
+    parser.add_argument("--format", choices=("auto",) + IMPORT_FORMATS, default="auto")
+    parser.add_argument("--directory", default="/", help="directory recorded for imported commands")
+    sys.exit(asyncio.run(_main(parser.parse_args(argv))))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,345 @@
+"""Ranked prefix, substring and fuzzy search over command history"""
+from datetime import datetime
+from difflib import SequenceMatcher
+from typing import Any, Callable, Dict, List, Optional
+
+from sqlalchemy import bindparam, delete, func, insert, select, text, update
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from app.core.database import CommandIndex
+
+_index = CommandIndex.__table__
+_CANDIDATES = 200  # most recently used matches ranked per query
+_FUZZY_CANDIDATES = 100  # fuzzy scoring is costlier per candidate
+_FREQUENT = 100  # most used commands always considered as well
+_FUZZY_THRESHOLD = 0.6  # similarity a fuzzy match needs (0..1)
+_QUERY_TRIGRAMS = 3  # rarest query trigrams looked up in the index
+_CHUNK = 500  # bound parameters per IN list
+
+# Score multipliers per kind of match
+_MATCH_WEIGHT = {"prefix": 2.0, "substring": 1.0, "directory": 0.5, "fuzzy": 0.5}
+
+
+def _trigrams(value: str) -> set:
+    value = value.lower()
+    return {value[i:i + 3] for i in range(len(value) - 2)}
+
+
+def _phrase(value: str) -> str:
+    """An FTS5 string literal"""
+    return '"' + value.replace('"', '""') + '"'
+
+
+class _TermFrequencies:
+    """How many index entries contain each trigram, loaded once from the
+    fts5vocab table and then counted along as entries are added (deleted
+    entries are not subtracted; the counts only steer query planning)"""
+
+    def __init__(self):
+        self.counts: Optional[Dict[str, int]] = None
+
+    async def load(self, conn: AsyncConnection) -> Dict[str, int]:
+        if self.counts is None:
+            rows = await conn.execute(text("SELECT term, doc FROM command_search_terms"))
+            self.counts = dict(rows.all())
+        return self.counts
+
+    def add(self, entries: List[Dict[str, Any]]):
+        if self.counts is None:
+            return
+        for entry in entries:
+            for gram in _trigrams(entry["command"]) | _trigrams(entry["directory"]):
+                self.counts[gram] = self.counts.get(gram, 0) + 1
+
+    def reset(self):
+        self.counts = None
+
+
+_terms = _TermFrequencies()
+
+
+def _as_datetime(value) -> datetime:
+    """A timestamp read with raw SQL (SQLite returns its stored text)"""
+    return value if isinstance(value, datetime) else datetime.fromisoformat(value)
+
+
+def frecency(count: int, last_used: datetime, now: datetime) -> float:
+    """Use count weighted by how recently the command last ran"""
+    age = (now - last_used).total_seconds()
+    if age < 3600:
+        return count * 4.0
+    if age < 86400:
+        return count * 2.0
+    if age < 7 * 86400:
+        return count * 1.0
+    return count * 0.25
+
+
+# Raw SQL and driver-level inserts skip SQLAlchemy's per-row type
+# processing, which costs more than the statements on bulk imports
+_EXISTING_SQL = text(
+    "SELECT command, count, last_used FROM command_index WHERE command IN :commands"
+).bindparams(bindparam("commands", expanding=True))
+_INDEX_INSERT_SQL = "INSERT INTO command_index (command, directory, count, last_used) VALUES (?, ?, ?, ?)"
+
+# Entries inserted after last_id (ids only grow) into the full-text index
+_SEARCH_INSERT_SQL = text(
+    "INSERT INTO command_search(rowid, command, directory) "
+    "SELECT id, command, directory FROM command_index WHERE id > :last_id"
+)
+
+
+async def update_search_index(conn: AsyncConnection, rows: List[Dict[str, Any]]):
+    """Count newly stored history rows in the distinct-command index.
+
+    A command used more recently than its entry is deleted and inserted
+    again, so entry ids stay in order of last use; older rows (imports)
+    only add to the count. The inserted entries go into the full-text
+    index with one statement (see database._SEARCH_DDL).
+    """
+    latest: Dict[str, list] = {}
+    for row in rows:
+        entry = latest.get(row["command"])
+        if entry is None:
+            latest[row["command"]] = [1, row["timestamp"], row["directory"]]
+        else:
+            entry[0] += 1
+            if row["timestamp"] >= entry[1]:
+                entry[1], entry[2] = row["timestamp"], row["directory"]
+
+    moved: List[Dict[str, Any]] = []
+    replaced: List[str] = []
+    bumped: List[Dict[str, Any]] = []
+    commands = list(latest)
+    for i in range(0, len(commands), _CHUNK):
+        chunk = commands[i:i + _CHUNK]
+        existing = {
+            row.command: row for row in (await conn.execute(_EXISTING_SQL, {"commands": chunk})).all()
+        }
+        for command in chunk:
+            count, last_used, directory = latest[command]
+            old = existing.get(command)
+            if old is not None and last_used < _as_datetime(old.last_used):
+                bumped.append({"key": command, "added": count})
+                continue
+            if old is not None:
+                replaced.append(command)
+                count += old.count
+            moved.append({
+                "command": command, "directory": directory, "count": count, "last_used": last_used
+            })
+
+    for i in range(0, len(replaced), _CHUNK):
+        await conn.execute(delete(_index).where(_index.c.command.in_(replaced[i:i + _CHUNK])))
+    if len(moved) > len(replaced):
+        replaced_set = set(replaced)
+        _terms.add([entry for entry in moved if entry["command"] not in replaced_set])
+    if moved:
+        moved.sort(key=lambda row: row["last_used"])
+        last_id = await conn.scalar(select(func.max(_index.c.id))) or 0
+        if conn.dialect.name == "sqlite":
+            await conn.exec_driver_sql(_INDEX_INSERT_SQL, [
+                (entry["command"], entry["directory"], entry["count"],
+                 entry["last_used"].isoformat(" ", "microseconds"))
+                for entry in moved
+            ])
+            await conn.execute(_SEARCH_INSERT_SQL, {"last_id": last_id})
+        else:
+            await conn.execute(insert(_index), moved)
+    if bumped:
+        await conn.execute(
+            update(_index)
+            .where(_index.c.command == bindparam("key"))
+            .values(count=_index.c.count + bindparam("added")),
+            bumped,
+        )
+
+
+async def remove_from_search_index(conn: AsyncConnection, counts: Dict[str, int]):
+    """Uncount deleted history rows (command -> rows deleted); entries left
+    without rows are removed"""
+    if not counts:
+        return
+    await conn.execute(
+        update(_index)
+        .where(_index.c.command == bindparam("key"))
+        .values(count=_index.c.count - bindparam("removed")),
+        [{"key": command, "removed": count} for command, count in counts.items()],
+    )
+    await conn.execute(delete(_index).where(_index.c.count <= 0))
+
+
+# Raw SQL skips per-row type processing, which dominates at these sizes
+_MATCH_SQL = text(
+    "SELECT command, directory, count, last_used FROM command_index WHERE id IN ("
+    "SELECT rowid FROM command_search WHERE command_search MATCH :match "
+    "ORDER BY rowid DESC LIMIT :limit) ORDER BY id DESC"
+)
+_MATCH_WINDOW_SQL = text(
+    "SELECT id, command, directory, count, last_used FROM command_index WHERE id IN ("
+    "SELECT rowid FROM command_search WHERE command_search MATCH :match AND rowid < :before "
+    "ORDER BY rowid DESC LIMIT :limit) ORDER BY id DESC"
+)
+_FREQUENT_SQL = text(
+    "SELECT command, directory, count, last_used FROM command_index "
+    "ORDER BY count DESC LIMIT :limit"
+)
+# Case-insensitive through ix_command_index_lower, like the trigram index
+_PREFIX_SQL = text(
+    "SELECT command, directory, count, last_used FROM command_index "
+    "WHERE lower(command) >= :low AND lower(command) < :high LIMIT :limit"
+)
+
+
+def _similarity(needle: str, grams: set, command: str) -> float:
+    """How closely a command resembles a (lowercased) query.
+
+    The better of the share of the query's trigrams the command contains
+    (typos inside a longer command) and the edit similarity to the
+    command's start (typos while typing it, including transpositions),
+    which is only computed when the first character matches.
+    """
+    shared = len(grams & _trigrams(command)) / len(grams)
+    if shared >= _FUZZY_THRESHOLD or command[:1] != needle[:1]:
+        return shared
+    matcher = SequenceMatcher(None, needle, command[:len(needle)], autojunk=False)
+    if matcher.real_quick_ratio() < _FUZZY_THRESHOLD or matcher.quick_ratio() < _FUZZY_THRESHOLD:
+        return shared
+    return max(shared, matcher.ratio())
+
+
+def reset_term_frequencies():
+    """Forget the trigram counts (after the index was rebuilt)"""
+    _terms.reset()
+
+
+async def _substring_match(conn: AsyncConnection, needle: str) -> Optional[str]:
+    """FTS5 query for entries that may contain needle: all of its rarest
+    trigrams, which is far cheaper than a phrase query when the other
+    trigrams are common (hits still have to be checked). None when some
+    trigram occurs nowhere, so nothing can match."""
+    counts = await _terms.load(conn)
+    rarest = sorted(_trigrams(needle), key=lambda gram: counts.get(gram, 0))[:_QUERY_TRIGRAMS]
+    if counts.get(rarest[0], 0) == 0:
+        return None
+    return "(" + " AND ".join(_phrase(gram) for gram in rarest) + ")"
+
+
+async def _checked_hits(conn: AsyncConnection, match: str, accept: Callable[[Any], bool],
+                        limit: int, window: int) -> list:
+    """Index entries hit by an FTS5 query that pass accept, most recently
+    used first. Hits only contain the looked-up trigrams, so they are
+    checked, and further (growing) windows are read until ``limit`` pass
+    or the hits run out."""
+    hits = []
+    before = 2 ** 63 - 1
+    while True:
+        rows = (await conn.execute(_MATCH_WINDOW_SQL, {
+            "match": match, "before": before, "limit": window
+        })).all()
+        hits.extend(row for row in rows if accept(row))
+        if len(hits) >= limit or len(rows) < window:
+            return hits
+        before = rows[-1].id
+        window *= 2
+
+
+async def matching_commands(conn: AsyncConnection, query: str, limit: int) -> List[str]:
+    """The most recently used distinct commands containing query (case-insensitive)"""
+    if len(query) >= 3 and conn.dialect.name == "sqlite":
+        match = await _substring_match(conn, query)
+        if match is None:
+            return []
+        needle = query.lower()
+        rows = await _checked_hits(
+            conn, "command : " + match, lambda row: needle in row.command.lower(),
+            limit, max(limit * 2, _CANDIDATES),
+        )
+        return [row.command for row in rows[:limit]]
+    rows = await conn.execute(
+        select(_index.c.command)
+        .where(_index.c.command.contains(query, autoescape=True))
+        .order_by(_index.c.id.desc())
+        .limit(limit)
+    )
+    return [row.command for row in rows.all()]
+
+
+async def search_commands(conn: AsyncConnection, query: str, limit: int = 20) -> List[Dict[str, Any]]:
+    """Distinct commands matching query, ranked by match quality and frecency.
+
+    Queries of three or more characters match substrings of the command
+    or its last directory through the trigram index (reading on past
+    trigram hits that do not contain the query until ``limit`` do), then
+    fall back to fuzzy matching (shared trigrams or a close edit) when
+    exact matches run short; shorter queries match command prefixes. All
+    matching is case-insensitive. Only the most recently used matches of
+    each kind and the ``_FREQUENT`` most used commands are ranked.
+    """
+    needle = query.strip()
+    if not needle:
+        return []
+    lowered = needle.lower()
+    fts = conn.dialect.name == "sqlite"
+    found: Dict[str, Dict[str, Any]] = {}
+
+    def rank(rows, kind_of):
+        now = datetime.now()
+        for row in rows:
+            if row.command in found:
+                continue
+            kind, quality = kind_of(row)
+            if kind is None:
+                continue
+            last_used = _as_datetime(row.last_used)
+            found[row.command] = {
+                "command": row.command,
+                "directory": row.directory,
+                "count": row.count,
+                "last_used": last_used.isoformat(),
+                "match": kind,
+                "score": round(
+                    frecency(row.count, last_used, now) * _MATCH_WEIGHT[kind] * quality, 4
+                ),
+            }
+
+    def exact_kind(row):
+        command = row.command.lower()
+        if command.startswith(lowered):
+            return "prefix", 1.0
+        if lowered in command:
+            return "substring", 1.0
+        if lowered in row.directory.lower():
+            return "directory", 1.0
+        return None, 0.0
+
+    frequent = (await conn.execute(_FREQUENT_SQL, {"limit": _FREQUENT})).all()
+    if len(needle) >= 3 and fts:
+        match = await _substring_match(conn, lowered)
+        rows = []
+        if match is not None:
+            rows = await _checked_hits(
+                conn, match, lambda row: exact_kind(row)[0] is not None, limit, _CANDIDATES
+            )
+    else:
+        rows = (await conn.execute(
+            _PREFIX_SQL, {"low": lowered, "high": lowered + "\U0010ffff", "limit": _CANDIDATES}
+        )).all()
+    rank(rows + frequent, exact_kind)
+
+    grams = _trigrams(needle)
+    if len(found) < limit and grams and fts:
+        def fuzzy_kind(row):
+            quality = _similarity(lowered, grams, row.command[:256].lower())
+            return ("fuzzy", quality ** 3) if quality >= _FUZZY_THRESHOLD else (None, 0.0)
+
+        match = "command : (" + " OR ".join(_phrase(gram) for gram in sorted(grams)) + ")"
+        rows = await conn.execute(_MATCH_SQL, {"match": match, "limit": _FUZZY_CANDIDATES})
+        rank(rows.all() + frequent, fuzzy_kind)
+
+    # Exact matches first, each group by score
+    return sorted(
+        found.values(),
+        key=lambda result: (result["match"] != "fuzzy", result["score"]),
+        reverse=True,
+    )[:limit]
@@ -0,0 +1,217 @@
+"""Time-partitioned command history: one table per period plus pinned favorites"""
+import bisect
+from datetime import datetime, timedelta
+from typing import Any, AsyncIterator, Dict, Iterable, List, NamedTuple, Optional
+
+from sqlalchemy import Table, delete, func, insert, inspect, select
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from app.config import settings
+from app.core.database import CommandHistory, HistorySegment, LEGACY_HISTORY_TABLE, segment_table
+
+_pinned = CommandHistory.__table__
+_registry = HistorySegment.__table__
+_COLUMNS = [column.name for column in _pinned.columns]
+_ORIGIN = datetime(1970, 1, 5)  # a Monday, so weekly segments start on Mondays
+
+
+class Segment(NamedTuple):
+    name: str
+    start: datetime
+    end: datetime  # exclusive
+
+    @property
+    def table(self) -> Table:
+        return segment_table(self.name)
+
+
+class HistorySegments:
+    """Registry of the history segments.
+
+    Each period of ``days`` days (aligned on Mondays for weekly segments)
+    gets its own table, created when the first command of the period is
+    stored, so retention drops whole tables instead of deleting rows and
+    a time range query only opens the segments it overlaps. Favorites in
+    a dropped segment are moved to the pinned table first; they rejoin a
+    segment if one is created for their period again. Segments keep the
+    period they were created with if ``history_segment_days`` changes.
+
+    The in-memory list only holds committed segments: create them with
+    ``create`` in a transaction of their own, then ``register`` them.
+    """
+
+    def __init__(self, days: Optional[int] = None):
+        self.days = days or settings.history_segment_days
+        self.segments: List[Segment] = []  # oldest first
+        self._starts: List[datetime] = []
+        self.loaded = False
+
+        # Counters
+        self.created = 0
+        self.dropped = 0
+
+    def load(self, connection):
+        """Read the registry (sync; run through ``run_sync``)"""
+        rows = connection.execute(select(_registry).order_by(_registry.c.start)).all()
+        self.segments = [Segment(row.name, row.start, row.end) for row in rows]
+        self._starts = [segment.start for segment in self.segments]
+        self.loaded = True
+
+    async def ready(self, conn: AsyncConnection):
+        """Load the registry unless it is loaded"""
+        if not self.loaded:
+            await conn.run_sync(self.load)
+
+    def invalidate(self):
+        """Reload the registry on next use (a transaction that changed it failed)"""
+        self.loaded = False
+
+    def find(self, timestamp: datetime) -> Optional[Segment]:
+        i = bisect.bisect_right(self._starts, timestamp) - 1
+        if i >= 0 and timestamp < self.segments[i].end:
+            return self.segments[i]
+        return None
+
+    def overlapping(self, since: Optional[datetime] = None,
+                    until: Optional[datetime] = None) -> List[Segment]:
+        """Segments holding times in [since, until], oldest first"""
+        first = 0 if since is None else bisect.bisect_right(self._starts, since) - 1
+        last = len(self.segments) if until is None else bisect.bisect_right(self._starts, until)
+        return [
+            segment for segment in self.segments[max(first, 0):last]
+            if since is None or segment.end > since
+        ]
+
+    def tables(self, since: Optional[datetime] = None, until: Optional[datetime] = None,
+               newest_first: bool = False) -> List[Table]:
+        """The tables to read for [since, until]: overlapping segments and the pinned table"""
+        segments = self.overlapping(since, until)
+        if newest_first:
+            segments.reverse()
+        return [segment.table for segment in segments] + [_pinned]
+
+    def create(self, connection, timestamps: Iterable[datetime]) -> List[Segment]:
+        """Create the segments missing for timestamps (sync; run through
+        ``run_sync``, then ``register`` the result once committed)"""
+        created: List[Segment] = []
+        segments = list(self.segments)
+        starts = list(self._starts)
+        period = timedelta(days=self.days)
+        for timestamp in sorted(timestamps):
+            i = bisect.bisect_right(starts, timestamp)
+            if i and timestamp < segments[i - 1].end:
+                continue
+            start = _ORIGIN + (timestamp - _ORIGIN) // period * period
+            end = start + period
+            # Stay clear of segments created with another period length
+            if i:
+                start = max(start, segments[i - 1].end)
+            if i < len(segments):
+                end = min(end, segments[i].start)
+            segment = Segment(f"{LEGACY_HISTORY_TABLE}_{start:%Y%m%d}", start, end)
+            table = segment.table
+            table.create(connection)
+            connection.execute(insert(_registry).values(name=segment.name, start=start, end=end))
+            # Favorites pinned when this period's last segment was dropped rejoin it
+            period_rows = (_pinned.c.timestamp >= start, _pinned.c.timestamp < end)
+            moved = connection.execute(
+                insert(table).from_select(_COLUMNS, select(*_pinned.c).where(*period_rows))
+            )
+            if moved.rowcount:
+                connection.execute(delete(_pinned).where(*period_rows))
+            segments.insert(i, segment)
+            starts.insert(i, start)
+            created.append(segment)
+        return created
+
+    def register(self, created: List[Segment]):
+        for segment in created:
+            i = bisect.bisect_right(self._starts, segment.start)
+            self.segments.insert(i, segment)
+            self._starts.insert(i, segment.start)
+            self.created += 1
+
+    def drop(self, connection, segment: Segment):
+        """Drop a segment's table (sync). It leaves the in-memory list at
+        once, so no reader opens it while the drop commits."""
+        if segment in self.segments:
+            i = self.segments.index(segment)
+            del self.segments[i]
+            del self._starts[i]
+        segment.table.drop(connection)
+        connection.execute(delete(_registry).where(_registry.c.name == segment.name))
+        self.dropped += 1
+
+    def partition_legacy(self, connection) -> int:
+        """Move the rows of the unpartitioned history table into segments
+        and drop it (sync); returns the number of rows moved"""
+        if not inspect(connection).has_table(LEGACY_HISTORY_TABLE):
+            return 0
+        self.load(connection)
+        legacy = segment_table(LEGACY_HISTORY_TABLE)
+        moved = 0
+        timestamp = connection.scalar(select(func.min(legacy.c.timestamp)))
+        while timestamp is not None:
+            self.register(self.create(connection, [timestamp]))
+            segment = self.find(timestamp)
+            moved += connection.execute(
+                insert(segment.table).from_select(
+                    _COLUMNS,
+                    select(*(legacy.c[name] for name in _COLUMNS)).where(
+                        legacy.c.timestamp >= segment.start, legacy.c.timestamp < segment.end
+                    ),
+                )
+            ).rowcount
+            # Skip straight to the next period that has rows
+            timestamp = connection.scalar(
+                select(func.min(legacy.c.timestamp)).where(legacy.c.timestamp >= segment.end)
+            )
+        legacy.drop(connection)
+        self.invalidate()
+        print(f"🗂️  Partitioned {moved} history entries into {len(self.segments)} segments")
+        return moved
+
+    async def stream(self, conn: AsyncConnection, columns: List[str],
+                     since: Optional[datetime] = None, until: Optional[datetime] = None,
+                     batch: int = 1000) -> AsyncIterator[List[Dict[str, Any]]]:
+        """History rows in [since, until) oldest first, in batches of mappings;
+        only the segments overlapping the range are read"""
+        def query(table: Table):
+            statement = select(*(table.c[name] for name in columns))
+            if since is not None:
+                statement = statement.where(table.c.timestamp >= since)
+            if until is not None:
+                statement = statement.where(table.c.timestamp < until)
+            return statement.order_by(table.c.timestamp, table.c.id)
+
+        await self.ready(conn)
+        # Pinned rows never fall in the period of an existing segment:
+        # they go between the segments they are older and newer than
+        pinned = list((await conn.execute(query(_pinned))).mappings())
+        position = 0
+        for segment in self.overlapping(since, until):
+            end = position
+            while end < len(pinned) and pinned[end]["timestamp"] < segment.start:
+                end += 1
+            if end > position:
+                yield pinned[position:end]
+                position = end
+            result = await conn.stream(query(segment.table))
+            async for partition in result.mappings().partitions(batch):
+                yield partition
+        if position < len(pinned):
+            yield pinned[position:]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "segments": len(self.segments),
+            "segment_days": self.days,
+            "oldest": self.segments[0].start.isoformat() if self.segments else None,
+            "newest": self.segments[-1].end.isoformat() if self.segments else None,
+            "created": self.created,
+            "dropped": self.dropped,
+        }
+
+
+# Global instance
+history_segments = HistorySegments()
@@ -1,160 +1,707 @@
+import base64
 import json
 import os
-from datetime import datetime
-from typing import List, Dict, Any, Optional
+import re
+from datetime import datetime, timedelta
+from typing import List, Dict, Any, Optional, Tuple, Union
 from pathlib import Path
-import subprocess
 import asyncio
+import time
+
+from sqlalchemy import and_, case, delete, func, insert, select, tuple_, update
+
+from app.config import settings
+from app.core.database import CommandHistory, HistorySequence, base_command, engine, lock_database
+from app.core.git_service import git_service
+from app.core.output_store import blob_key, output_store
+from app.core.history_segments import history_segments
+from app.core.local_completion import local_completer
+from app.core.history_stats import history_stats
+from app.core.history_search import (
+    matching_commands, remove_from_search_index, search_commands, update_search_index
+)
+
+_pinned = CommandHistory.__table__
+_LEGACY_LOG_RE = re.compile(r"^log\.(\d+)\.jsonl$")
+_IMPORT_BATCH = 10000
+_SEARCH_COMMANDS = 1000  # matching commands listed in a search page query at most
+_COLUMNS = [column.name for column in _pinned.columns]
+_DEFAULTS = {
+    column.name: column.default.arg
+    for column in _pinned.columns if column.default is not None and column.default.is_scalar
+}
+# Driver-level insert: SQLAlchemy's per-row parameter processing costs more
+# than SQLite's insert itself for large batches
+_INSERT_SQL = "INSERT INTO {table} (" + ", ".join(_COLUMNS) + ") VALUES (" + ", ".join("?" * len(_COLUMNS)) + ")"
+_FIELDS = [(name, _DEFAULTS.get(name)) for name in _COLUMNS]
+_TIMESTAMP = _COLUMNS.index("timestamp")
+# Columns read from rows that are about to be deleted, to uncount them
+_FORGET_COLUMNS = ["command", "base_command", "directory", "exit_code", "duration_seconds", "timestamp"]
+
 
 class HistoryService:
-    def __init__(self, data_file: str = "data.json"):
-        self.data_file = Path(data_file)
-        self.ensure_data_file()
-    
-    def ensure_data_file(self):
-        """Ensure the data.json file exists with proper structure"""
-        if not self.data_file.exists():
-            initial_data = {
-                "commands": [],
-                "git_commits": [],
-                "sessions": [],
-                "favorites": [],
-                "metadata": {
-                    "created": datetime.now().isoformat(),
-                    "last_updated": datetime.now().isoformat(),
-                    "version": "1.0.0"
-                }
-            }
-            self.save_data(initial_data)
-    
-    def load_data(self) -> Dict[str, Any]:
-        """Load data from JSON file"""
-        try:
-            with open(self.data_file, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
-            self.ensure_data_file()
-            return self.load_data()
-    
-    def save_data(self, data: Dict[str, Any]):
-        """Save data to JSON file"""
-        data["metadata"]["last_updated"] = datetime.now().isoformat()
-        with open(self.data_file, 'w', encoding='utf-8') as f:
-            json.dump(data, f, indent=2, ensure_ascii=False)
-    
-    def add_command(self, command: str, exit_code: int = 0, duration: float = 0.0, 
-                   directory: str = "/", output: str = "") -> Dict[str, Any]:
-        """Add a command to history"""
-        data = self.load_data()
-        
-        command_record = {
-            "id": len(data["commands"]) + 1,
+    """Command history stored in SQLite.
+
+    New commands are queued for a single writer task, which waits
+    ``history_commit_window_ms`` for more to arrive and inserts the whole
+    group with one ``executemany`` in one transaction (group commit); ids
+    come from the database sequence when the group is written. Rows go to the time segment of their timestamp (see
+    history_segments); reads open only the segments they need, and
+    retention drops the segments that ended more than ``max_history_days``
+    ago. ``start`` must run before commands are added: it imports legacy
+    history and seeds the id sequence.
+    """
+
+    def __init__(self, data_file: str = "data.json", data_dir: Optional[str] = None):
+        self.data_file = Path(data_file)  # legacy single-file store
+        self.legacy_dir = Path(data_dir or settings.history_dir)  # legacy snapshot + log store
+        self._git_commits: List[Dict[str, Any]] = []
+        self._database_lock = None  # shared lock keeping offline importers out
+
+        # Write-behind state
+        self._queue: List[Dict[str, Any]] = []
+        self._outputs: Dict[str, bytes] = {}  # output store key -> content of queued rows
+        self._waiters: List[asyncio.Future] = []
+        self._inflight: Optional[asyncio.Future] = None
+        self._queued = asyncio.Event()
+        self._writer: Optional[asyncio.Task] = None
+        self._retention: Optional[asyncio.Task] = None
+        self._write_lock = asyncio.Lock()  # serialises row inserts and segment drops
+
+        # Counters
+        self.commits = 0
+        self.committed_ops = 0
+
+    async def start(self, exclusive: bool = False):
+        """Partition and import legacy history, load statistics, seed the id
+        sequence, apply retention and start the writer.
+
+        ``exclusive`` (offline imports) raises BlockingIOError while a server
+        uses the database; the server waits for such imports instead.
+        """
+        if self._database_lock is None:
+            loop = asyncio.get_running_loop()
+            try:
+                self._database_lock = lock_database(exclusive, blocking=False)
+            except BlockingIOError:
+                if exclusive:
+                    raise
+                print("⏳ Waiting for a history import to finish...")
+                self._database_lock = await loop.run_in_executor(None, lock_database)
+        async with engine.begin() as conn:
+            await conn.run_sync(history_segments.partition_legacy)
+        async with engine.begin() as conn:
+            await history_stats.load(conn)
+        async with engine.begin() as conn:
+            await _seed_ids(conn)
+        await self._import_legacy()
+        await self.enforce_retention()
+        if self._writer is None or self._writer.done():
+            self._writer = asyncio.create_task(self._write_behind())
+        if self._retention is None or self._retention.done():
+            self._retention = asyncio.create_task(self._enforce_retention_periodically())
+
+    async def close(self):
+        """Write everything still queued and stop the background tasks"""
+        await self.flush()
+        for task in (self._writer, self._retention):
+            if task:
+                task.cancel()
+        self._writer = self._retention = None
+        await engine.dispose()
+        if self._database_lock is not None:
+            self._database_lock.close()
+            self._database_lock = None
+
+    async def flush(self):
+        """Wait until every command added so far has been committed"""
+        if self._queue and self._writer is not None and not self._writer.done():
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            await waiter
+        elif self._inflight is not None:
+            await asyncio.shield(self._inflight)
+
+    async def _write_behind(self):
+        """Group-commit queued commands: one executemany per window"""
+        window = settings.history_commit_window_ms / 1000
+        while True:
+            await self._queued.wait()
+            if window:
+                await asyncio.sleep(window)
+            self._queued.clear()
+            batch, self._queue = self._queue, []
+            outputs, self._outputs = self._outputs, {}
+            waiters, self._waiters = self._waiters, []
+            if not batch:
+                continue
+
+            self._inflight = asyncio.ensure_future(self._insert(batch, outputs))
+            try:
+                await self._inflight
+                error = None
+            except Exception as e:
+                print(f"History write error: {e}")
+                error = e
+            finally:
+                self._inflight = None
+            self.commits += 1
+            self.committed_ops += len(batch)
+
+            for waiter in waiters:
+                if not waiter.done():
+                    if error:
+                        waiter.set_exception(error)
+                    else:
+                        waiter.set_result(None)
+
+    async def _insert(self, rows: List[Dict[str, Any]], outputs: Optional[Dict[str, bytes]] = None):
+        if outputs:
+            # Output blobs go first, so stored rows never point at missing ones
+            loop = asyncio.get_running_loop()
+            try:
+                await loop.run_in_executor(None, output_store.put_many, list(outputs.values()))
+            except OSError as e:
+                print(f"⚠️  Could not store command output: {e}")
+        # One writer at a time: segments are created (and dropped by
+        # retention) against the registry as the writer last saw it
+        async with self._write_lock:
+            try:
+                await self._create_segments(rows)
+                async with engine.begin() as conn:
+                    first_id = await _reserve_ids(conn, len(rows))
+                    for i, row in enumerate(rows):
+                        row["id"] = first_id + i
+                    for i in range(0, len(rows), _IMPORT_BATCH):
+                        await self._store(conn, rows[i:i + _IMPORT_BATCH])
+                    await history_stats.record(conn, rows)
+            except Exception:
+                # Counters and registry entries of the failed transaction were rolled back
+                history_stats.invalidate()
+                history_segments.invalidate()
+                raise
+
+    async def add_many(self, rows: List[Dict[str, Any]]):
+        """Store complete history rows (bulk import) in one transaction; ids are assigned here"""
+        if rows:
+            await self._insert(rows)
+
+    @staticmethod
+    async def _create_segments(rows: List[Dict[str, Any]]):
+        """Create and commit the segments rows fall in, ahead of the rows:
+        readers only ever see segments whose table exists"""
+        async with engine.connect() as conn:
+            await history_segments.ready(conn)
+        missing = {
+            row["timestamp"] for row in rows if history_segments.find(row["timestamp"]) is None
+        }
+        if missing:
+            async with engine.begin() as conn:
+                # Take the write lock (an empty reservation), then re-read the
+                # registry: another process may have created these segments
+                await _reserve_ids(conn, 0)
+                await conn.run_sync(history_segments.load)
+                created = await conn.run_sync(history_segments.create, missing)
+            history_segments.register(created)
+
+    @staticmethod
+    async def _store(conn, rows: List[Dict[str, Any]]):
+        """Insert rows into their segments and update the search index"""
+        groups: Dict[str, List[Dict[str, Any]]] = {}
+        segment = None
+        for row in rows:
+            if segment is None or not segment.start <= row["timestamp"] < segment.end:
+                segment = history_segments.find(row["timestamp"])
+            groups.setdefault(segment.name, []).append(row)
+        for table_name, group in groups.items():
+            if conn.dialect.name == "sqlite":
+                # Timestamps in the text format of SQLAlchemy's SQLite DateTime
+                await conn.exec_driver_sql(
+                    _INSERT_SQL.format(table=table_name), [_driver_values(row) for row in group]
+                )
+            else:
+                await conn.execute(insert(history_segments.find(group[0]["timestamp"]).table), group)
+        await update_search_index(conn, rows)
+
+    def writer_stats(self) -> Dict[str, Any]:
+        """Group commit counters"""
+        return {
+            "engine": engine.dialect.name,
+            "fsync_policy": settings.history_fsync,
+            "commits": self.commits,
+            "committed_ops": self.committed_ops,
+            "ops_per_commit": round(self.committed_ops / self.commits, 2) if self.commits else 0,
+            "queued_ops": len(self._queue),
+            "partitions": history_segments.stats(),
+        }
+
+    def add_command(self, command: str, exit_code: int = 0, duration: float = 0.0,
+                   directory: str = "/", output: Union[str, bytes] = "",
+                   timestamp: Optional[datetime] = None,
+                   cpu_percent: float = 0.0, memory_mb: float = 0.0) -> Dict[str, Any]:
+        """Add a command to history (committed by the background writer).
+
+        The full output goes to the output store; the row keeps its key and size.
+        Returns the queued row, which gets its id when it is written (see
+        ``record_command``).
+        """
+        if isinstance(output, str):
+            output = output.encode("utf-8")
+        output_hash = blob_key(output) if output else ""
+        if output:
+            self._outputs[output_hash] = output
+        row = {
+            "id": None,
             "command": command,
+            "base_command": base_command(command),
             "exit_code": exit_code,
             "duration_seconds": duration,
+            "cpu_percent": cpu_percent,
+            "memory_mb": memory_mb,
             "directory": directory,
-            "output": output[:500] if output else "",  # Truncate output
-            "timestamp": datetime.now().isoformat(),
+            "output": "",
+            "output_hash": output_hash,
+            "output_size": len(output),
+            "timestamp": timestamp or datetime.now(),
             "is_favorite": False
         }
-        
-        data["commands"].append(command_record)
-        
-        # Keep only last 1000 commands
-        if len(data["commands"]) > 1000:
-            data["commands"] = data["commands"][-1000:]
-        
-        self.save_data(data)
-        return command_record
-    
-    def get_commands(self, limit: int = 100, search: Optional[str] = None) -> List[Dict[str, Any]]:
-        """Get command history with optional search"""
-        data = self.load_data()
-        commands = data["commands"]
-        
-        if search:
-            commands = [cmd for cmd in commands if search.lower() in cmd["command"].lower()]
-        
-        return commands[-limit:] if limit else commands
-    
-    def get_git_commits(self, limit: int = 10, repo_path: str = ".") -> List[Dict[str, Any]]:
-        """Get recent git commits"""
-        try:
-            # Get git log in JSON format
-            cmd = [
-                "git", "log", f"--max-count={limit}", 
-                "--pretty=format:{\"hash\":\"%H\",\"author\":\"%an\",\"email\":\"%ae\",\"date\":\"%ai\",\"message\":\"%s\"}",
-                "--no-merges"
-            ]
-            
-            result = subprocess.run(
-                cmd, cwd=repo_path, capture_output=True, text=True, timeout=10
+
+        self._queue.append(row)
+        self._queued.set()
+        local_completer.record(command, row["timestamp"])
+        return row
+
+    async def record_command(self, **kwargs) -> Dict[str, Any]:
+        """Add a command and wait until it is committed; returns it with its id"""
+        row = self.add_command(**kwargs)
+        await self.flush()
+        return self._to_dict(row)
+
+    @staticmethod
+    def _to_dict(row) -> Dict[str, Any]:
+        """API representation of a history row"""
+        row = dict(row._mapping) if hasattr(row, "_mapping") else row
+        return {
+            "id": row["id"],
+            "command": row["command"],
+            "base_command": row["base_command"],
+            "exit_code": row["exit_code"],
+            "duration_seconds": row["duration_seconds"],
+            "cpu_percent": row["cpu_percent"],
+            "memory_mb": row["memory_mb"],
+            "directory": row["directory"],
+            "output": row["output"],
+            "output_hash": row["output_hash"],
+            "output_size": row["output_size"],
+            "timestamp": row["timestamp"].isoformat(),
+            "is_favorite": bool(row["is_favorite"])
+        }
+
+    async def get_commands(self, limit: int = 100, search: Optional[str] = None,
+                           favorites_only: bool = False) -> List[Dict[str, Any]]:
+        """The most recent commands (oldest first) with optional search"""
+        page = await self.get_page(limit=limit, search=search, favorites_only=favorites_only)
+        return page["data"]
+
+    async def get_page(self, limit: int = 100, cursor: Optional[str] = None,
+                       direction: str = "older", search: Optional[str] = None,
+                       favorites_only: bool = False, directory: Optional[str] = None,
+                       exit_code: Optional[int] = None) -> Dict[str, Any]:
+        """One page of history (oldest first) next to a cursor.
+
+        Pages are keyed on (timestamp, id): ``older`` returns the commands
+        just before the cursor, ``newer`` those just after it, and no cursor
+        means the most recent page. Segments are read from the cursor
+        outwards, one index range scan each, until the page is full, so a
+        page costs the same however far back it is. Raises ValueError for
+        a malformed cursor.
+        """
+        older = direction != "newer"
+        position = _decode_cursor(cursor) if cursor else None
+        commands: Optional[List[str]] = None
+
+        def page_query(table):
+            query = select(table)
+            if position:
+                key = tuple_(table.c.timestamp, table.c.id)
+                query = query.where(key < tuple_(*position) if older else key > tuple_(*position))
+            if older:
+                query = query.order_by(table.c.timestamp.desc(), table.c.id.desc())
+            else:
+                query = query.order_by(table.c.timestamp, table.c.id)
+            if favorites_only:
+                query = query.where(table.c.is_favorite.is_(True))
+            if directory is not None:
+                query = query.where(table.c.directory == directory)
+            if exit_code is not None:
+                query = query.where(table.c.exit_code == exit_code)
+            if commands is not None:
+                query = query.where(table.c.command.in_(commands))
+            elif search:
+                query = query.where(table.c.command.icontains(search, autoescape=True))
+            if limit:
+                query = query.limit(limit + 1)  # one extra row tells whether there is more
+            return query
+
+        async with engine.connect() as conn:
+            await history_segments.ready(conn)
+            if search:
+                # The newest limit + 1 matching rows belong to the limit + 1
+                # most recently used matching commands. Other pages and filters need every
+                # matching command; when there are too many to list, rows
+                # are tested one by one along the keyset scan instead
+                first_page = limit and not (cursor or favorites_only or directory or exit_code is not None)
+                wanted = limit + 1 if first_page else _SEARCH_COMMANDS + 1
+                commands = await matching_commands(conn, search, wanted)
+                if not commands:
+                    return {"data": [], "older_cursor": None, "newer_cursor": None}
+                if not first_page and len(commands) > _SEARCH_COMMANDS:
+                    commands = None
+            # Pinned favorites, then the segments nearest the cursor first:
+            # segments hold disjoint periods, so once they yielded a full
+            # page the ones further away cannot contribute
+            rows = (await conn.execute(page_query(_pinned))).all()
+            found = 0
+            if older:
+                segments = history_segments.overlapping(until=position[0] if position else None)
+                segments.reverse()
+            else:
+                segments = history_segments.overlapping(since=position[0] if position else None)
+            for segment in segments:
+                if limit and found > limit:
+                    break
+                batch = (await conn.execute(page_query(segment.table))).all()
+                rows.extend(batch)
+                found += len(batch)
+
+        rows.sort(key=lambda row: (row.timestamp, row.id), reverse=older)
+        more = bool(limit) and len(rows) > limit
+        rows = rows[:limit] if limit else rows
+        if older:
+            rows.reverse()
+        data = [self._to_dict(row) for row in rows]
+        has_older = more if older else bool(cursor)
+        has_newer = bool(cursor) if older else more
+        return {
+            "data": data,
+            "older_cursor": _encode_cursor(rows[0]) if rows and has_older else None,
+            "newer_cursor": _encode_cursor(rows[-1]) if rows and has_newer else None,
+        }
+
+    async def read_output(self, command_id: int, offset: int = 0,
+                          length: Optional[int] = None) -> Tuple[bytes, int]:
+        """A byte range of a command's output and its total size (a negative
+        offset counts from the end). Raises LookupError for an unknown
+        command and BlobNotFound once retention removed the output."""
+        await self.flush()
+        async with engine.connect() as conn:
+            await history_segments.ready(conn)
+            for table in history_segments.tables(newest_first=True):
+                row = (await conn.execute(
+                    select(table.c.output, table.c.output_hash).where(table.c.id == command_id)
+                )).first()
+                if row is not None:
+                    break
+        if row is None:
+            raise LookupError(f"Command {command_id} not found")
+        if row.output_hash:
+            return await output_store.read_async(row.output_hash, offset, length)
+        # Legacy records keep their (truncated) output inline
+        data = row.output.encode("utf-8")
+        start = max(0, len(data) + offset) if offset < 0 else offset
+        end = len(data) if length is None else start + length
+        return data[start:end], len(data)
+
+    async def search(self, query: str, limit: int = 20) -> tuple[List[Dict[str, Any]], float]:
+        """Distinct commands ranked by match and frecency; returns results and elapsed milliseconds"""
+        started = time.perf_counter()
+        async with engine.connect() as conn:
+            results = await search_commands(conn, query, limit)
+        return results, (time.perf_counter() - started) * 1000
+
+    async def set_favorite(self, command_id: int) -> Optional[bool]:
+        """Toggle a command's favorite flag; returns the new value (None if unknown)"""
+        await self.flush()
+        async with engine.begin() as conn:
+            await history_segments.ready(conn)
+            for table in history_segments.tables(newest_first=True):
+                favorite = await conn.scalar(
+                    update(table)
+                    .where(table.c.id == command_id)
+                    .values(is_favorite=~table.c.is_favorite)
+                    .returning(table.c.is_favorite)
+                )
+                if favorite is not None:
+                    return favorite
+        return None
+
+    async def delete_older_than(self, days: int) -> int:
+        """Delete non-favorite commands older than the given number of days"""
+        await self.flush()
+        return await self._expire(datetime.now() - timedelta(days=days), exact=True)
+
+    async def enforce_retention(self) -> int:
+        """Drop the segments that ended more than ``max_history_days`` ago"""
+        if settings.max_history_days <= 0:
+            return 0
+        await self.flush()
+        dropped = history_segments.dropped
+        removed = await self._expire(
+            datetime.now() - timedelta(days=settings.max_history_days), exact=False
+        )
+        if removed or history_segments.dropped > dropped:
+            print(
+                f"🧹 Retention dropped {history_segments.dropped - dropped} history segments "
+                f"({removed} commands)"
             )
-            
-            if result.returncode != 0:
-                return []
-            
-            commits = []
-            for line in result.stdout.strip().split('\n'):
-                if line.strip():
-                    try:
-                        commit = json.loads(line)
-                        commit["short_hash"] = commit["hash"][:7]
-                        commits.append(commit)
-                    except json.JSONDecodeError:
-                        continue
-            
-            # Update stored commits
-            data = self.load_data()
-            data["git_commits"] = commits
-            self.save_data(data)
-            
-            return commits
-            
-        except (subprocess.TimeoutExpired, subprocess.SubprocessError, FileNotFoundError):
-            return []
-    
-    def get_statistics(self) -> Dict[str, Any]:
-        """Get usage statistics"""
-        data = self.load_data()
-        commands = data["commands"]
-        
-        if not commands:
-            return {"total_commands": 0, "most_used": [], "avg_duration": 0}
-        
-        # Count command frequency
-        command_count = {}
-        total_duration = 0
-        
-        for cmd in commands:
-            base_cmd = cmd["command"].split()[0] if cmd["command"] else "unknown"
-            command_count[base_cmd] = command_count.get(base_cmd, 0) + 1
-            total_duration += cmd.get("duration_seconds", 0)
-        
-        # Get top 10 most used commands
-        most_used = sorted(command_count.items(), key=lambda x: x[1], reverse=True)[:10]
-        
+        return removed
+
+    async def _enforce_retention_periodically(self):
+        while True:
+            await asyncio.sleep(settings.history_retention_interval)
+            try:
+                await self.enforce_retention()
+            except Exception as e:
+                print(f"History retention error: {e}")
+
+    async def _expire(self, cutoff: datetime, exact: bool) -> int:
+        """Remove non-favorite commands older than cutoff; returns how many.
+
+        Segments that ended before the cutoff are dropped whole, after
+        their favorites are moved to the pinned table. With ``exact`` the
+        older rows of the segment holding the cutoff are deleted as well;
+        otherwise they wait until their whole segment has expired.
+        """
+        removed = 0
+        try:
+            async with self._write_lock, engine.begin() as conn:
+                await history_segments.ready(conn)
+                for segment in history_segments.overlapping(until=cutoff):
+                    table = segment.table
+                    if segment.end <= cutoff:
+                        await conn.execute(insert(_pinned).from_select(
+                            _COLUMNS,
+                            select(*(table.c[name] for name in _COLUMNS)).where(
+                                table.c.is_favorite.is_(True)
+                            ),
+                        ))
+                        removed += await self._forget(conn, table, table.c.is_favorite.is_(False))
+                        await conn.run_sync(history_segments.drop, segment)
+                    elif exact:
+                        removed += await self._delete(conn, table, cutoff)
+                # Pinned rows whose favorite flag was cleared expire one by one
+                removed += await self._delete(conn, _pinned, cutoff)
+        except Exception:
+            history_stats.invalidate()
+            history_segments.invalidate()
+            raise
+        return removed
+
+    async def _delete(self, conn, table, cutoff: datetime) -> int:
+        condition = and_(table.c.timestamp < cutoff, table.c.is_favorite.is_(False))
+        removed = await self._forget(conn, table, condition)
+        if removed:
+            await conn.execute(delete(table).where(condition))
+        return removed
+
+    @staticmethod
+    async def _forget(conn, table, condition) -> int:
+        """Uncount the rows matching condition from the statistics and the
+        search index before they are deleted; returns their number"""
+        counts: Dict[str, int] = {}
+        removed = 0
+        result = await conn.stream(select(*(table.c[name] for name in _FORGET_COLUMNS)).where(condition))
+        async for rows in result.mappings().partitions(_IMPORT_BATCH):
+            await history_stats.forget(conn, rows)
+            for row in rows:
+                counts[row["command"]] = counts.get(row["command"], 0) + 1
+            removed += len(rows)
+        await remove_from_search_index(conn, counts)
+        return removed
+
+    async def get_git_commits(self, limit: int = 10, repo_path: str = ".") -> List[Dict[str, Any]]:
+        """Get recent git commits (cached until the repository changes)"""
+        commits = await git_service.commits(repo_path, limit)
+        # Remember the latest commits for exports
+        self._git_commits = commits
+        return commits
+
+    async def get_statistics(self) -> Dict[str, Any]:
+        """Get usage statistics (maintained incrementally)"""
+        if not history_stats.loaded:
+            async with engine.begin() as conn:
+                await history_stats.load(conn)
+        return history_stats.summary()
+
+    async def load_data(self, limit: int = 1000) -> Dict[str, Any]:
+        """Recent commands, cached git commits and store metadata"""
+        total, first, last = 0, None, None
+        async with engine.connect() as conn:
+            await history_segments.ready(conn)
+            for table in history_segments.tables():
+                count, oldest, newest = (await conn.execute(
+                    select(func.count(), func.min(table.c.timestamp), func.max(table.c.timestamp))
+                )).one()
+                if count:
+                    total += count
+                    first = oldest if first is None else min(first, oldest)
+                    last = newest if last is None else max(last, newest)
         return {
-            "total_commands": len(commands),
-            "most_used": [{
-                "command": cmd,
-                "count": count,
-                "percentage": round((count / len(commands)) * 100, 2)
-            } for cmd, count in most_used],
-            "avg_duration": round(total_duration / len(commands), 2) if commands else 0,
-            "last_command_time": commands[-1]["timestamp"] if commands else None
+            "commands": await self.get_commands(limit=limit),
+            "git_commits": self._git_commits,
+            "metadata": {
+                "total_commands": total,
+                "first_command": first.isoformat() if first else None,
+                "last_command": last.isoformat() if last else None,
+                "storage": engine.dialect.name
+            }
         }
-    
-    def export_data(self, export_path: str = None) -> str:
-        """Export all data to a file"""
+
+    async def export_data(self, export_path: str = None) -> str:
+        """Export all data to a file, streaming rows from the database"""
         if not export_path:
             export_path = f"history_export_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
-        
-        data = self.load_data()
-        with open(export_path, 'w', encoding='utf-8') as f:
-            json.dump(data, f, indent=2, ensure_ascii=False)
-        
+
+        await self.flush()
+        async with engine.connect() as conn:
+            with open(export_path, 'w', encoding='utf-8') as f:
+                f.write('{"commands": [')
+                separator = "\n"
+                async for partition in history_segments.stream(conn, _COLUMNS):
+                    for row in partition:
+                        f.write(separator + json.dumps(self._to_dict(row), ensure_ascii=False))
+                        separator = ",\n"
+                f.write('\n], "git_commits": ')
+                json.dump(self._git_commits, f, ensure_ascii=False)
+                f.write(', "metadata": ')
+                json.dump({"exported": datetime.now().isoformat()}, f)
+                f.write('}\n')
+
         return export_path
 
+    async def _import_legacy(self):
+        """Import the JSON stores used before SQLite (data.json, snapshot + log)"""
+        loop = asyncio.get_running_loop()
+        for source in (self.data_file, self.legacy_dir):
+            if not source.exists():
+                continue
+            try:
+                records = await loop.run_in_executor(None, _read_legacy, source)
+            except (OSError, ValueError, KeyError) as e:
+                print(f"⚠️  Could not import legacy history from {source}: {e}")
+                continue
+            rows = [_legacy_row(record) for record in records if record.get("command")]
+            await self._insert(rows)
+            source.rename(source.with_name(source.name + ".migrated"))
+            print(f"📦 Imported {len(rows)} commands from {source} into the history database")
+
+
+_sequence = HistorySequence.__table__
+
+
+async def _seed_ids(conn):
+    """Start the id sequence past the largest stored id (history written by
+    versions without the sequence)"""
+    # Write first, so the ids read below stay the largest until commit
+    await conn.execute(update(_sequence).values(next_id=_sequence.c.next_id))
+    last_id = 0
+    for table in history_segments.tables():
+        last_id = max(last_id, await conn.scalar(select(func.max(table.c.id))) or 0)
+    seeded = await conn.execute(
+        update(_sequence).where(_sequence.c.name == "history").values(
+            next_id=case((_sequence.c.next_id <= last_id, last_id + 1), else_=_sequence.c.next_id)
+        )
+    )
+    if not seeded.rowcount:
+        await conn.execute(insert(_sequence).values(name="history", next_id=last_id + 1))
+
+
+async def _reserve_ids(conn, count: int) -> int:
+    """First of ``count`` new history ids. As the first write of the
+    transaction this takes the database write lock, so the ids stay
+    reserved for the transaction even against other processes."""
+    next_id = await conn.scalar(
+        update(_sequence).where(_sequence.c.name == "history")
+        .values(next_id=_sequence.c.next_id + count).returning(_sequence.c.next_id)
+    )
+    return next_id - count
+
+
+def _driver_values(row: Dict[str, Any]) -> tuple:
+    """_INSERT_SQL parameters of a row; the timestamp in the text format of
+    SQLAlchemy's SQLite DateTime"""
+    values = [row.get(name, default) for name, default in _FIELDS]
+    values[_TIMESTAMP] = values[_TIMESTAMP].isoformat(" ", "microseconds")
+    return tuple(values)
+
+
+def _encode_cursor(row) -> str:
+    """Opaque page cursor for a history row"""
+    key = f"{row.timestamp.isoformat()}|{row.id}"
+    return base64.urlsafe_b64encode(key.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def _decode_cursor(cursor: str) -> tuple:
+    try:
+        key = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode("utf-8")
+        timestamp, row_id = key.rsplit("|", 1)
+        return datetime.fromisoformat(timestamp), int(row_id)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+
+def _read_legacy(source: Path) -> List[Dict[str, Any]]:
+    """Command records of a legacy data.json file or snapshot + log directory"""
+    if source.is_file():
+        with open(source, "r", encoding="utf-8") as f:
+            return json.load(f).get("commands", [])
+
+    commands: List[Dict[str, Any]] = []
+    generation = 0
+    snapshot = source / "snapshot.json"
+    if snapshot.exists():
+        with open(snapshot, "r", encoding="utf-8") as f:
+            document = json.load(f)
+        commands = document["data"].get("commands", [])
+        generation = document["generation"]
+    logs = sorted(
+        (int(m.group(1)), m.group(0)) for m in map(_LEGACY_LOG_RE.match, os.listdir(source)) if m
+    )
+    for log_generation, name in logs:
+        if log_generation < generation:
+            continue
+        with open(source / name, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # torn write
+                try:
+                    op = json.loads(line)
+                except ValueError:
+                    continue
+                if op.get("op") == "add":
+                    commands.append(op["record"])
+    return commands
+
+
+def _legacy_row(record: Dict[str, Any]) -> Dict[str, Any]:
+    """A history row from a legacy JSON record (without its id, which is reassigned)"""
+    try:
+        timestamp = datetime.fromisoformat(record["timestamp"])
+    except (KeyError, TypeError, ValueError):
+        timestamp = datetime.now()
+    command = record["command"]
+    return {
+        "command": command,
+        "base_command": base_command(command),
+        "exit_code": record.get("exit_code") or 0,
+        "duration_seconds": record.get("duration_seconds") or 0.0,
+        "cpu_percent": record.get("cpu_percent") or 0.0,
+        "memory_mb": record.get("memory_mb") or 0.0,
+        "directory": record.get("directory") or "/",
+        "output": record.get("output") or "",
+        "timestamp": timestamp.replace(tzinfo=None),
+        "is_favorite": bool(record.get("is_favorite")),
+    }
+
 # Global instance
-history_service = HistoryService("data.json")
\ No newline at end of file
+history_service = HistoryService("data.json")
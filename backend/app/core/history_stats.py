@@ -0,0 +1,298 @@
+"""Incrementally maintained command history statistics"""
+import bisect
+import heapq
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import bindparam, delete, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from app.core.database import CommandHistory, HistoryStat
+from app.core.history_segments import history_segments
+
+_pinned = CommandHistory.__table__
+_stats = HistoryStat.__table__
+
+# Upper bounds (seconds) of the duration histogram buckets; the last is open
+DURATION_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900, 3600)
+_TOP = 20  # entries per breakdown in the summary
+_HOURS = 24  # hourly rollups in the summary
+_DAYS = 30  # daily rollups in the summary
+_REBUILD_BATCH = 10000
+_KINDS = ("total", "command", "directory", "hour", "day")
+
+
+class _Counter:
+    """Count, failures, total duration and duration histogram of a group of commands"""
+
+    __slots__ = ("count", "failures", "duration_sum", "histogram", "last_used")
+
+    def __init__(self, count=0, failures=0, duration_sum=0.0, histogram=None, last_used=None):
+        self.count = count
+        self.failures = failures
+        self.duration_sum = duration_sum
+        self.histogram = histogram or [0] * (len(DURATION_BUCKETS) + 1)
+        self.last_used: Optional[datetime] = last_used
+
+    def add(self, failed: int, duration: float, bucket: int, timestamp: datetime):
+        """Count a command (failed: 0 or 1; bucket: its histogram index)"""
+        self.count += 1
+        self.failures += failed
+        self.duration_sum += duration
+        self.histogram[bucket] += 1
+        if self.last_used is None or timestamp > self.last_used:
+            self.last_used = timestamp
+
+    def remove(self, exit_code: int, duration: float):
+        """Uncount a deleted command (the oldest go first, so last_used stands)"""
+        self.count -= 1
+        if exit_code:
+            self.failures -= 1
+        self.duration_sum -= duration
+        self.histogram[bisect.bisect_left(DURATION_BUCKETS, duration)] -= 1
+
+    def percentile(self, fraction: float) -> float:
+        """Duration percentile, interpolated within its histogram bucket"""
+        if not self.count:
+            return 0.0
+        rank = fraction * self.count
+        seen = 0
+        for i, in_bucket in enumerate(self.histogram):
+            if in_bucket and seen + in_bucket >= rank:
+                lower = DURATION_BUCKETS[i - 1] if i else 0.0
+                if i == len(DURATION_BUCKETS):
+                    return lower
+                return round(lower + (DURATION_BUCKETS[i] - lower) * (rank - seen) / in_bucket, 3)
+            seen += in_bucket
+        return DURATION_BUCKETS[-1]
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "failures": self.failures,
+            "failure_rate": round(self.failures / self.count, 4) if self.count else 0,
+            "avg_duration": round(self.duration_sum / self.count, 3) if self.count else 0,
+            "p50_duration": self.percentile(0.5),
+            "p95_duration": self.percentile(0.95),
+        }
+
+
+class HistoryStats:
+    """Statistics kept up to date as commands are stored.
+
+    Counters per base command, per directory, per hour and per day (plus
+    one overall) live in memory and in the ``history_stats`` table; the
+    history writer applies each batch to both in the same transaction as
+    the rows themselves, and retention uncounts the rows it drops.
+    Reading the statistics never touches the history table: the summary
+    is built from the counters and cached until the next change. Hourly
+    counters are only kept for the hours the summary shows (the daily
+    ones cover the rest), so neither the cost of the summary nor the
+    number of counters grows with the age of the history.
+    """
+
+    def __init__(self):
+        self._counters: Dict[str, Dict[str, _Counter]] = {kind: {} for kind in _KINDS}
+        self.loaded = False
+        self._summary: Optional[Dict[str, Any]] = None
+        self._summary_hour: Optional[str] = None
+
+    async def load(self, conn: AsyncConnection):
+        """Load the persisted counters, building them once if they are missing"""
+        rows = (await conn.execute(select(_stats))).all()
+        self._counters = {kind: {} for kind in _KINDS}
+        for row in rows:
+            self._counters.setdefault(row.kind, {})[row.key] = _Counter(
+                row.count, row.failures, row.duration_sum, list(row.histogram), row.last_used
+            )
+        self.loaded = True
+        self._summary = None
+        await history_segments.ready(conn)
+        if not rows and (
+            history_segments.segments or await conn.scalar(select(_pinned.c.id).limit(1)) is not None
+        ):
+            await self.rebuild(conn)
+        else:
+            await self._prune_hours(conn)
+
+    def invalidate(self):
+        """Drop the in-memory counters (a write failed); reloaded on next use"""
+        self.loaded = False
+        self._summary = None
+
+    async def record(self, conn: AsyncConnection, rows: List[Dict[str, Any]]):
+        """Count newly stored rows and persist the counters they touched"""
+        touched = self._apply(rows)
+        touched.difference_update(await self._prune_hours(conn))
+        await self._persist(conn, touched)
+
+    async def forget(self, conn: AsyncConnection, rows: List[Dict[str, Any]]):
+        """Uncount rows about to be deleted and persist the counters they touched"""
+        touched = set()
+        for row in rows:
+            timestamp = row["timestamp"]
+            for key in (
+                ("total", ""),
+                ("command", row["base_command"] or "unknown"),
+                ("directory", row["directory"]),
+                ("hour", timestamp.strftime("%Y-%m-%dT%H")),
+                ("day", timestamp.strftime("%Y-%m-%d")),
+            ):
+                counter = self._counters[key[0]].get(key[1])
+                if counter is not None:
+                    counter.remove(row["exit_code"], row["duration_seconds"] or 0.0)
+                    touched.add(key)
+        self._summary = None
+        emptied = [(kind, key) for kind, key in touched if self._counters[kind][key].count <= 0]
+        for kind, key in emptied:
+            del self._counters[kind][key]
+        if emptied:
+            await conn.execute(
+                delete(_stats).where(
+                    _stats.c.kind == bindparam("stat_kind"), _stats.c.key == bindparam("stat_key")
+                ),
+                [{"stat_kind": kind, "stat_key": key} for kind, key in emptied],
+            )
+        await self._persist(conn, touched.difference(emptied))
+
+    async def rebuild(self, conn: AsyncConnection):
+        """Recount everything from the history tables"""
+        print("📊 Rebuilding history statistics")
+        self._counters = {kind: {} for kind in _KINDS}
+        self._summary = None
+        columns = ["base_command", "directory", "exit_code", "duration_seconds", "timestamp"]
+        async for rows in history_segments.stream(conn, columns, batch=_REBUILD_BATCH):
+            self._apply(rows)
+        await conn.execute(delete(_stats))
+        await self._prune_hours(conn)
+        await self._persist(conn, {
+            (kind, key) for kind, counters in self._counters.items() for key in counters
+        })
+
+    def _apply(self, rows) -> set:
+        touched = set()
+        hour_start = hour_end = hour = day = None
+        for row in rows:
+            timestamp = row["timestamp"]
+            duration = row["duration_seconds"] or 0.0
+            failed = 1 if row["exit_code"] else 0
+            bucket = bisect.bisect_left(DURATION_BUCKETS, duration)
+            # Rows mostly come in time order: format the keys once per hour
+            if hour_start is None or not hour_start <= timestamp < hour_end:
+                hour_start = timestamp.replace(minute=0, second=0, microsecond=0)
+                hour_end = hour_start + timedelta(hours=1)
+                hour = ("hour", hour_start.strftime("%Y-%m-%dT%H"))
+                day = ("day", hour_start.strftime("%Y-%m-%d"))
+            for key in (
+                ("total", ""),
+                ("command", row["base_command"] or "unknown"),
+                ("directory", row["directory"]),
+                hour,
+                day,
+            ):
+                counters = self._counters[key[0]]
+                counter = counters.get(key[1])
+                if counter is None:
+                    counter = counters[key[1]] = _Counter()
+                counter.add(failed, duration, bucket, timestamp)
+                touched.add(key)
+        self._summary = None
+        return touched
+
+    async def _prune_hours(self, conn: AsyncConnection) -> set:
+        """Drop the hourly counters older than the summary shows; returns their keys"""
+        cutoff = (datetime.now() - timedelta(hours=_HOURS)).strftime("%Y-%m-%dT%H")
+        hours = self._counters["hour"]
+        stale = [key for key in hours if key <= cutoff]
+        for key in stale:
+            del hours[key]
+        if stale:
+            await conn.execute(delete(_stats).where(_stats.c.kind == "hour", _stats.c.key <= cutoff))
+        return {("hour", key) for key in stale}
+
+    async def _persist(self, conn: AsyncConnection, keys: set):
+        if not keys:
+            return
+        values = []
+        for kind, key in keys:
+            counter = self._counters[kind][key]
+            values.append({
+                "kind": kind, "key": key, "count": counter.count, "failures": counter.failures,
+                "duration_sum": counter.duration_sum, "histogram": counter.histogram,
+                "last_used": counter.last_used,
+            })
+        statement = sqlite_insert(_stats)
+        await conn.execute(
+            statement.on_conflict_do_update(
+                index_elements=[_stats.c.kind, _stats.c.key],
+                set_={
+                    name: statement.excluded[name]
+                    for name in ("count", "failures", "duration_sum", "histogram", "last_used")
+                },
+            ),
+            values,
+        )
+
+    def summary(self) -> Dict[str, Any]:
+        """The statistics response, rebuilt only after changes (or each new hour)"""
+        hour = datetime.now().strftime("%Y-%m-%dT%H")
+        if self._summary is None or self._summary_hour != hour:
+            self._summary = self._build_summary()
+            self._summary_hour = hour
+        return self._summary
+
+    def _build_summary(self) -> Dict[str, Any]:
+        total = self._counters["total"].get("")
+        if total is None or not total.count:
+            return {"total_commands": 0, "most_used": [], "avg_duration": 0}
+
+        def top(kind: str) -> List[Tuple[str, _Counter]]:
+            # Most used first; ties by name, so the order does not depend on how counters were built
+            return heapq.nsmallest(_TOP, self._counters[kind].items(), key=lambda item: (-item[1].count, item[0]))
+
+        def rollup(kind: str, keys: List[str], label: str) -> List[Dict[str, Any]]:
+            buckets = []
+            for key in keys:
+                counter = self._counters[kind].get(key)
+                buckets.append({
+                    label: key,
+                    "count": counter.count if counter else 0,
+                    "failures": counter.failures if counter else 0,
+                })
+            return buckets
+
+        commands = top("command")
+        now = datetime.now()
+        hours = [(now - timedelta(hours=i)).strftime("%Y-%m-%dT%H") for i in range(_HOURS - 1, -1, -1)]
+        days = [(now - timedelta(days=i)).strftime("%Y-%m-%d") for i in range(_DAYS - 1, -1, -1)]
+        overall = total.summary()
+        return {
+            "total_commands": total.count,
+            "most_used": [{
+                "command": command,
+                "count": counter.count,
+                "percentage": round((counter.count / total.count) * 100, 2)
+            } for command, counter in commands[:10]],
+            "avg_duration": round(total.duration_sum / total.count, 2),
+            "last_command_time": total.last_used.isoformat() if total.last_used else None,
+            "failure_rate": overall["failure_rate"],
+            "p50_duration": overall["p50_duration"],
+            "p95_duration": overall["p95_duration"],
+            "duration_histogram": [
+                {"le": bound, "count": count}
+                for bound, count in zip(DURATION_BUCKETS + (None,), total.histogram)
+            ],
+            "commands": [{"command": command, **counter.summary()} for command, counter in commands],
+            "directories": [
+                {"directory": directory, "count": counter.count,
+                 "failure_rate": counter.summary()["failure_rate"]}
+                for directory, counter in top("directory")
+            ],
+            "hourly": rollup("hour", hours, "hour"),
+            "daily": rollup("day", days, "day"),
+        }
+
+
+# Global instance
+history_stats = HistoryStats()
@@ -0,0 +1,339 @@
+"""In-process command completion from history, $PATH and known arguments"""
+import asyncio
+import bisect
+import os
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import select
+
+from app.config import settings
+from app.core.database import CommandIndex, base_command, engine
+from app.core.history_search import frecency
+from app.models.ai import CommandSuggestion
+
+_index = CommandIndex.__table__
+_TOP = 8  # best entries kept per trie node
+
+_SHELL_BUILTINS = {
+    "alias", "bg", "cd", "echo", "exit", "export", "fg", "history", "jobs", "pwd",
+    "source", "type", "unalias", "unset", "wait",
+}
+
+# Subcommands (first argument) and flags of common tools, most used first
+KNOWN_ARGUMENTS: Dict[str, Tuple[Tuple[str, ...], Tuple[str, ...]]] = {
+    "git": (
+        ("status", "add", "commit", "push", "pull", "checkout", "switch", "branch", "log", "diff",
+         "fetch", "merge", "rebase", "stash", "reset", "restore", "clone", "init", "remote", "tag",
+         "show", "cherry-pick", "blame", "bisect", "clean", "worktree", "submodule"),
+        ("--help", "--version", "-C", "--no-pager"),
+    ),
+    "docker": (
+        ("ps", "run", "exec", "build", "images", "pull", "push", "logs", "stop", "start", "rm",
+         "rmi", "compose", "inspect", "network", "volume", "system", "login", "tag"),
+        ("--help", "--version", "-H", "--context"),
+    ),
+    "kubectl": (
+        ("get", "describe", "apply", "delete", "logs", "exec", "port-forward", "config", "create",
+         "edit", "rollout", "scale", "top", "explain", "cp"),
+        ("-n", "--namespace", "-o", "--context", "-A", "--all-namespaces", "-f", "-l"),
+    ),
+    "npm": (
+        ("install", "run", "start", "test", "build", "ci", "init", "publish", "update", "uninstall",
+         "ls", "outdated", "audit", "exec"),
+        ("--save-dev", "-D", "-g", "--global", "--help", "--version"),
+    ),
+    "pip": (
+        ("install", "uninstall", "list", "freeze", "show", "download", "wheel", "check", "config"),
+        ("-r", "-e", "-U", "--upgrade", "--user", "--no-cache-dir", "--help", "--version"),
+    ),
+    "cargo": (
+        ("build", "run", "test", "check", "clippy", "fmt", "add", "new", "init", "update", "doc",
+         "bench", "publish", "install"),
+        ("--release", "--all-features", "--workspace", "-p", "--help", "--version"),
+    ),
+    "systemctl": (
+        ("status", "start", "stop", "restart", "reload", "enable", "disable", "daemon-reload",
+         "list-units", "is-active", "is-enabled", "mask", "unmask"),
+        ("--user", "--now", "--failed", "--no-pager", "-a", "--all"),
+    ),
+    "apt": (
+        ("install", "update", "upgrade", "remove", "purge", "search", "show", "list", "autoremove"),
+        ("-y", "--no-install-recommends", "--installed", "--upgradable"),
+    ),
+    "ls": ((), ("-la", "-l", "-a", "-lh", "-lah", "-R", "-t", "-S", "-1", "--color=auto")),
+    "grep": ((), ("-r", "-i", "-n", "-v", "-l", "-E", "-F", "-w", "-c", "--include", "--exclude")),
+    "tar": ((), ("-xzf", "-czf", "-xvf", "-cvf", "-tf", "-xJf", "-C")),
+    "find": ((), ("-name", "-iname", "-type", "-mtime", "-size", "-exec", "-maxdepth", "-delete")),
+    "ssh": ((), ("-p", "-i", "-L", "-R", "-D", "-N", "-v", "-A", "-J")),
+    "rm": ((), ("-r", "-f", "-rf", "-i", "-v")),
+    "cp": ((), ("-r", "-a", "-v", "-i", "-p")),
+    "ps": ((), ("aux", "-ef", "-p", "-u")),
+}
+
+
+class _Node:
+    __slots__ = ("label", "children", "top")
+
+    def __init__(self, label: str):
+        self.label = label  # edge label from the parent
+        self.children: Optional[Dict[str, "_Node"]] = None
+        self.top: List[Tuple[float, int, str]] = []  # (-score, length, word), best first
+
+
+class PrefixTrie:
+    """Radix trie keeping the best ``_TOP`` words below each node, so the
+    best completions of a prefix cost one walk down the prefix"""
+
+    def __init__(self):
+        self.root = _Node("")
+
+    def add(self, word: str, score: float):
+        """Insert word or change its score"""
+        node = self.root
+        path = [node]
+        i = 0
+        while i < len(word):
+            if node.children is None:
+                node.children = {}
+            child = node.children.get(word[i])
+            if child is None:
+                child = node.children[word[i]] = _Node(word[i:])
+                path.append(child)
+                break
+            label = child.label
+            common = 1
+            while common < len(label) and i + common < len(word) and label[common] == word[i + common]:
+                common += 1
+            if common < len(label):
+                # Split the edge where word leaves it
+                middle = _Node(label[:common])
+                middle.top = list(child.top)
+                child.label = label[common:]
+                middle.children = {child.label[0]: child}
+                node.children[word[i]] = middle
+                child = middle
+            path.append(child)
+            node = child
+            i += common
+
+        entry = (-score, len(word), word)  # shorter words first among equals
+        for node in path:
+            top = node.top
+            for j, (_, _, existing) in enumerate(top):
+                if existing == word:
+                    del top[j]
+                    break
+            if len(top) < _TOP or entry < top[-1]:
+                bisect.insort(top, entry)
+                del top[_TOP:]
+
+    def best(self, prefix: str) -> List[Tuple[float, str]]:
+        """(score, word) of the best words starting with prefix"""
+        node = self.root
+        i = 0
+        while i < len(prefix):
+            child = node.children.get(prefix[i]) if node.children else None
+            if child is None:
+                return []
+            if prefix.startswith(child.label, i):
+                i += len(child.label)
+            elif not child.label.startswith(prefix[i:]):
+                return []
+            else:
+                i = len(prefix)
+            node = child
+        return [(-score, word) for score, _, word in node.top]
+
+
+def path_executables() -> Set[str]:
+    """Names of the executables on $PATH and the common shell builtins"""
+    names = set(_SHELL_BUILTINS)
+    for directory in os.environ.get("PATH", "").split(os.pathsep):
+        try:
+            entries = os.scandir(directory or ".")
+        except OSError:
+            continue
+        with entries:
+            for entry in entries:
+                try:
+                    if entry.is_file() and os.access(entry.path, os.X_OK):
+                        names.add(entry.name)
+                except OSError:
+                    continue
+    return names
+
+
+class _CompletionIndex:
+    """Tries over history commands and program names, ranked by frecency"""
+
+    def __init__(self, executables: Set[str]):
+        self.history = PrefixTrie()
+        self.programs = PrefixTrie()
+        self.executables = executables
+        self.usage: Dict[str, Tuple[int, datetime]] = {}  # command -> (count, last used)
+        self.program_scores: Dict[str, float] = {}
+
+    @classmethod
+    def build(cls, rows: Iterable[Tuple[str, int, datetime]], executables: Set[str],
+              now: datetime) -> "_CompletionIndex":
+        """Index history (command, count, last used) rows (blocking)"""
+        index = cls(executables)
+        scored = []
+        for command, count, last_used in rows:
+            score = frecency(count, last_used, now)
+            scored.append((score, command))
+            index.usage[command] = (count, last_used)
+            program = base_command(command)
+            if program:
+                index.program_scores[program] = index.program_scores.get(program, 0.0) + score
+        # Best first: each node's list fills with the words that belong in it
+        scored.sort(reverse=True)
+        for score, command in scored[:settings.autocomplete_history_size]:
+            index.history.add(command, score)
+        for program in sorted(
+            executables | set(index.program_scores),
+            key=lambda name: (-index.program_scores.get(name, 0.0), len(name), name),
+        ):
+            index.programs.add(program, index.program_scores.get(program, 0.0))
+        return index
+
+    def record(self, command: str, timestamp: datetime):
+        count, last_used = self.usage.get(command, (0, timestamp))
+        self.usage[command] = (count + 1, max(last_used, timestamp))
+        score = frecency(count + 1, max(last_used, timestamp), datetime.now())
+        self.history.add(command, score)
+        program = base_command(command)
+        if program:
+            self.program_scores[program] = self.program_scores.get(program, 0.0) + score
+            self.programs.add(program, self.program_scores[program])
+
+
+class LocalCompleter:
+    """Command completions answered in process, without the network.
+
+    Completes the whole line from history commands starting with it, and
+    the word being typed from program names ($PATH, builtins and history)
+    or, after a known program, its subcommands and flags. History is
+    ranked by frecency; the index is rebuilt every
+    ``autocomplete_rebuild_interval`` seconds (frecency decays with time)
+    and new commands are added to it as they are recorded.
+    """
+
+    def __init__(self):
+        self._index: Optional[_CompletionIndex] = None
+        self._building: Optional[List[Tuple[str, datetime]]] = None  # recorded during a rebuild
+        self._task: Optional[asyncio.Task] = None
+
+        # Counters
+        self.queries = 0
+        self.rebuilds = 0
+
+    async def rebuild(self):
+        """Re-read history and $PATH and swap in a new index"""
+        self._building = []
+        try:
+            async with engine.connect() as conn:
+                rows = (await conn.execute(
+                    select(_index.c.command, _index.c.count, _index.c.last_used)
+                )).all()
+            loop = asyncio.get_running_loop()
+            executables = await loop.run_in_executor(None, path_executables)
+            index = await loop.run_in_executor(
+                None, _CompletionIndex.build, [tuple(row) for row in rows], executables, datetime.now()
+            )
+            for command, timestamp in self._building:
+                index.record(command, timestamp)
+            self._index = index
+            self.rebuilds += 1
+        finally:
+            self._building = None
+
+    async def _rebuild_periodically(self):
+        while True:
+            try:
+                await self.rebuild()
+            except Exception as e:
+                print(f"Local completion index error: {e}")
+            await asyncio.sleep(settings.autocomplete_rebuild_interval)
+
+    def start(self):
+        """Build the index in the background and keep it fresh"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._rebuild_periodically())
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    def record(self, command: str, timestamp: Optional[datetime] = None):
+        """Count a newly run command"""
+        timestamp = timestamp or datetime.now()
+        if self._building is not None:
+            self._building.append((command, timestamp))
+        if self._index is not None:
+            self._index.record(command, timestamp)
+
+    def complete(self, text: str, limit: int = 5) -> List[CommandSuggestion]:
+        """Best completions of a partial command line"""
+        index = self._index
+        line = text.lstrip()
+        if index is None or not line:
+            return []
+        self.queries += 1
+        suggestions: Dict[str, CommandSuggestion] = {}
+
+        def add(command: str, description: str, confidence: float):
+            if command != line and command not in suggestions:
+                suggestions[command] = CommandSuggestion(
+                    command=command, description=description, confidence=round(confidence, 3)
+                )
+
+        history = index.history.best(line)
+        if history:
+            best = history[0][0] or 1.0
+            for score, command in history:
+                count = index.usage.get(command, (0,))[0]
+                add(command, f"From history (used {count} times)", 0.5 + 0.45 * score / best)
+
+        head, _, word = line.rpartition(" ")
+        if not head.strip():
+            for score, program in index.programs.best(word)[:limit]:
+                description = "Executable on $PATH" if program in index.executables else "Command from history"
+                add(program, description, 0.6 if score else 0.4)
+        else:
+            program = base_command(head)
+            known = KNOWN_ARGUMENTS.get(program)
+            if known:
+                subcommands, flags = known
+                tokens = head.split()
+                arguments = tokens[next(
+                    (i + 1 for i, token in enumerate(tokens) if os.path.basename(token) == program),
+                    len(tokens),
+                ):]
+                if word.startswith("-"):
+                    candidates, kind = flags, "flag"
+                elif not any(not argument.startswith("-") for argument in arguments):
+                    candidates, kind = subcommands, "subcommand"
+                else:
+                    candidates, kind = (), ""
+                matches = [candidate for candidate in candidates if candidate.startswith(word)]
+                for rank, candidate in enumerate(matches[:limit]):
+                    add(f"{head} {candidate}", f"{program} {kind}", 0.45 - rank * 0.01)
+
+        ranked = sorted(suggestions.values(), key=lambda suggestion: -suggestion.confidence)
+        return ranked[:limit]
+
+    def stats(self) -> Dict[str, int]:
+        index = self._index
+        return {
+            "history_commands": len(index.usage) if index else 0,
+            "programs": len(index.executables | set(index.program_scores)) if index else 0,
+            "queries": self.queries,
+            "rebuilds": self.rebuilds,
+        }
+
+
+# Global instance
+local_completer = LocalCompleter()
@@ -0,0 +1,226 @@
+"""Coalescing output pipeline between a PTY session and its client"""
+import asyncio
+from typing import Awaitable, Callable, Optional
+
+from app.config import settings
+from app.core.pty_manager import PTYSession
+
+
+class OutputPipeline:
+    """Streams a session's scrollback to one client in coalesced frames.
+
+    The pipeline keeps a byte cursor into the session's scrollback ring.
+    Output that arrives is merged and flushed once the flush window
+    elapses or ``max_frame_bytes`` are pending, whichever comes first.
+    Small writes arriving after an idle period (keystroke echo) are
+    flushed immediately.
+
+    Backpressure is applied by the session: while the slowest attached
+    pipeline lags more than the high watermark behind the ring head, the
+    PTY reader is unregistered so the child blocks on a full PTY.
+
+    When the session keeps a screen model, a new viewer (or one reattaching
+    after a large gap) first receives a snapshot of the current screen
+    followed by live output, and a viewer that falls too far behind skips
+    the intermediate output and jumps to a fresh snapshot.
+
+    While the session's throughput governor has it throttled, the pipeline
+    switches to summarised mode: it sends only the latest screenful at a
+    capped frame rate, reports the bytes it skipped through ``throttle``
+    control messages, and returns to full streaming once output slows down.
+    """
+
+    def __init__(
+        self,
+        session: PTYSession,
+        send: Callable[[bytes, int, bool], Awaitable[None]],
+        on_eof: Optional[Callable[[], None]] = None,
+        control: Optional[Callable[[dict], Awaitable[None]]] = None,
+        offset: Optional[int] = None,
+        flush_interval_ms: Optional[float] = None,
+        max_frame_bytes: Optional[int] = None,
+        echo_max_bytes: Optional[int] = None,
+    ):
+        self.session = session
+        self._send = send
+        self._on_eof = on_eof
+        self._control = control
+        self.flush_interval = (
+            flush_interval_ms if flush_interval_ms is not None
+            else settings.terminal_flush_interval_ms
+        ) / 1000
+        self.max_frame_bytes = max_frame_bytes or settings.terminal_max_frame_bytes
+        self.echo_max_bytes = (
+            echo_max_bytes if echo_max_bytes is not None else settings.terminal_echo_max_bytes
+        )
+
+        # Replay everything still in the ring unless the client already has it
+        scrollback = session.scrollback
+        start = scrollback.tail if offset is None else offset
+        self.cursor = min(max(start, scrollback.tail), scrollback.head)
+        self.skipped_bytes = max(0, scrollback.tail - start)
+
+        # Prefer a screen snapshot over replaying a large amount of raw output
+        self._resync = session.screen is not None and (
+            offset is None
+            or scrollback.head - start > settings.terminal_snapshot_min_bytes
+        )
+        self.starts_with_snapshot = self._resync
+        self.snapshots_sent = 0
+
+        self._data_ready = asyncio.Event()
+        self._frame_full = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._last_flush = 0.0
+        self._summarising = False
+        self.frame_interval = 1 / settings.terminal_throttle_fps
+
+        # Counters
+        self.frames_sent = 0
+        self.bytes_sent = 0
+
+    @property
+    def pending(self) -> int:
+        """Bytes available in the ring that have not been sent yet"""
+        return self.session.scrollback.head - self.cursor
+
+    def start(self):
+        """Attach to the session and start the flush task"""
+        self.session.attach(self)
+        self.notify()
+        self._task = asyncio.create_task(self._flush_loop())
+
+    def stop(self):
+        """Cancel the flush task and detach; the session keeps running"""
+        if self._task and not self._task.done():
+            self._task.cancel()
+        self.session.detach(self)
+
+    def notify(self):
+        """Called by the session when output arrives or the PTY closes"""
+        pending = self.pending
+        if pending or self.session.eof or self._resync:
+            self._data_ready.set()
+        if pending >= self.max_frame_bytes:
+            self._frame_full.set()
+
+    def stats(self) -> dict:
+        """Cursor and throughput statistics for this client"""
+        return {
+            "offset": self.cursor,
+            "buffered_bytes": self.pending,
+            "skipped_bytes": self.skipped_bytes,
+            "snapshots_sent": self.snapshots_sent,
+            "summarised": self._summarising,
+            "frames_sent": self.frames_sent,
+            "bytes_sent": self.bytes_sent,
+        }
+
+    async def _flush_loop(self):
+        """Send pending output once the flush window or frame size is reached"""
+        loop = asyncio.get_running_loop()
+        scrollback = self.session.scrollback
+        try:
+            while True:
+                if self.session.throttled or self._summarising:
+                    await self._summarise_step()
+                    if self.session.eof and not self._summarising and not self.pending:
+                        break
+                    continue
+
+                await self._data_ready.wait()
+
+                if (
+                    self.session.screen is not None
+                    and self.pending > settings.terminal_screen_skip_bytes
+                ):
+                    # Too far behind: drop intermediate frames, resync from the screen
+                    self._resync = True
+
+                if self._resync:
+                    self._resync = False
+                    frame, offset = await self.session.screen_snapshot()
+                    if offset > self.cursor and self.snapshots_sent:
+                        self.skipped_bytes += offset - self.cursor
+                    self.cursor = offset
+                    self._last_flush = loop.time()
+                    await self._send(frame, self.cursor, True)
+                    self.snapshots_sent += 1
+                    self.frames_sent += 1
+                    self.bytes_sent += len(frame)
+                    self.session.maybe_resume_reading()
+                    if not self.pending and not self.session.eof:
+                        self._data_ready.clear()
+                    continue
+
+                if not self.session.eof and self.pending < self.max_frame_bytes:
+                    idle = loop.time() - self._last_flush >= self.flush_interval
+                    if not (idle and self.pending <= self.echo_max_bytes):
+                        try:
+                            await asyncio.wait_for(self._frame_full.wait(), self.flush_interval)
+                        except asyncio.TimeoutError:
+                            pass
+
+                start, frame = scrollback.read(self.cursor, self.max_frame_bytes)
+                if start > self.cursor:
+                    self.skipped_bytes += start - self.cursor
+                self.cursor = start + len(frame)
+                if self.pending < self.max_frame_bytes:
+                    self._frame_full.clear()
+                if not self.pending:
+                    self._data_ready.clear()
+
+                if frame:
+                    self._last_flush = loop.time()
+                    await self._send(frame, self.cursor, False)
+                    self.frames_sent += 1
+                    self.bytes_sent += len(frame)
+
+                self.session.maybe_resume_reading()
+                self.session.update_throughput()
+
+                if self.session.eof and not self.pending:
+                    break
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Output pipeline error: {e}")
+            return
+
+        if self._on_eof:
+            self._on_eof()
+
+    async def _summarise_step(self):
+        """Send one summary frame while throttled; leave the mode once it ends"""
+        if not self._summarising:
+            self._summarising = True
+            await self._send_control("summarised")
+
+        await asyncio.sleep(self.frame_interval)
+        self.session.update_throughput()
+
+        if self.pending:
+            frame, offset = await self.session.summary_frame()
+            self.skipped_bytes += max(0, offset - self.cursor)
+            self.cursor = max(self.cursor, offset)
+            self._last_flush = asyncio.get_running_loop().time()
+            await self._send(frame, self.cursor, True)
+            self.frames_sent += 1
+            self.bytes_sent += len(frame)
+            await self._send_control("summarised")
+
+        if not self.session.throttled or self.session.eof:
+            self._summarising = False
+            self._data_ready.clear()
+            self.notify()
+            await self._send_control("full")
+
+    async def _send_control(self, mode: str):
+        """Tell the client about the streaming mode and skipped output"""
+        if self._control:
+            await self._control({
+                "type": "throttle",
+                "mode": mode,
+                "skipped_bytes": self.skipped_bytes,
+                "rate_bytes_per_sec": round(self.session.governor.rate)
+            })
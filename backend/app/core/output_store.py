@@ -0,0 +1,194 @@
+"""Content-addressed store for full command output"""
+import asyncio
+import hashlib
+import os
+import struct
+import tempfile
+import threading
+import zlib
+from typing import Dict, Iterable, Optional, Tuple
+
+from app.config import settings
+
+_MAGIC = b"OUT1"
+_HEADER = struct.Struct(">4sQII")  # magic, size, chunk size, chunk count
+_OFFSET = struct.Struct(">Q")
+
+
+class BlobNotFound(KeyError):
+    """Raised when a blob is unknown or was removed by retention"""
+
+
+def blob_key(data: bytes) -> str:
+    """Content address of data (SHA-256, hex)"""
+    return hashlib.sha256(data).hexdigest()
+
+
+class OutputStore:
+    """Command output stored once per distinct content.
+
+    Each blob lives at ``<root>/<k[:2]>/<k[2:4]>/<key>`` and is compressed
+    in independent ``chunk_size`` chunks after a table of their offsets, so
+    a range read only inflates the chunks it overlaps. Storing content that
+    is already there just refreshes its modification time; once the store
+    outgrows ``max_bytes`` the least recently stored blobs are removed
+    until it is back under 90% of the limit.
+    """
+
+    def __init__(self, root: Optional[str] = None, max_bytes: Optional[int] = None,
+                 chunk_size: Optional[int] = None):
+        self.root = root or settings.output_store_dir
+        self.max_bytes = settings.output_store_max_bytes if max_bytes is None else max_bytes
+        self.chunk_size = chunk_size or settings.output_store_chunk_bytes
+        self._lock = threading.Lock()
+        self._blobs: Optional[Dict[str, Tuple[float, int]]] = None  # key -> (mtime, file size)
+        self._total = 0
+
+        # Counters
+        self.stored = 0
+        self.deduplicated = 0
+        self.evicted = 0
+
+    def _path(self, key: str) -> str:
+        if len(key) != 64 or not all(c in "0123456789abcdef" for c in key):
+            raise BlobNotFound(key)
+        return os.path.join(self.root, key[:2], key[2:4], key)
+
+    def _scan(self):
+        """Sizes and ages of the stored blobs, read from disk once"""
+        if self._blobs is not None:
+            return
+        blobs: Dict[str, Tuple[float, int]] = {}
+        if os.path.isdir(self.root):
+            for first in os.scandir(self.root):
+                if not first.is_dir():
+                    continue
+                for second in os.scandir(first.path):
+                    if not second.is_dir():
+                        continue
+                    for entry in os.scandir(second.path):
+                        if entry.is_file() and len(entry.name) == 64:
+                            stat = entry.stat()
+                            blobs[entry.name] = (stat.st_mtime, stat.st_size)
+        self._blobs = blobs
+        self._total = sum(size for _, size in blobs.values())
+
+    def put(self, data: bytes) -> str:
+        """Store data (blocking); returns its key"""
+        key = blob_key(data)
+        path = self._path(key)
+        with self._lock:
+            self._scan()
+            if key in self._blobs:
+                try:
+                    os.utime(path)
+                    self._blobs[key] = (os.stat(path).st_mtime, self._blobs[key][1])
+                    self.deduplicated += 1
+                    return key
+                except FileNotFoundError:
+                    self._total -= self._blobs.pop(key)[1]
+
+        size = self._write(path, data)
+        with self._lock:
+            if key not in self._blobs:
+                self._total += size
+            self._blobs[key] = (os.stat(path).st_mtime, size)
+            self.stored += 1
+            if self.max_bytes and self._total > self.max_bytes:
+                self._evict(int(self.max_bytes * 0.9), keep=key)
+        return key
+
+    def put_many(self, blobs: Iterable[bytes]):
+        for data in blobs:
+            self.put(data)
+
+    def _write(self, path: str, data: bytes) -> int:
+        """Write the chunked blob through a temporary file; returns its size"""
+        chunks = [
+            zlib.compress(data[i:i + self.chunk_size], 6)
+            for i in range(0, len(data), self.chunk_size)
+        ]
+        offsets = [0]
+        for chunk in chunks:
+            offsets.append(offsets[-1] + len(chunk))
+
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, temp = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(_HEADER.pack(_MAGIC, len(data), self.chunk_size, len(chunks)))
+                f.write(b"".join(_OFFSET.pack(offset) for offset in offsets))
+                f.writelines(chunks)
+            os.replace(temp, path)
+        except BaseException:
+            if os.path.exists(temp):
+                os.unlink(temp)
+            raise
+        return _HEADER.size + _OFFSET.size * len(offsets) + offsets[-1]
+
+    def _evict(self, target: int, keep: str):
+        for key, (_, size) in sorted(self._blobs.items(), key=lambda item: item[1][0]):
+            if self._total <= target:
+                break
+            if key == keep:
+                continue
+            try:
+                os.unlink(self._path(key))
+            except FileNotFoundError:
+                pass
+            del self._blobs[key]
+            self._total -= size
+            self.evicted += 1
+
+    def read(self, key: str, offset: int = 0, length: Optional[int] = None) -> Tuple[bytes, int]:
+        """Bytes [offset, offset + length) of a blob and its total size
+        (blocking); a negative offset counts from the end"""
+        try:
+            f = open(self._path(key), "rb")
+        except FileNotFoundError:
+            raise BlobNotFound(key)
+        with f:
+            magic, size, chunk_size, count = _HEADER.unpack(f.read(_HEADER.size))
+            if magic != _MAGIC:
+                raise BlobNotFound(key)
+            if offset < 0:
+                offset = max(0, size + offset)
+            end = size if length is None else min(size, offset + length)
+            if offset >= end:
+                return b"", size
+
+            first, last = offset // chunk_size, (end - 1) // chunk_size
+            f.seek(_HEADER.size + _OFFSET.size * first)
+            table = f.read(_OFFSET.size * (last - first + 2))
+            offsets = [_OFFSET.unpack_from(table, i * _OFFSET.size)[0] for i in range(last - first + 2)]
+            f.seek(_HEADER.size + _OFFSET.size * (count + 1) + offsets[0])
+            compressed = f.read(offsets[-1] - offsets[0])
+
+        data = b"".join(
+            zlib.decompress(compressed[offsets[i] - offsets[0]:offsets[i + 1] - offsets[0]])
+            for i in range(len(offsets) - 1)
+        )
+        start = offset - first * chunk_size
+        return data[start:start + end - offset], size
+
+    async def read_async(self, key: str, offset: int = 0,
+                         length: Optional[int] = None) -> Tuple[bytes, int]:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.read, key, offset, length)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            self._scan()
+            return {
+                "blobs": len(self._blobs),
+                "bytes": self._total,
+                "max_bytes": self.max_bytes,
+                "stored": self.stored,
+                "deduplicated": self.deduplicated,
+                "evicted": self.evicted,
+            }
+
+
+# Global instance
+output_store = OutputStore()
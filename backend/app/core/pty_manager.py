@@ -2,13 +2,32 @@
 import ptyprocess
 import os
 import asyncio
+import time
 import uuid
-from typing import Dict, Optional
+from typing import Callable, Dict, List, Optional
 from datetime import datetime
 
+from app.config import settings
+from app.core.scrollback import ScrollbackBuffer
+from app.core.screen_model import ScreenModel, is_available as screen_model_available
+from app.core.scrollback_index import ScrollbackIndex
+from app.core.git_service import git_service
+from app.core.history_service import history_service
+from app.core.session_limiter import SessionLimiter
+from app.core.session_recorder import SessionRecorder
+from app.core.shell_integration import ShellIntegrationParser, bash_rcfile
+from app.core.shell_pool import ShellPool
+from app.core.throughput import ThroughputGovernor
+
 
 class PTYSession:
-    """Represents a single PTY terminal session"""
+    """Represents a single PTY terminal session.
+
+    The session owns the PTY reader: output is always captured into the
+    scrollback ring, whether or not a client is attached, so a session can
+    outlive the WebSocket that created it. Attached viewers (output
+    pipelines) read from the ring at their own byte offset.
+    """
     
     def __init__(self, session_id: str, cols: int = 80, rows: int = 24):
         self.session_id = session_id
@@ -16,8 +35,45 @@ class PTYSession:
         self.rows = rows
         self.process: Optional[ptyprocess.PtyProcess] = None
         self.created_at = datetime.now()
+        self.client: Optional[str] = None  # admission-control key (client host)
         self.current_command = ""
         self.command_history: list[str] = []
+        self.shell_integration: Optional[ShellIntegrationParser] = None
+        self.on_command: Optional[Callable[["PTYSession", dict], None]] = None
+        self.scrollback = ScrollbackBuffer(
+            max(settings.terminal_scrollback_bytes, settings.terminal_output_high_water)
+        )
+        self.screen: Optional[ScreenModel] = None
+        if settings.terminal_screen_model and screen_model_available():
+            self.screen = ScreenModel(cols, rows)
+        self._screen_lock = asyncio.Lock()
+        self.recorder: Optional[SessionRecorder] = None
+        self.search_index: Optional[ScrollbackIndex] = None
+        if settings.terminal_search_index_bytes > 0:
+            self.search_index = ScrollbackIndex()
+        self.governor: Optional[ThroughputGovernor] = None
+        if settings.terminal_throttle_bytes_per_sec > 0:
+            self.governor = ThroughputGovernor(settings.terminal_throttle_bytes_per_sec)
+        self.viewers: List = []  # attached OutputPipelines
+        self.detached_at: Optional[datetime] = datetime.now()
+        self.attached_once = False  # a fresh session waits for its first viewer
+        self.leave_timer: Optional[asyncio.TimerHandle] = None  # close unless reattached
+        self.eof = False
+        self.spawned_at = 0.0  # time.monotonic() when the shell was spawned
+        self.first_output: Optional[asyncio.Future] = None  # resolves to monotonic time
+
+        # Output reader state
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._reader_fd = -1
+        self._paused = False
+        self._stall_started = 0.0
+
+        # Input writer state
+        self._input = bytearray()  # input the PTY has not taken yet
+        self._writer_fd = -1
+        self._drained: List[asyncio.Future] = []
+        self.stall_count = 0
+        self.stall_seconds = 0.0
         
     def start(self, shell: str = "/bin/bash"):
         """Start the PTY process"""
@@ -25,11 +81,22 @@ class PTYSession:
         env['TERM'] = 'xterm-256color'
         env['COLORTERM'] = 'truecolor'
         
+        argv = [shell]
+        if settings.terminal_shell_integration and os.path.basename(shell) == "bash":
+            # Prompt markers let the output reader record each command
+            argv = [shell, "--rcfile", bash_rcfile(), "-i"]
+            self.shell_integration = ShellIntegrationParser(
+                self._command_finished, settings.history_output_max_bytes
+            )
+
+        self.spawned_at = time.monotonic()
         self.process = ptyprocess.PtyProcess.spawn(
-            [shell],
+            argv,
             dimensions=(self.rows, self.cols),
             env=env
         )
+        # Non-blocking so the output reader can drain everything that is ready
+        os.set_blocking(self.process.fd, False)
         
     def resize(self, cols: int, rows: int):
         """Resize the terminal"""
@@ -37,11 +104,67 @@ class PTYSession:
             self.cols = cols
             self.rows = rows
             self.process.setwinsize(rows, cols)
+            if self.screen:
+                self.screen.resize(cols, rows)
+            if self.recorder:
+                self.recorder.record_resize(cols, rows)
             
-    def write(self, data: str):
-        """Write data to the terminal"""
+    def write(self, data: str | bytes):
+        """Write data to the terminal without blocking.
+
+        What the PTY does not take at once is buffered and written from a
+        loop writer callback as the child reads its input; callers await
+        ``drain`` to stop taking more input while the buffer is full.
+        """
         if self.process and self.process.isalive():
-            self.process.write(data.encode('utf-8'))
+            if isinstance(data, str):
+                data = data.encode('utf-8')
+            if self.recorder:
+                self.recorder.record_input(data)
+            if not self._input:
+                try:
+                    data = data[os.write(self.process.fd, data):]
+                except BlockingIOError:
+                    pass
+                except OSError as e:
+                    print(f"PTY write error: {e}")
+                    return
+            if data:
+                self._input += data
+                if self._writer_fd == -1 and self._loop is not None:
+                    self._writer_fd = self.process.fd
+                    self._loop.add_writer(self._writer_fd, self._on_writable)
+
+    def _on_writable(self):
+        """Write buffered input the PTY has room for"""
+        try:
+            written = os.write(self._writer_fd, self._input)
+        except BlockingIOError:
+            return
+        except OSError as e:
+            print(f"PTY write error: {e}")
+            written = len(self._input)
+        del self._input[:written]
+        if not self._input:
+            self._stop_writing()
+        if self._drained and len(self._input) <= settings.terminal_input_high_water // 2:
+            for waiter in self._drained:
+                if not waiter.done():
+                    waiter.set_result(None)
+            self._drained = []
+
+    def _stop_writing(self):
+        if self._loop and self._writer_fd != -1:
+            self._loop.remove_writer(self._writer_fd)
+        self._writer_fd = -1
+
+    async def drain(self):
+        """Wait while more than ``terminal_input_high_water`` input bytes are unwritten"""
+        if len(self._input) <= settings.terminal_input_high_water or self._writer_fd == -1:
+            return
+        waiter = self._loop.create_future()
+        self._drained.append(waiter)
+        await waiter
             
     def read(self, size: int = 1024) -> str:
         """Read data from the terminal (non-blocking)"""
@@ -54,11 +177,237 @@ class PTYSession:
             return ""
         except Exception:
             return ""
-            
+
+    def read_available(self, max_bytes: int = 65536) -> bytes:
+        """Drain up to max_bytes of output that is ready without blocking.
+
+        Raises EOFError once the child side of the PTY has been closed.
+        """
+        if not self.process:
+            raise EOFError("PTY session not started")
+
+        chunks = []
+        remaining = max_bytes
+        while remaining > 0:
+            try:
+                chunk = os.read(self.process.fd, min(remaining, 65536))
+            except BlockingIOError:
+                break
+            except OSError:
+                # Linux reports EIO when the child side is gone
+                if chunks:
+                    break
+                raise EOFError("PTY closed")
+            if not chunk:
+                if chunks:
+                    break
+                raise EOFError("PTY closed")
+            chunks.append(chunk)
+            remaining -= len(chunk)
+        return b"".join(chunks)
+
+    def start_reading(self):
+        """Register the PTY reader on the running event loop"""
+        self._loop = asyncio.get_running_loop()
+        self.first_output = self._loop.create_future()
+        self._reader_fd = self.fileno()
+        if self._reader_fd != -1:
+            self._loop.add_reader(self._reader_fd, self._on_readable)
+        if settings.terminal_recording and self.recorder is None:
+            self.recorder = SessionRecorder(self.session_id, self.cols, self.rows)
+            self.recorder.start()
+
+    def stop_reading(self):
+        """Unregister the PTY reader and writer and finish the recording"""
+        if self._loop and self._reader_fd != -1 and not self._paused:
+            self._loop.remove_reader(self._reader_fd)
+        self._reader_fd = -1
+        self._paused = False
+        self._stop_writing()
+        self._input.clear()
+        for waiter in self._drained:
+            if not waiter.done():
+                waiter.set_result(None)
+        self._drained = []
+        if self.recorder:
+            self.recorder.close()
+
+    def _on_readable(self):
+        """Drain ready output into the scrollback and wake attached viewers"""
+        try:
+            data = self.read_available(settings.terminal_max_frame_bytes)
+        except EOFError:
+            data = b""
+            self.eof = True
+        except Exception as e:
+            print(f"PTY read error: {e}")
+            data = b""
+            self.eof = True
+
+        if self.eof:
+            self.stop_reading()
+        elif data:
+            self.scrollback.append(data)
+            if self.search_index:
+                self.search_index.feed(self.scrollback.head - len(data), data)
+            if self.recorder:
+                self.recorder.record_output(data)
+            if self.shell_integration:
+                self.shell_integration.feed(data)
+            if not self.first_output.done():
+                self.first_output.set_result(time.monotonic())
+            self.update_throughput(len(data))
+
+        for viewer in self.viewers:
+            viewer.notify()
+
+        if self.viewers and self.lag() >= settings.terminal_output_high_water:
+            self._pause_reading()
+
+    def _command_finished(
+        self, command: str, exit_code: int, started_at: float, duration: float, directory: str,
+        output: bytes = b""
+    ):
+        """Called by the shell integration parser when a command completes"""
+        self.current_command = ""
+        self.command_history.append(command)
+        if len(self.command_history) > 1000:
+            del self.command_history[:-1000]
+        if self.on_command:
+            self.on_command(self, {
+                "command": command,
+                "exit_code": exit_code,
+                "duration": round(duration, 3),
+                "directory": directory or "/",
+                "output": output,
+                "timestamp": datetime.fromtimestamp(started_at),
+            })
+
+    @property
+    def throttled(self) -> bool:
+        """Whether output is currently too fast to stream in full"""
+        return self.governor is not None and self.governor.throttled
+
+    def update_throughput(self, nbytes: int = 0):
+        """Feed the throughput governor and react to mode changes"""
+        if self.governor is None or self._loop is None:
+            return
+        now = self._loop.time()
+        stalled = now - self._stall_started if self._paused else 0.0
+        if not self.governor.update(now, nbytes, stalled):
+            return
+        if self.governor.throttled:
+            print(
+                f"🚰 Throttling terminal session {self.session_id} "
+                f"({self.governor.rate / 1024:.0f} KiB/s)"
+            )
+            # Summarised viewers skip ahead, so stop holding the child back
+            self.maybe_resume_reading()
+        for viewer in self.viewers:
+            viewer.notify()
+
+    def lag(self) -> int:
+        """Bytes the slowest attached viewer has yet to send"""
+        if not self.viewers or self.throttled:
+            return 0
+        return self.scrollback.head - min(viewer.cursor for viewer in self.viewers)
+
+    def _pause_reading(self):
+        """Stop reading the PTY until the slowest viewer catches up"""
+        if self._paused or self._reader_fd == -1:
+            return
+        self._loop.remove_reader(self._reader_fd)
+        self._paused = True
+        self._stall_started = self._loop.time()
+        self.stall_count += 1
+
+    def maybe_resume_reading(self):
+        """Re-register the PTY reader once viewers have drained enough"""
+        if not self._paused or self.lag() > settings.terminal_output_low_water:
+            return
+        self._paused = False
+        self.stall_seconds += self._loop.time() - self._stall_started
+        if self._reader_fd != -1:
+            self._loop.add_reader(self._reader_fd, self._on_readable)
+
+    def attach(self, viewer):
+        """Attach an output pipeline"""
+        self.viewers.append(viewer)
+        self.detached_at = None
+        self.attached_once = True
+        if self.leave_timer:
+            self.leave_timer.cancel()
+            self.leave_timer = None
+
+    def detach(self, viewer):
+        """Detach an output pipeline; the session keeps running"""
+        if viewer in self.viewers:
+            self.viewers.remove(viewer)
+        if not self.viewers:
+            self.detached_at = datetime.now()
+        self.maybe_resume_reading()
+
+    async def screen_snapshot(self) -> tuple[bytes, int]:
+        """Bring the screen model up to date off the loop and render it.
+
+        Returns the snapshot and the stream offset it corresponds to.
+        """
+        async with self._screen_lock:
+            head = self.scrollback.head
+            start = max(self.screen.offset, head - settings.terminal_screen_catchup_bytes)
+            start, data = self.scrollback.read(start, head - start)
+            return await asyncio.get_running_loop().run_in_executor(
+                None, self.screen.sync_and_render, start, data
+            )
+
+    def tail_screenful(self) -> tuple[bytes, int]:
+        """The last screenful of raw output lines and the offset it ends at"""
+        head = self.scrollback.head
+        window = min(self.rows * self.cols * 4, settings.terminal_max_frame_bytes)
+        start, data = self.scrollback.read(head - window, window)
+        lines = data.split(b"\n")
+        if start > 0:
+            lines = lines[1:]  # first line is probably cut short
+        lines = [line.rstrip(b"\r") for line in lines[-self.rows:]]
+        return b"\r\n" + b"\r\n".join(lines), head
+
+    async def summary_frame(self) -> tuple[bytes, int]:
+        """Latest screenful used while output is throttled"""
+        if self.screen is not None:
+            return await self.screen_snapshot()
+        return self.tail_screenful()
+
+    def output_stats(self) -> dict:
+        """Output offsets, queue depth and stall statistics"""
+        stall_seconds = self.stall_seconds
+        if self._paused:
+            stall_seconds += self._loop.time() - self._stall_started
+        return {
+            "head_offset": self.scrollback.head,
+            "tail_offset": self.scrollback.tail,
+            "queued_bytes": self.lag(),
+            "paused": self._paused,
+            "stall_count": self.stall_count,
+            "stall_seconds": round(stall_seconds, 3),
+            "throttled": self.throttled,
+            "throttle_count": self.governor.throttle_count if self.governor else 0,
+            "rate_bytes_per_sec": round(self.governor.rate) if self.governor else None,
+        }
+
+    def terminate(self):
+        """Kill the shell and release its PTY fd (blocking, run off the loop)"""
+        if not self.process:
+            return
+        try:
+            # Closes the fd, escalates to SIGKILL and reaps the child
+            self.process.close(force=True)
+        except Exception as e:
+            print(f"PTY terminate error: {e}")
+
     def close(self):
         """Close the PTY session"""
-        if self.process and self.process.isalive():
-            self.process.terminate(force=True)
+        self.stop_reading()
+        self.terminate()
             
     def is_alive(self) -> bool:
         """Check if the PTY process is still running"""
@@ -69,6 +418,18 @@ class PTYSession:
         """Get the process ID"""
         return self.process.pid if self.process else None
 
+    @property
+    def cwd(self) -> Optional[str]:
+        """The shell's working directory, from its prompt markers or /proc"""
+        if self.shell_integration and self.shell_integration.cwd:
+            return self.shell_integration.cwd
+        if self.process:
+            try:
+                return os.readlink(f"/proc/{self.process.pid}/cwd")
+            except OSError:
+                pass
+        return None
+
     def fileno(self) -> int:
         """Get the file descriptor of the PTY"""
         if self.process:
@@ -81,41 +442,214 @@ class PTYManager:
     
     def __init__(self):
         self.sessions: Dict[str, PTYSession] = {}
+        self.pool = ShellPool(self._spawn_session, self._terminate_in_background)
+        self.limiter = SessionLimiter()
+        self._reaper_task: Optional[asyncio.Task] = None
+        self._terminating: set = set()
+
+        # Counters
+        self.reclaimed = 0  # detached sessions closed to admit a new one
         
     def create_session(self, cols: int = 80, rows: int = 24) -> PTYSession:
-        """Create a new PTY session"""
+        """Create a new PTY session and start capturing its output"""
         session_id = str(uuid.uuid4())
         session = PTYSession(session_id, cols, rows)
+        session.on_command = self._record_command
         session.start()
+        session.start_reading()
         self.sessions[session_id] = session
         return session
+
+    async def _spawn_session(self, cols: int = 80, rows: int = 24) -> PTYSession:
+        """Spawn a shell off the event loop and start capturing its output"""
+        session = PTYSession(str(uuid.uuid4()), cols, rows)
+        session.on_command = self._record_command
+        await asyncio.get_running_loop().run_in_executor(None, session.start)
+        session.start_reading()
+        return session
+
+    async def acquire_session(
+        self, cols: int = 80, rows: int = 24, client: str = "local"
+    ) -> PTYSession:
+        """Admit a new session for client and hand out a warm (or new) shell.
+
+        A client at its limit gets its longest detached session closed to
+        make room (a reloaded page leaves the old one behind). Raises
+        SessionLimitExceeded when admission control refuses it.
+        """
+        if not self.limiter.has_room(client):
+            self._reclaim_detached(client)
+        await self.limiter.acquire(client)
+        try:
+            session = await self.pool.acquire(cols, rows)
+        except BaseException:
+            self.limiter.release(client)
+            raise
+        session.client = client
+        session.created_at = datetime.now()
+        session.detached_at = datetime.now()
+        self.sessions[session.session_id] = session
+        return session
         
+    async def open_session(
+        self, session_id: Optional[str] = None, cols: int = 80, rows: int = 24,
+        client: str = "local"
+    ) -> tuple[PTYSession, bool]:
+        """Reattach to a live session or admit a new one.
+
+        Returns the session and whether it was reattached. Raises
+        SessionLimitExceeded when admission control refuses a new session.
+        """
+        session = self.get_session(session_id) if session_id else None
+        if session is not None and session.is_alive():
+            print(f"🔁 Terminal session reattached: {session.session_id} (PID: {session.pid})")
+            return session, True
+        # Take a warm shell from the pool (or spawn a new one)
+        session = await self.acquire_session(cols=cols, rows=rows, client=client)
+        print(f"✅ Terminal session created: {session.session_id} (PID: {session.pid})")
+        return session, False
+
+    def _record_command(self, session: PTYSession, record: dict):
+        """Store a command reported by a session's shell integration"""
+        def save():
+            try:
+                history_service.add_command(**record)
+            except Exception as e:
+                print(f"Failed to record command: {e}")
+            # The command may have changed the work tree, which git status
+            # caching cannot see
+            git_service.invalidate(record["directory"])
+
+        # Keep the history write out of the PTY reader callback
+        if session._loop:
+            session._loop.call_soon(save)
+        else:
+            save()
+
+    def _reclaim_detached(self, client: str) -> bool:
+        """Close client's longest detached session, if it has one"""
+        detached = [
+            session for session in self.sessions.values()
+            if session.client == client and session.attached_once and session.detached_at
+        ]
+        if not detached:
+            return False
+        oldest = min(detached, key=lambda session: session.detached_at)
+        print(f"♻️  Reclaiming detached terminal session for {client}: {oldest.session_id}")
+        self.close_session(oldest.session_id)
+        self.reclaimed += 1
+        return True
+
     def get_session(self, session_id: str) -> Optional[PTYSession]:
         """Get an existing session"""
         return self.sessions.get(session_id)
         
     def close_session(self, session_id: str):
-        """Close and remove a session"""
-        session = self.sessions.get(session_id)
+        """Close and remove a session; the shell is terminated off the loop"""
+        session = self.sessions.pop(session_id, None)
         if session:
-            session.close()
-            del self.sessions[session_id]
+            session.stop_reading()
+            if session.client is not None:
+                self.limiter.release(session.client)
+            self._terminate_in_background(session)
+
+    def leave_session(self, session_id: str, grace: Optional[float] = None):
+        """The page showing a session went away: close the session after
+        grace seconds unless it is reattached (the page was reloaded)"""
+        session = self.sessions.get(session_id)
+        if session is None:
+            return
+        grace = settings.terminal_leave_grace if grace is None else grace
+
+        def close_if_detached():
+            session.leave_timer = None
+            if self.sessions.get(session_id) is session and not session.viewers:
+                print(f"👋 Closing terminal session left by its page: {session_id}")
+                self.close_session(session_id)
+
+        if session.leave_timer:
+            session.leave_timer.cancel()
+        session.leave_timer = asyncio.get_running_loop().call_later(grace, close_if_detached)
+
+    def _terminate_in_background(self, session: PTYSession):
+        """Run the blocking terminate() in the default executor"""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            session.terminate()
+            return
+        future = loop.run_in_executor(None, session.terminate)
+        self._terminating.add(future)
+        future.add_done_callback(self._terminating.discard)
             
     def cleanup_dead_sessions(self):
-        """Remove sessions that are no longer alive"""
+        """Remove sessions whose shell has exited (reaping zombies and fds)"""
         dead_sessions = [
             sid for sid, session in self.sessions.items()
-            if not session.is_alive()
+            if not session.is_alive() or (session.eof and not session.viewers)
         ]
         for sid in dead_sessions:
-            del self.sessions[sid]
+            self.close_session(sid)
+
+    def reap_idle_sessions(self, ttl: Optional[float] = None) -> int:
+        """Close sessions that have been detached for longer than ttl seconds"""
+        ttl = settings.terminal_session_idle_ttl if ttl is None else ttl
+        now = datetime.now()
+        idle_sessions = [
+            sid for sid, session in self.sessions.items()
+            if session.detached_at and (now - session.detached_at).total_seconds() > ttl
+        ]
+        for sid in idle_sessions:
+            print(f"🧹 Reaping idle terminal session: {sid}")
+            self.close_session(sid)
+        return len(idle_sessions)
+
+    async def _reap_periodically(self):
+        """Background task reaping dead and idle sessions"""
+        while True:
+            await asyncio.sleep(settings.terminal_reap_interval)
+            try:
+                self.cleanup_dead_sessions()
+                self.reap_idle_sessions()
+                for session in self.pool.prune():
+                    self._terminate_in_background(session)
+            except Exception as e:
+                print(f"Session reaper error: {e}")
+
+    def start_reaper(self):
+        """Start the background reaper task"""
+        if self._reaper_task is None or self._reaper_task.done():
+            self._reaper_task = asyncio.create_task(self._reap_periodically())
+
+    def stop_reaper(self):
+        """Stop the background reaper task"""
+        if self._reaper_task:
+            self._reaper_task.cancel()
+            self._reaper_task = None
             
     def close_all(self):
-        """Close all sessions"""
+        """Close all sessions and idle pooled shells"""
+        for session in self.pool.drain():
+            session.close()
         for session in self.sessions.values():
             session.close()
         self.sessions.clear()
 
+    async def shutdown(self):
+        """Stop background tasks and terminate every shell off the loop"""
+        self.stop_reaper()
+        sessions = self.pool.drain()
+        for session_id in list(self.sessions):
+            session = self.sessions.pop(session_id)
+            session.stop_reading()
+            sessions.append(session)
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(
+            *(loop.run_in_executor(None, session.terminate) for session in sessions),
+            *self._terminating,
+            return_exceptions=True
+        )
+
 
 # Global PTY manager instance
 pty_manager = PTYManager()
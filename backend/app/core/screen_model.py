@@ -0,0 +1,158 @@
+"""Server-side virtual terminal screen model (optional, requires pyte)"""
+import threading
+from typing import List, Optional, Tuple
+
+try:
+    import pyte
+    from pyte import graphics
+except ImportError:  # pragma: no cover - optional dependency
+    pyte = None
+
+# Private modes restored on snapshot (pyte stores private modes shifted by 5 bits)
+_PRIVATE_MODES = {
+    1: "?1",        # application cursor keys
+    1000: "?1000",  # mouse reporting
+    1002: "?1002",
+    1006: "?1006",
+    2004: "?2004",  # bracketed paste
+}
+_ALT_SCREEN_MODES = (1049, 1047, 47)
+
+if pyte is not None:
+    _FG_CODES = {name: code for code, name in {**graphics.FG_ANSI, **graphics.FG_AIXTERM}.items()}
+    _BG_CODES = {name: code for code, name in {**graphics.BG_ANSI, **graphics.BG_AIXTERM}.items()}
+
+
+def is_available() -> bool:
+    """Whether the optional VT emulator dependency is installed"""
+    return pyte is not None
+
+
+class ScreenModel:
+    """Tracks the current screen grid and cursor of a PTY session.
+
+    A newly attached viewer can be sent one compact snapshot of the visible
+    screen instead of replaying the raw scrollback. The VT emulator is
+    slow, so output is not fed on every read: the model is brought up to
+    date lazily, off the event loop, when a snapshot is requested, and only
+    the most recent output is replayed into it.
+    """
+
+    def __init__(self, cols: int, rows: int):
+        if pyte is None:
+            raise RuntimeError("pyte is required for the terminal screen model")
+        self.screen = pyte.Screen(cols, rows)
+        self.stream = pyte.ByteStream(self.screen)
+        self.offset = 0  # stream offset the screen reflects
+        self._size = (cols, rows)
+        self._lock = threading.Lock()
+
+    def resize(self, cols: int, rows: int):
+        """Resize the emulated screen (applied on the next sync)"""
+        self._size = (cols, rows)
+
+    def sync_and_render(self, start: int, data: bytes) -> Tuple[bytes, int]:
+        """Feed output beginning at stream offset start and render a snapshot.
+
+        If start is past the current offset the output in between is gone
+        (or was skipped), so the screen is reset before feeding. Blocking;
+        run it in an executor. Returns the snapshot and the offset it
+        reflects.
+        """
+        with self._lock:
+            cols, rows = self._size
+            if (self.screen.columns, self.screen.lines) != (cols, rows):
+                self.screen.resize(rows, cols)
+            if start > self.offset:
+                self.screen.reset()
+            elif start < self.offset:
+                data = data[self.offset - start:]
+                start = self.offset
+            self.stream.feed(data)
+            self.offset = start + len(data)
+            return self.snapshot(), self.offset
+
+    def snapshot(self) -> bytes:
+        """Render the visible screen, cursor and modes as escape sequences"""
+        screen = self.screen
+        parts: List[str] = []
+
+        if any((mode << 5) in screen.mode for mode in _ALT_SCREEN_MODES):
+            parts.append("\x1b[?1049h")
+        parts.append("\x1b[0m\x1b[H\x1b[2J")
+
+        for y in range(screen.lines):
+            line = screen.buffer[y]
+            # Trailing blank cells are already cleared by the erase above
+            width = screen.columns
+            while width and _is_blank(line[width - 1]):
+                width -= 1
+            if not width:
+                continue
+            parts.append(f"\x1b[{y + 1};1H")
+            last_sgr: Optional[str] = None
+            for x in range(width):
+                char = line[x]
+                if not char.data:
+                    continue  # second cell of a wide character
+                sgr = _sgr(char)
+                if sgr != last_sgr:
+                    parts.append(sgr)
+                    last_sgr = sgr
+                parts.append(char.data)
+            parts.append("\x1b[0m")
+
+        for mode, sequence in _PRIVATE_MODES.items():
+            if (mode << 5) in screen.mode:
+                parts.append(f"\x1b[{sequence}h")
+        cursor = screen.cursor
+        parts.append(f"\x1b[{cursor.y + 1};{cursor.x + 1}H")
+        parts.append("\x1b[?25l" if cursor.hidden else "\x1b[?25h")
+        return "".join(parts).encode("utf-8")
+
+
+def _is_blank(char) -> bool:
+    """Whether a cell is an unstyled space"""
+    return (
+        char.data == " " and char.fg == "default" and char.bg == "default"
+        and not char.reverse and not char.underscore
+    )
+
+
+def _color(color: str, codes: dict, extended: int) -> Optional[str]:
+    """SGR parameter for a pyte color name or hex value"""
+    if color == "default":
+        return None
+    if color in codes:
+        return str(codes[color])
+    if len(color) == 6:
+        try:
+            r, g, b = (int(color[i:i + 2], 16) for i in (0, 2, 4))
+        except ValueError:
+            return None
+        return f"{extended};2;{r};{g};{b}"
+    return None
+
+
+def _sgr(char) -> str:
+    """SGR sequence reproducing a cell's attributes"""
+    params = ["0"]
+    if char.bold:
+        params.append("1")
+    if char.italics:
+        params.append("3")
+    if char.underscore:
+        params.append("4")
+    if char.blink:
+        params.append("5")
+    if char.reverse:
+        params.append("7")
+    if char.strikethrough:
+        params.append("9")
+    fg = _color(char.fg, _FG_CODES, 38)
+    if fg:
+        params.append(fg)
+    bg = _color(char.bg, _BG_CODES, 48)
+    if bg:
+        params.append(bg)
+    return f"\x1b[{';'.join(params)}m"
@@ -0,0 +1,55 @@
+"""Fixed-size scrollback ring buffer addressed by absolute byte offsets"""
+from typing import Tuple
+
+
+class ScrollbackBuffer:
+    """Keeps the most recent ``capacity`` bytes of a session's output.
+
+    Offsets are absolute positions in the session's output stream:
+    ``head`` is the total number of bytes ever written and ``tail`` is the
+    oldest offset still held in the ring.
+    """
+
+    def __init__(self, capacity: int):
+        if capacity <= 0:
+            raise ValueError("Scrollback capacity must be positive")
+        self.capacity = capacity
+        self._buf = bytearray(capacity)
+        self.head = 0
+
+    @property
+    def tail(self) -> int:
+        """Oldest offset still available"""
+        return max(0, self.head - self.capacity)
+
+    def __len__(self) -> int:
+        return self.head - self.tail
+
+    def append(self, data: bytes):
+        """Append output, overwriting the oldest bytes once full"""
+        total = len(data)
+        if not total:
+            return
+        chunk = data[-self.capacity:] if total > self.capacity else data
+        start = (self.head + total - len(chunk)) % self.capacity
+        first = min(len(chunk), self.capacity - start)
+        self._buf[start:start + first] = chunk[:first]
+        if first < len(chunk):
+            self._buf[:len(chunk) - first] = chunk[first:]
+        self.head += total
+
+    def read(self, offset: int, max_bytes: int) -> Tuple[int, bytes]:
+        """Read up to max_bytes starting at offset.
+
+        Returns the offset actually read from (moved forward to ``tail`` if
+        the requested bytes have already been overwritten) and the data.
+        """
+        start = min(max(offset, self.tail), self.head)
+        length = min(self.head - start, max_bytes)
+        if length <= 0:
+            return start, b""
+        pos = start % self.capacity
+        if pos + length <= self.capacity:
+            return start, bytes(self._buf[pos:pos + length])
+        first = self.capacity - pos
+        return start, bytes(self._buf[pos:]) + bytes(self._buf[:length - first])
@@ -0,0 +1,301 @@
+"""Incremental full-text search index over a session's output"""
+import asyncio
+import re
+import time
+import zlib
+from array import array
+from collections import deque
+from typing import Deque, List, Optional, Tuple
+
+from app.config import settings
+
+# CSI, OSC (BEL or ST terminated), other two-byte escapes, and remaining C0
+# controls; none of them spans a newline, so stripping keeps line boundaries
+_ANSI_RE = re.compile(
+    rb"\x1b\[[0-?]*[ -/]*[@-~]"
+    rb"|\x1b\][^\x07\x1b\n]*(?:\x07|\x1b\\)?"
+    rb"|\x1b[ -/]*[0-~]"
+    rb"|[\x00-\x08\x0b-\x1f\x7f]"
+)
+_WORD_RE = re.compile(r"\w+")
+_MAX_LINE_BYTES = 16 * 1024  # longer lines are indexed truncated
+_BLOCK_BYTES = 128 * 1024  # raw output per indexed block
+_FLUSH_DELAY = 1.0  # seconds before a partial block is indexed anyway
+
+
+def _index_keys(text: str) -> set:
+    """Filter keys for already lowercased text: whole words and their trigrams.
+
+    Every run of word characters in a query is a substring of a run of word
+    characters in any line that contains the query, so trigrams that cross
+    word boundaries need not be indexed; skipping them keeps indexing fast.
+    """
+    words = set(_WORD_RE.findall(text))
+    keys = {word[i:i + 3] for word in words for i in range(len(word) - 2)}
+    keys.update("\0" + word for word in words)
+    return keys
+
+
+def _query_keys(query: str) -> List[str]:
+    """Filter keys every line containing the (lowercased) query must have.
+
+    Words that are delimited on both sides within the query must also
+    appear whole; the first and last may be cut off by the match.
+    """
+    keys = set()
+    for match in _WORD_RE.finditer(query):
+        word = match.group()
+        keys.update(word[i:i + 3] for i in range(len(word) - 2))
+        if match.start() > 0 and match.end() < len(query):
+            keys.add("\0" + word)
+    return list(keys)
+
+
+class _Block:
+    """A run of indexed lines: compressed text, line offsets and a key filter.
+
+    The filter is a bloom-style bitmap (one bit per hashed key) held in a
+    Python int, so a block can be ruled out with a single ``&``.
+    """
+
+    __slots__ = ("offsets", "text", "text_bytes", "bloom", "bits")
+
+    def __init__(self, offsets: array, lines: List[str]):
+        joined = "\n".join(lines)
+        self.offsets = offsets
+        self.text = zlib.compress(joined.encode("utf-8"), 1)
+        self.text_bytes = len(joined)
+        keys = _index_keys(joined.lower())
+        self.bits = max(1024, 1 << (len(keys) * 8).bit_length())
+        bitmap = bytearray(self.bits // 8)
+        mask = self.bits - 1
+        for key in keys:
+            h = hash(key) & mask
+            bitmap[h >> 3] |= 1 << (h & 7)
+        self.bloom = int.from_bytes(bitmap, "little")
+
+    def may_contain(self, keys: List[str]) -> bool:
+        mask = self.bits - 1
+        query = 0
+        for key in keys:
+            query |= 1 << (hash(key) & mask)
+        return self.bloom & query == query
+
+    def lines(self) -> List[str]:
+        return zlib.decompress(self.text).decode("utf-8").split("\n")
+
+
+class ScrollbackIndex:
+    """Searchable, ANSI-stripped line index of everything a session printed.
+
+    ``feed`` only queues raw output, so the PTY reader stays cheap; complete
+    lines are stripped, compressed and indexed in the default executor, one
+    batch at a time, as a block with a filter of its words and word
+    trigrams. Search skips every block whose filter lacks one of the
+    query's keys and only decompresses the rest; output not indexed yet is
+    scanned directly, so search never waits for the indexer. Output
+    dropped because indexing fell behind is counted in ``dropped_bytes``.
+    Retention is measured in indexed text and is independent of (usually
+    much larger than) the scrollback ring.
+    """
+
+    def __init__(self, max_bytes: Optional[int] = None, backlog_bytes: Optional[int] = None):
+        self.max_bytes = max_bytes or settings.terminal_search_index_bytes
+        self.backlog_bytes = backlog_bytes or settings.terminal_search_backlog_bytes
+        self._blocks: Deque[_Block] = deque()
+        self.text_bytes = 0
+
+        # Raw output waiting to be indexed, and the unterminated last line
+        self._pending: List[bytes] = []
+        self._pending_bytes = 0
+        self._pending_offset = 0  # stream offset of the first pending byte
+        self._partial = b""
+        self._partial_offset = 0
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._job: Optional[asyncio.Future] = None
+        self._job_input: Optional[Tuple[int, bytes]] = None  # (offset, data) being indexed
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+        # Counters
+        self.dropped_bytes = 0  # output never indexed because indexing fell behind
+        self.evicted_lines = 0
+
+    def feed(self, offset: int, data: bytes):
+        """Queue output that starts at stream offset ``offset``"""
+        if self._loop is None:
+            self._loop = asyncio.get_running_loop()
+        if not self._pending:
+            self._pending_offset = offset
+        self._pending.append(data)
+        self._pending_bytes += len(data)
+
+        if self._pending_bytes > self.backlog_bytes:
+            # Indexing cannot keep up with this flood: drop the oldest output
+            while self._pending_bytes > self.backlog_bytes // 2:
+                dropped = self._pending.pop(0)
+                self._pending_bytes -= len(dropped)
+                self._pending_offset += len(dropped)
+                self.dropped_bytes += len(dropped)
+
+        if self._pending_bytes >= _BLOCK_BYTES:
+            self._schedule()
+        elif self._timer is None:
+            self._timer = self._loop.call_later(_FLUSH_DELAY, self._schedule)
+
+    def _schedule(self):
+        """Index the pending output in the executor (one batch at a time)"""
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        if self._job is not None or not self._pending:
+            return
+        size = taken = 0
+        while taken < len(self._pending) and size < _BLOCK_BYTES:
+            size += len(self._pending[taken])
+            taken += 1
+        data = b"".join(self._pending[:taken])
+        del self._pending[:taken]
+        self._pending_bytes -= size
+        offset = self._pending_offset
+        self._pending_offset += size
+        if self._partial and self._partial_offset + len(self._partial) == offset:
+            data = self._partial + data
+            offset = self._partial_offset
+        self._partial = b""
+        self._job_input = (offset, data)
+        self._job = self._loop.run_in_executor(None, _build, offset, data)
+        self._job.add_done_callback(self._job_done)
+
+    def _job_done(self, job: asyncio.Future):
+        self._job = None
+        self._job_input = None
+        try:
+            block, self._partial, self._partial_offset = job.result()
+        except Exception as e:
+            print(f"Scrollback index error: {e}")
+            block = None
+        if block is not None:
+            self._blocks.append(block)
+            self.text_bytes += block.text_bytes
+            while self.text_bytes > self.max_bytes and len(self._blocks) > 1:
+                evicted = self._blocks.popleft()
+                self.text_bytes -= evicted.text_bytes
+                self.evicted_lines += len(evicted.offsets)
+        if self._pending_bytes >= _BLOCK_BYTES:
+            self._schedule()
+        elif self._pending and self._timer is None:
+            self._timer = self._loop.call_later(_FLUSH_DELAY, self._schedule)
+
+    def _unindexed(self) -> List[Tuple[int, bytes]]:
+        """(offset, raw output) runs not in a block yet, oldest first"""
+        runs: List[Tuple[int, bytes]] = []
+        if self._job_input is not None:
+            runs.append(self._job_input)
+        elif self._partial:
+            runs.append((self._partial_offset, self._partial))
+        if self._pending:
+            pending = b"".join(self._pending)
+            if runs and runs[-1][0] + len(runs[-1][1]) == self._pending_offset:
+                runs[-1] = (runs[-1][0], runs[-1][1] + pending)
+            else:
+                runs.append((self._pending_offset, pending))
+        return runs
+
+    async def flush(self):
+        """Index the output received before the call (output arriving
+        meanwhile is left for later, so this returns under a flood too)"""
+        target = self._pending_offset + self._pending_bytes
+        while True:
+            if self._job is not None:
+                if self._job_input[0] >= target:
+                    break
+                if self._job.done():
+                    await asyncio.sleep(0)  # let _job_done run
+                else:
+                    await asyncio.shield(self._job)
+            elif self._pending and self._pending_offset < target:
+                self._schedule()
+            else:
+                break
+
+    async def search(self, query: str, limit: int = 100) -> Tuple[List[dict], float]:
+        """Newest-first matching lines; returns results and elapsed milliseconds.
+
+        Does not wait for indexing: output not in a block yet is scanned
+        directly (at most ``backlog_bytes`` plus the batch being indexed).
+        """
+        started = time.perf_counter()
+        blocks = list(self._blocks)
+        results = await asyncio.get_running_loop().run_in_executor(
+            None, _search_blocks, blocks, self._unindexed(), query, limit
+        )
+        return results, (time.perf_counter() - started) * 1000
+
+    def stats(self) -> dict:
+        """Index size and coverage"""
+        return {
+            "blocks": len(self._blocks),
+            "lines": sum(len(block.offsets) for block in self._blocks),
+            "text_bytes": self.text_bytes,
+            "compressed_bytes": sum(len(block.text) for block in self._blocks),
+            "oldest_offset": self._blocks[0].offsets[0] if self._blocks else None,
+            "pending_bytes": self._pending_bytes,
+            "dropped_bytes": self.dropped_bytes,
+            "evicted_lines": self.evicted_lines,
+        }
+
+
+def _split_lines(offset: int, data: bytes) -> Tuple[array, List[str]]:
+    """Stream offsets and ANSI-stripped text of the non-blank lines in data"""
+    offsets = array("Q")
+    lines: List[str] = []
+    raw_lines = data.split(b"\n")
+    stripped = _ANSI_RE.sub(b"", data).split(b"\n")
+    position = offset
+    for raw, line in zip(raw_lines, stripped):
+        if line.strip():
+            offsets.append(position)
+            lines.append(line[:_MAX_LINE_BYTES].decode("utf-8", errors="replace"))
+        position += len(raw) + 1
+    return offsets, lines
+
+
+def _build(offset: int, data: bytes) -> Tuple[Optional[_Block], bytes, int]:
+    """Block of the complete lines in data, plus the unterminated last line
+    and its offset, kept for the next batch unless it is huge (executor)"""
+    cut = data.rfind(b"\n") + 1
+    if len(data) - cut > _MAX_LINE_BYTES:
+        cut = len(data)
+    offsets, lines = _split_lines(offset, data[:cut])
+    block = _Block(offsets, lines) if lines else None
+    return block, data[cut:], offset + cut
+
+
+def _search_blocks(blocks: List[_Block], unindexed: List[Tuple[int, bytes]],
+                   query: str, limit: int) -> List[dict]:
+    """Scan the unindexed output, then blocks newest first, decompressing
+    only filter hits"""
+    needle = query.lower()
+    keys = _query_keys(needle)
+    results: List[dict] = []
+
+    def scan(offsets, lines) -> bool:
+        for i in range(len(lines) - 1, -1, -1):
+            column = lines[i].lower().find(needle)
+            if column == -1:
+                continue
+            results.append({"offset": offsets[i], "column": column, "line": lines[i]})
+            if len(results) >= limit:
+                return True
+        return False
+
+    for offset, data in reversed(unindexed):
+        if scan(*_split_lines(offset, data)):
+            return results
+    for block in reversed(blocks):
+        if keys and not block.may_contain(keys):
+            continue
+        if scan(block.offsets, block.lines()):
+            return results
+    return results
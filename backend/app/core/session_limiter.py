@@ -0,0 +1,94 @@
+"""Admission control for terminal sessions"""
+import asyncio
+from typing import Dict, List, Optional
+
+from app.config import settings
+
+
+class SessionLimitExceeded(Exception):
+    """Raised when admission control refuses a new terminal session"""
+
+
+class SessionLimiter:
+    """Caps concurrent sessions globally and per client.
+
+    With the ``queue`` policy, callers over the limit wait (up to
+    ``timeout`` seconds) for a slot to free up; with ``reject`` they fail
+    immediately.
+    """
+
+    def __init__(
+        self,
+        max_sessions: Optional[int] = None,
+        max_per_client: Optional[int] = None,
+        policy: Optional[str] = None,
+        timeout: Optional[float] = None,
+    ):
+        self.max_sessions = max_sessions or settings.terminal_max_sessions
+        self.max_per_client = max_per_client or settings.terminal_max_sessions_per_client
+        self.policy = policy or settings.terminal_admission_policy
+        self.timeout = settings.terminal_admission_timeout if timeout is None else timeout
+
+        self.active = 0
+        self._per_client: Dict[str, int] = {}
+        self._waiters: List[asyncio.Future] = []
+
+        # Counters
+        self.admitted = 0
+        self.rejected = 0
+
+    def has_room(self, client: str) -> bool:
+        return (
+            self.active < self.max_sessions
+            and self._per_client.get(client, 0) < self.max_per_client
+        )
+
+    async def acquire(self, client: str):
+        """Reserve a session slot for client, queueing or rejecting when full"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.timeout
+
+        while not self.has_room(client):
+            if self.policy == "reject":
+                self.rejected += 1
+                raise SessionLimitExceeded("Terminal session limit reached")
+
+            waiter = loop.create_future()
+            self._waiters.append(waiter)
+            try:
+                await asyncio.wait_for(waiter, max(0.0, deadline - loop.time()))
+            except asyncio.TimeoutError:
+                self.rejected += 1
+                raise SessionLimitExceeded("Timed out waiting for a terminal session slot")
+            finally:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+
+        self.active += 1
+        self._per_client[client] = self._per_client.get(client, 0) + 1
+        self.admitted += 1
+
+    def release(self, client: str):
+        """Free a slot and wake queued callers so they can re-check"""
+        if self._per_client.get(client, 0) <= 0:
+            return
+        self.active -= 1
+        self._per_client[client] -= 1
+        if not self._per_client[client]:
+            del self._per_client[client]
+        for waiter in self._waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+    def stats(self) -> dict:
+        """Current usage and admission counters"""
+        return {
+            "policy": self.policy,
+            "max_sessions": self.max_sessions,
+            "max_per_client": self.max_per_client,
+            "active": self.active,
+            "per_client": dict(self._per_client),
+            "queued": len(self._waiters),
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+        }
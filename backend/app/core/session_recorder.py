@@ -0,0 +1,262 @@
+"""Session recording in asciicast v2 format with a seekable time index"""
+import asyncio
+import bisect
+import codecs
+import json
+import mmap
+import os
+import struct
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from app.config import settings
+
+# Sidecar index record: elapsed seconds, byte offset of the event line in the .cast file
+_INDEX_ENTRY = struct.Struct(">dQ")
+
+# One writer thread keeps appends to each file in order
+_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="session-recorder")
+
+
+def recording_paths(session_id: str, directory: Optional[str] = None) -> Tuple[Path, Path]:
+    """Paths of a session's recording and its time index"""
+    base = Path(directory or settings.terminal_recording_dir)
+    return base / f"{session_id}.cast", base / f"{session_id}.idx"
+
+
+class SessionRecorder:
+    """Records a session's output, input and resizes to an asciicast file.
+
+    Events are encoded on the event loop and buffered; a background task
+    hands the buffer to a writer thread every ``flush_interval`` seconds (or
+    sooner once it grows large). Every ``index_interval`` seconds of session
+    time an entry mapping the elapsed time to the byte offset of the next
+    event line is appended to the ``.idx`` sidecar, so a replay can seek
+    without scanning the recording from the start.
+    """
+
+    def __init__(
+        self,
+        session_id: str,
+        cols: int,
+        rows: int,
+        directory: Optional[str] = None,
+        flush_interval: Optional[float] = None,
+        index_interval: Optional[float] = None,
+    ):
+        self.cast_path, self.index_path = recording_paths(session_id, directory)
+        self.flush_interval = flush_interval or settings.terminal_recording_flush_interval
+        self.index_interval = index_interval or settings.terminal_recording_index_interval
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self._started = time.monotonic()
+        self._next_index = 0.0
+        self._offset = 0  # bytes of .cast encoded so far
+        self._lines: List[bytes] = []
+        self._index: List[bytes] = []
+        self._buffered = 0
+        self._flush_needed = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self.closed = False
+
+        header = {
+            "version": 2,
+            "width": cols,
+            "height": rows,
+            "timestamp": int(time.time()),
+            "env": {"SHELL": os.environ.get("SHELL", "/bin/bash"), "TERM": "xterm-256color"},
+        }
+        self._append(json.dumps(header).encode("utf-8") + b"\n")
+
+    def start(self):
+        """Create the recording files and start the flush task"""
+        self.cast_path.parent.mkdir(parents=True, exist_ok=True)
+        self._task = asyncio.create_task(self._flush_loop())
+
+    def record_output(self, data: bytes):
+        """Record PTY output"""
+        text = self._decoder.decode(data)
+        if text:
+            self._event("o", text)
+
+    def record_input(self, data: bytes):
+        """Record input written to the PTY"""
+        self._event("i", data.decode("utf-8", errors="replace"))
+
+    def record_resize(self, cols: int, rows: int):
+        """Record a terminal resize"""
+        self._event("r", f"{cols}x{rows}")
+
+    def _event(self, kind: str, data: str):
+        if self.closed:
+            return
+        elapsed = time.monotonic() - self._started
+        if elapsed >= self._next_index:
+            self._index.append(_INDEX_ENTRY.pack(elapsed, self._offset))
+            self._next_index = elapsed + self.index_interval
+        self._append(json.dumps([round(elapsed, 6), kind, data]).encode("utf-8") + b"\n")
+
+    def _append(self, line: bytes):
+        self._lines.append(line)
+        self._offset += len(line)
+        self._buffered += len(line)
+        if self._buffered >= settings.terminal_max_frame_bytes:
+            self._flush_needed.set()
+
+    async def _flush_loop(self):
+        """Periodically hand buffered events to the writer thread"""
+        try:
+            while True:
+                try:
+                    await asyncio.wait_for(self._flush_needed.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._flush_needed.clear()
+                await self.flush()
+        except asyncio.CancelledError:
+            pass
+
+    async def flush(self):
+        """Write buffered events without blocking the event loop"""
+        lines, index = self._take()
+        if lines or index:
+            await asyncio.get_running_loop().run_in_executor(
+                _writer, self._write, lines, index
+            )
+
+    def _take(self) -> Tuple[List[bytes], List[bytes]]:
+        lines, self._lines = self._lines, []
+        index, self._index = self._index, []
+        self._buffered = 0
+        return lines, index
+
+    def _write(self, lines: List[bytes], index: List[bytes]):
+        """Append to the recording and its index (runs on the writer thread)"""
+        try:
+            if lines:
+                with open(self.cast_path, "ab") as f:
+                    f.write(b"".join(lines))
+            if index:
+                with open(self.index_path, "ab") as f:
+                    f.write(b"".join(index))
+        except OSError as e:
+            print(f"Session recording error: {e}")
+
+    def close(self):
+        """Stop recording; whatever is still buffered is written in the background"""
+        if self.closed:
+            return
+        tail = self._decoder.decode(b"", final=True)
+        if tail:
+            self._event("o", tail)
+        self.closed = True
+        if self._task:
+            self._task.cancel()
+        lines, index = self._take()
+        if lines or index:
+            _writer.submit(self._write, lines, index)
+
+
+def list_recordings(directory: Optional[str] = None) -> List[dict]:
+    """Recordings on disk with their size and duration"""
+    base = Path(directory or settings.terminal_recording_dir)
+    if not base.is_dir():
+        return []
+    recordings = []
+    for cast_path in sorted(base.glob("*.cast"), key=lambda p: p.stat().st_mtime, reverse=True):
+        index_path = cast_path.with_suffix(".idx")
+        duration = 0.0
+        if index_path.exists():
+            size = index_path.stat().st_size
+            if size >= _INDEX_ENTRY.size:
+                with open(index_path, "rb") as f:
+                    f.seek(size - size % _INDEX_ENTRY.size - _INDEX_ENTRY.size)
+                    duration, _ = _INDEX_ENTRY.unpack(f.read(_INDEX_ENTRY.size))
+        recordings.append({
+            "session_id": cast_path.stem,
+            "size_bytes": cast_path.stat().st_size,
+            "indexed_seconds": round(duration, 3),
+            "modified": cast_path.stat().st_mtime,
+        })
+    return recordings
+
+
+def read_recording(
+    session_id: str,
+    start: float = 0.0,
+    end: Optional[float] = None,
+    max_bytes: int = 4 * 1024 * 1024,
+    directory: Optional[str] = None,
+) -> Optional[bytes]:
+    """Asciicast text holding the header and the events between start and end.
+
+    Seeks with the time index and a memory-mapped view of the recording,
+    so only the requested part of the file is touched. Blocking; run it
+    in an executor. Returns None if the recording does not exist.
+    """
+    cast_path, index_path = recording_paths(session_id, directory)
+    if not cast_path.exists() or cast_path.stat().st_size == 0:
+        return None
+
+    with open(cast_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        header_end = data.find(b"\n")
+        if header_end == -1:
+            return None
+        out = [data[:header_end + 1]]
+
+        position = _seek(index_path, start, len(data)) or header_end + 1
+        size = 0
+        while position < len(data) and size < max_bytes:
+            line_end = data.find(b"\n", position)
+            if line_end == -1:
+                break  # event still being written
+            line = data[position:line_end + 1]
+            position = line_end + 1
+            elapsed = _event_time(line)
+            if elapsed is None or elapsed < start:
+                continue
+            if end is not None and elapsed > end:
+                break
+            out.append(line)
+            size += len(line)
+        return b"".join(out)
+
+
+def _seek(index_path: Path, start: float, limit: int) -> int:
+    """Byte offset of the last indexed event at or before start (0 if none)"""
+    if start <= 0 or not index_path.exists():
+        return 0
+    size = index_path.stat().st_size
+    count = size // _INDEX_ENTRY.size
+    if not count:
+        return 0
+    with open(index_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as index:
+        times = _IndexTimes(index, count)
+        slot = bisect.bisect_right(times, start) - 1
+        if slot < 0:
+            return 0
+        _, offset = _INDEX_ENTRY.unpack_from(index, slot * _INDEX_ENTRY.size)
+    return offset if offset < limit else 0
+
+
+class _IndexTimes:
+    """Sequence view over the times in a mapped index (for bisect)"""
+
+    def __init__(self, index: mmap.mmap, count: int):
+        self._index = index
+        self._count = count
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __getitem__(self, i: int) -> float:
+        return _INDEX_ENTRY.unpack_from(self._index, i * _INDEX_ENTRY.size)[0]
+
+
+def _event_time(line: bytes) -> Optional[float]:
+    """Elapsed time of an event line without decoding the whole event"""
+    try:
+        return float(line[1:line.index(b",")])
+    except ValueError:
+        return None
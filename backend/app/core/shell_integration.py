@@ -0,0 +1,170 @@
+"""Shell integration: command boundary markers emitted by the PTY shell"""
+import os
+import re
+import tempfile
+import time
+from typing import Callable, List, Optional
+
+# Sourced instead of ~/.bashrc (via --rcfile). Emits OSC 133-style markers:
+#   133;C            command is about to run (printed from PS0)
+#   633;E;<cmd>      command line of the command that just finished
+#   133;D;<status>   command finished with exit status
+#   633;P;Cwd=<dir>  current directory at the prompt
+#   133;A            prompt start
+BASH_INTEGRATION = r'''
+[ -f /etc/bash.bashrc ] && . /etc/bash.bashrc
+[ -f ~/.bashrc ] && . ~/.bashrc
+
+__st_escape() {
+    local value=$1
+    value=${value//\\/\\\\}
+    value=${value//$'\n'/\\x0a}
+    value=${value//$'\a'/\\x07}
+    value=${value//$'\e'/\\x1b}
+    builtin printf '%s' "$value"
+}
+
+__st_prompt_command() {
+    local status=$? entry
+    entry=$(HISTTIMEFORMAT= builtin history 1)
+    # An unchanged history number means the command was not recorded
+    # (HISTCONTROL=ignorespace etc.); report it as empty
+    if [[ $entry =~ ^\ *([0-9]+)\*?\ +(.*)$ ]] && [[ ${BASH_REMATCH[1]} != "$__st_last_hist" ]]; then
+        __st_last_hist=${BASH_REMATCH[1]}
+        entry=${BASH_REMATCH[2]}
+    else
+        entry=
+    fi
+    builtin printf '\e]633;E;%s\a\e]133;D;%s\a\e]633;P;Cwd=%s\a\e]133;A\a' \
+        "$(__st_escape "$entry")" "$status" "$(__st_escape "$PWD")"
+    return $status
+}
+
+if [[ "$PROMPT_COMMAND" != *__st_prompt_command* ]]; then
+    PROMPT_COMMAND="__st_prompt_command${PROMPT_COMMAND:+; $PROMPT_COMMAND}"
+fi
+PS0="${PS0}\e]133;C\a"
+'''
+
+_rcfile_path: Optional[str] = None
+
+# ESC ] <133|633> ; <payload> terminated by BEL or ESC \
+_OSC_RE = re.compile(rb"\x1b\](133|633);([^\x07\x1b]*)(?:\x07|\x1b\\)")
+_ESCAPE_RE = re.compile(r"\\(\\|x[0-9a-fA-F]{2})")
+_MAX_PENDING = 64 * 1024
+
+
+def bash_rcfile() -> str:
+    """Write the bash integration script once per process and return its path"""
+    global _rcfile_path
+    if _rcfile_path is None or not os.path.exists(_rcfile_path):
+        fd, path = tempfile.mkstemp(prefix="smart-terminal-", suffix=".bashrc")
+        with os.fdopen(fd, "w") as f:
+            f.write(BASH_INTEGRATION)
+        _rcfile_path = path
+    return _rcfile_path
+
+
+def _unescape(value: str) -> str:
+    return _ESCAPE_RE.sub(
+        lambda m: "\\" if m.group(1) == "\\" else chr(int(m.group(1)[1:], 16)),
+        value,
+    )
+
+
+class ShellIntegrationParser:
+    """Parses command boundary markers out of the PTY output stream.
+
+    ``on_command(command, exit_code, started_at, duration, directory, output)``
+    is called for every command that ran; ``started_at`` is a wall-clock
+    timestamp taken when the start marker streamed past, and ``output`` the
+    raw bytes between the start marker and the next marker (the first
+    ``max_output`` of them).
+    """
+
+    def __init__(self, on_command: Callable[[str, int, float, float, str, bytes], None],
+                 max_output: int = 0):
+        self._on_command = on_command
+        self._max_output = max_output
+        self._output: List[bytes] = []
+        self._output_size = 0
+        self._capturing = False
+        self._pending = b""
+        self.cwd = ""
+        self._started_at: Optional[float] = None
+        self._started_mono = 0.0
+        self._start_cwd = ""
+        self._command: Optional[str] = None
+
+    def feed(self, data: bytes):
+        """Scan a chunk of output for markers"""
+        if self._pending:
+            data = self._pending + data
+            self._pending = b""
+        elif b"\x1b]" not in data and not data.endswith(b"\x1b"):
+            if self._capturing:
+                self._capture(data)
+            return
+
+        end = 0
+        for match in _OSC_RE.finditer(data):
+            if self._capturing:
+                # Output ends at the first marker after the command started
+                self._capture(data[end:match.start()])
+                self._capturing = False
+            self._handle(match.group(1), match.group(2))
+            end = match.end()
+
+        # Keep a trailing, unterminated sequence (or a lone ESC that may
+        # start one) for the next chunk
+        start = data.rfind(b"\x1b]", end)
+        if start == -1 and data.endswith(b"\x1b"):
+            start = len(data) - 1
+        keep = start != -1 and len(data) - start < _MAX_PENDING
+        if self._capturing:
+            self._capture(data[end:start] if keep else data[end:])
+        if keep:
+            self._pending = data[start:]
+
+    def _capture(self, data: bytes):
+        room = self._max_output - self._output_size
+        if data and room > 0:
+            self._output.append(data[:room])
+            self._output_size += min(len(data), room)
+
+    def _handle(self, kind: bytes, payload: bytes):
+        text = payload.decode("utf-8", errors="replace")
+        code, _, value = text.partition(";")
+
+        if kind == b"133" and code == "C":
+            self._started_at = time.time()
+            self._started_mono = time.monotonic()
+            self._start_cwd = self.cwd
+            self._command = None
+            self._output, self._output_size = [], 0
+            self._capturing = self._max_output > 0
+        elif kind == b"633" and code == "E":
+            self._command = _unescape(value)
+        elif kind == b"633" and code == "P" and value.startswith("Cwd="):
+            self.cwd = _unescape(value[4:])
+        elif kind == b"133" and code == "D":
+            # The prompt hook reports the command line right before D; a D
+            # without it is either a prompt redraw or the command's own output
+            if self._started_at is None or self._command is None:
+                return
+            started_at, self._started_at = self._started_at, None
+            if not self._command.strip():
+                return
+            try:
+                exit_code = int(value) if value else 0
+            except ValueError:
+                exit_code = 0
+            duration = time.monotonic() - self._started_mono
+            output, self._output, self._output_size = b"".join(self._output), [], 0
+            try:
+                self._on_command(
+                    self._command, exit_code, started_at, duration,
+                    self._start_cwd or self.cwd, output
+                )
+            except Exception as e:
+                print(f"Shell integration error: {e}")
@@ -0,0 +1,140 @@
+"""Pool of pre-spawned shells for instant terminal open"""
+import asyncio
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Optional, Set
+
+from app.config import settings
+
+
+class ShellPool:
+    """Keeps a few already-initialised shells warm in the background.
+
+    Shells are spawned off the event loop and start capturing output right
+    away, so by the time one is handed out its prompt is usually sitting in
+    the scrollback. The pool refills asynchronously after every handout.
+    """
+
+    def __init__(
+        self,
+        spawn: Callable[..., Awaitable[Any]],
+        discard: Callable[[Any], None],
+        size: Optional[int] = None,
+    ):
+        self._spawn = spawn  # spawn(cols, rows) -> started, reading PTYSession
+        self._discard = discard  # terminates a dead shell off the loop
+        self.size = settings.terminal_pool_size if size is None else size
+        self._idle: Deque = deque()
+        self._refill_task: Optional[asyncio.Task] = None
+        self._measure_tasks: Set[asyncio.Task] = set()
+
+        # Counters
+        self.hits = 0
+        self.misses = 0
+        self._spawn_to_prompt: Deque[float] = deque(maxlen=100)
+        self._connect_to_prompt: Deque[float] = deque(maxlen=100)
+
+    def start(self):
+        """Fill the pool in the background"""
+        self.refill()
+
+    def refill(self):
+        """Top the pool back up to its target size without blocking"""
+        if self.size <= 0:
+            return
+        if self._refill_task is None or self._refill_task.done():
+            self._refill_task = asyncio.create_task(self._refill())
+
+    async def _refill(self):
+        while len(self._idle) < self.size:
+            try:
+                session = await self._spawn()
+            except Exception as e:
+                print(f"Shell pool spawn error: {e}")
+                return
+            self._idle.append(session)
+            self._track_first_output(session, session.spawned_at, self._spawn_to_prompt)
+
+    async def acquire(self, cols: int = 80, rows: int = 24):
+        """Hand out a warm shell, or spawn one if the pool is empty"""
+        requested_at = time.monotonic()
+
+        session = None
+        while self._idle:
+            candidate = self._idle.popleft()
+            if candidate.is_alive() and not candidate.eof:
+                session = candidate
+                break
+            candidate.stop_reading()
+            self._discard(candidate)
+
+        if session is not None:
+            self.hits += 1
+            if (session.cols, session.rows) != (cols, rows):
+                session.resize(cols, rows)
+        else:
+            self.misses += 1
+            session = await self._spawn(cols=cols, rows=rows)
+            self._track_first_output(session, session.spawned_at, self._spawn_to_prompt)
+
+        self._track_first_output(session, requested_at, self._connect_to_prompt)
+        self.refill()
+        return session
+
+    def _track_first_output(self, session, since: float, samples: Deque[float]):
+        """Record how long after ``since`` the session printed its first output"""
+        if session.first_output.done():
+            samples.append(max(0.0, session.first_output.result() - since))
+            return
+
+        async def measure():
+            try:
+                first_output_at = await asyncio.wait_for(
+                    asyncio.shield(session.first_output), timeout=30
+                )
+            except (asyncio.TimeoutError, asyncio.CancelledError):
+                return
+            samples.append(max(0.0, first_output_at - since))
+
+        task = asyncio.create_task(measure())
+        self._measure_tasks.add(task)
+        task.add_done_callback(self._measure_tasks.discard)
+
+    def prune(self) -> list:
+        """Remove idle shells that died while waiting; returns them for cleanup"""
+        dead = [session for session in self._idle if not session.is_alive() or session.eof]
+        for session in dead:
+            self._idle.remove(session)
+            session.stop_reading()
+        if dead:
+            self.refill()
+        return dead
+
+    def drain(self) -> list:
+        """Stop refilling and hand back all idle shells for termination"""
+        if self._refill_task:
+            self._refill_task.cancel()
+        for task in list(self._measure_tasks):
+            task.cancel()
+        sessions = list(self._idle)
+        self._idle.clear()
+        for session in sessions:
+            session.stop_reading()
+        return sessions
+
+    def stats(self) -> dict:
+        """Pool hit rate and time-to-first-prompt metrics"""
+        lookups = self.hits + self.misses
+
+        def avg_ms(samples: Deque[float]) -> Optional[float]:
+            return round(sum(samples) / len(samples) * 1000, 1) if samples else None
+
+        return {
+            "size": self.size,
+            "idle": len(self._idle),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+            "avg_spawn_to_prompt_ms": avg_ms(self._spawn_to_prompt),
+            "avg_connect_to_prompt_ms": avg_ms(self._connect_to_prompt),
+        }
@@ -0,0 +1,157 @@
+"""LRU + TTL cache of AI suggestion responses"""
+import asyncio
+import hashlib
+import json
+import os
+import tempfile
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from app.config import settings
+from app.models.ai import SuggestionResponse
+
+Fetch = Callable[[], Awaitable[SuggestionResponse]]
+
+
+def prompt_key(kind: str, prompt: str, max_suggestions: int) -> str:
+    """Cache key of a built prompt: runs of whitespace count as one space"""
+    normalised = " ".join(prompt.split())
+    return hashlib.sha256(f"{kind}\0{max_suggestions}\0{normalised}".encode("utf-8")).hexdigest()
+
+
+class SuggestionCache:
+    """Suggestion responses reused for identical prompts.
+
+    Entries live for the TTL of their kind (``autocomplete`` or ``next``)
+    and the least recently used go once there are ``max_entries``. With
+    ``stale_seconds`` an expired entry is still served for that long while
+    a background request refreshes it. Concurrent misses on one key share
+    a single request, and empty responses (failed requests) are not kept.
+    With ``path`` set, entries are saved at shutdown and loaded at startup.
+    """
+
+    def __init__(
+        self,
+        max_entries: Optional[int] = None,
+        ttls: Optional[Dict[str, float]] = None,
+        stale_seconds: Optional[float] = None,
+        path: Optional[str] = None,
+    ):
+        self.max_entries = max_entries or settings.ai_cache_max_entries
+        self.ttls = ttls or {
+            "autocomplete": settings.ai_cache_autocomplete_ttl,
+            "next": settings.ai_cache_next_command_ttl,
+        }
+        self.stale_seconds = settings.ai_cache_stale_seconds if stale_seconds is None else stale_seconds
+        self.path = settings.ai_cache_file if path is None else path
+        # key -> (kind, stored at (epoch seconds), response as a dict)
+        self._entries: "OrderedDict[str, Tuple[str, float, Dict[str, Any]]]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+        # Counters
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.refreshes = 0
+
+    async def get(self, kind: str, key: str, fetch: Fetch) -> SuggestionResponse:
+        """The cached response for key, or the one fetch returns"""
+        entry = self._entries.get(key)
+        if entry is not None:
+            age = time.time() - entry[1]
+            ttl = self.ttls.get(kind, 0)
+            if age < ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return SuggestionResponse(**entry[2])
+            if age < ttl + self.stale_seconds:
+                self._entries.move_to_end(key)
+                self.stale_hits += 1
+                if key not in self._inflight:
+                    self.refreshes += 1
+                    self._start(kind, key, fetch)
+                return SuggestionResponse(**entry[2])
+            del self._entries[key]
+
+        self.misses += 1
+        future = self._inflight.get(key) or self._start(kind, key, fetch)
+        return await asyncio.shield(future)
+
+    def _start(self, kind: str, key: str, fetch: Fetch) -> asyncio.Future:
+        future = asyncio.ensure_future(self._fetch(kind, key, fetch))
+        self._inflight[key] = future
+        return future
+
+    async def _fetch(self, kind: str, key: str, fetch: Fetch) -> SuggestionResponse:
+        try:
+            response = await fetch()
+        finally:
+            self._inflight.pop(key, None)
+        if response.suggestions:
+            self.put(kind, key, response)
+        return response
+
+    def put(self, kind: str, key: str, response: SuggestionResponse, stored: Optional[float] = None):
+        self._entries[key] = (kind, stored or time.time(), response.model_dump())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self._entries.clear()
+
+    def load(self):
+        """Read the entries saved by the last run (still fresh or stale-servable ones)"""
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"⚠️  Could not load the suggestion cache from {self.path}: {e}")
+            return
+        now = time.time()
+        loaded = 0
+        for key, kind, stored, response in entries:
+            if now - stored < self.ttls.get(kind, 0) + self.stale_seconds:
+                self.put(kind, key, SuggestionResponse(**response), stored)
+                loaded += 1
+        if loaded:
+            print(f"💾 Loaded {loaded} cached suggestions")
+
+    def save(self):
+        """Write the entries to ``path`` (least recently used first)"""
+        if not self.path:
+            return
+        entries = [[key, kind, stored, response] for key, (kind, stored, response) in self._entries.items()]
+        directory = os.path.dirname(os.path.abspath(self.path))
+        try:
+            fd, temp = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(entries, f)
+            os.replace(temp, self.path)
+        except OSError as e:
+            print(f"⚠️  Could not save the suggestion cache to {self.path}: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.stale_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttls": self.ttls,
+            "stale_seconds": self.stale_seconds,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.hits + self.stale_hits) / lookups, 4) if lookups else 0,
+            "evictions": self.evictions,
+            "refreshes": self.refreshes,
+            "persistent": bool(self.path),
+        }
+
+
+# Global instance
+suggestion_cache = SuggestionCache()
@@ -0,0 +1,239 @@
+"""Multiplexing many terminal sessions over one WebSocket connection"""
+import asyncio
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, Optional, Tuple
+
+from fastapi import WebSocket
+
+from app.config import settings
+from app.core.output_pipeline import OutputPipeline
+from app.core.pty_manager import PTYSession, pty_manager
+from app.core.session_limiter import SessionLimitExceeded
+from app.core.terminal_protocol import JsonProtocol, MuxEvent, channel_protocol
+
+
+class FairScheduler:
+    """Deficit round-robin writer shared by the channels of one connection.
+
+    Every send goes through a single writer task. Channels with queued
+    frames are served in turn, each allowed up to ``quantum`` bytes per
+    round (unused credit carries over only while frames stay queued), so a
+    channel streaming large frames cannot starve the others. Callers wait
+    until their frame is written, which keeps each output pipeline to one
+    frame in flight and lets PTY backpressure work per channel.
+    """
+
+    def __init__(self, quantum: Optional[int] = None):
+        self.quantum = quantum or settings.terminal_max_frame_bytes
+        self._queues: Dict[int, Deque[Tuple[int, Callable[[], Awaitable[None]], asyncio.Future]]] = {}
+        self._active: Deque[int] = deque()  # channels with queued frames, in service order
+        self._deficit: Dict[int, int] = {}
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        """Start the writer task"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        """Stop the writer and fail everything still queued"""
+        if self._task and not self._task.done():
+            self._task.cancel()
+        for channel in list(self._queues):
+            self.discard(channel)
+
+    async def submit(self, channel: int, size: int, send: Callable[[], Awaitable[None]]):
+        """Queue a send for channel and wait until it has been written"""
+        future = asyncio.get_running_loop().create_future()
+        queue = self._queues.setdefault(channel, deque())
+        if not queue:
+            self._active.append(channel)
+        queue.append((size, send, future))
+        self._wakeup.set()
+        await future
+
+    def discard(self, channel: int):
+        """Drop a channel's queued sends"""
+        queue = self._queues.pop(channel, None)
+        self._deficit.pop(channel, None)
+        if channel in self._active:
+            self._active.remove(channel)
+        for _, _, future in queue or ():
+            if not future.done():
+                future.cancel()
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            while self._active:
+                channel = self._active.popleft()
+                queue = self._queues.get(channel)
+                if not queue:
+                    continue
+                deficit = self._deficit.get(channel, 0) + self.quantum
+                while queue and queue[0][0] <= deficit:
+                    size, send, future = queue.popleft()
+                    deficit -= size
+                    if future.done():
+                        continue  # the sender gave up (pipeline stopped)
+                    try:
+                        await send()
+                    except Exception as e:
+                        if not future.done():
+                            future.set_exception(e)
+                        continue
+                    if not future.done():
+                        future.set_result(None)
+                if queue:
+                    self._deficit[channel] = deficit
+                    self._active.append(channel)
+                else:
+                    self._deficit.pop(channel, None)
+            self._wakeup.clear()
+
+
+class MuxChannel:
+    """One terminal session attached to a channel of a multiplexed connection"""
+
+    def __init__(self, channel: int, protocol: JsonProtocol):
+        self.channel = channel
+        self.protocol = protocol
+        self.session: Optional[PTYSession] = None
+        self.pipeline: Optional[OutputPipeline] = None
+
+
+class TerminalMux:
+    """Opens, attaches, resizes and closes many PTY sessions over one socket.
+
+    Each channel gets its own output pipeline and wire-protocol state;
+    all writes are interleaved by a ``FairScheduler``. Channels are
+    opened in the background so a queued admission does not hold up
+    input to the other channels.
+    """
+
+    def __init__(self, websocket: WebSocket, protocol: JsonProtocol, client: str):
+        self.websocket = websocket
+        self.protocol = protocol
+        self.client = client
+        self.channels: Dict[int, MuxChannel] = {}
+        self.scheduler = FairScheduler()
+        self._opening: Dict[int, asyncio.Task] = {}
+
+    def start(self):
+        """Start the shared writer"""
+        self.scheduler.start()
+
+    async def handle(self, event: MuxEvent):
+        """Dispatch one client message"""
+        if event.type == "open":
+            if event.channel in self.channels or event.channel in self._opening:
+                await self._error(event.channel, "Channel already open")
+                return
+            task = asyncio.create_task(self._open(event))
+            self._opening[event.channel] = task
+            task.add_done_callback(lambda _: self._opening.pop(event.channel, None))
+            return
+
+        entry = self.channels.get(event.channel)
+        if entry is None:
+            await self._error(event.channel, "Unknown channel")
+            return
+        if event.type == "input":
+            entry.session.write(event.data)
+            await entry.session.drain()
+        elif event.type == "resize":
+            if event.cols and event.rows:
+                entry.session.resize(event.cols, event.rows)
+        elif event.type == "detach":
+            self._release(event.channel, end_session=False)
+            await self._send_control(event.channel, {"type": "detached"})
+        elif event.type == "close":
+            self._release(event.channel, end_session=True)
+            await self._send_control(event.channel, {"type": "closed"})
+
+    async def _open(self, event: MuxEvent):
+        """Attach a channel to an existing session or a newly admitted one"""
+        channel = event.channel
+        try:
+            session, reattached = await pty_manager.open_session(
+                event.session_id, event.cols or 80, event.rows or 24, self.client
+            )
+        except SessionLimitExceeded as e:
+            print(f"⛔ Terminal session refused for {self.client}: {e}")
+            await self._error(channel, str(e))
+            return
+        except Exception as e:
+            print(f"Failed to open channel {channel}: {e}")
+            await self._error(channel, "Failed to open terminal session")
+            return
+
+        entry = MuxChannel(channel, channel_protocol(self.protocol, channel))
+        entry.session = session
+        self.channels[channel] = entry
+
+        async def send_output(data: bytes, end_offset: int, snapshot: bool):
+            await self.scheduler.submit(
+                channel, len(data),
+                lambda: entry.protocol.send_output(self.websocket, data, end_offset, snapshot)
+            )
+
+        async def send_control(message: dict):
+            await self._send_control(channel, message, entry.protocol)
+
+        def on_pty_eof():
+            """The shell exited: end the channel"""
+            if self.channels.get(channel) is entry:
+                self._release(channel, end_session=True)
+                asyncio.create_task(self._send_control(channel, {"type": "closed"}))
+
+        entry.pipeline = OutputPipeline(
+            session, send_output, on_eof=on_pty_eof, control=send_control,
+            offset=event.offset if reattached else None
+        )
+        await send_control({
+            "type": "connected",
+            "session_id": session.session_id,
+            "pid": session.pid,
+            "protocol": self.protocol.name,
+            "reattached": reattached,
+            "offset": entry.pipeline.cursor,
+            "skipped_bytes": entry.pipeline.skipped_bytes,
+            "snapshot": entry.pipeline.starts_with_snapshot
+        })
+        entry.pipeline.start()
+
+    def _release(self, channel: int, end_session: bool):
+        """Stop streaming a channel; close its session or leave it detached"""
+        entry = self.channels.pop(channel, None)
+        if entry is None:
+            return
+        if entry.pipeline:
+            entry.pipeline.stop()
+        self.scheduler.discard(channel)
+        session = entry.session
+        if end_session or session.eof or not session.is_alive():
+            print(f"Closing terminal session: {session.session_id}")
+            pty_manager.close_session(session.session_id)
+        else:
+            print(f"⏸️  Terminal session detached: {session.session_id}")
+
+    async def _send_control(
+        self, channel: int, message: dict, protocol: Optional[JsonProtocol] = None
+    ):
+        """Send a channel-tagged control message through the scheduler"""
+        protocol = protocol or channel_protocol(self.protocol, channel)
+        await self.scheduler.submit(
+            channel, 0, lambda: protocol.send_control(self.websocket, message)
+        )
+
+    async def _error(self, channel: int, message: str):
+        await self._send_control(channel, {"type": "error", "message": message})
+
+    def close(self):
+        """Connection gone: detach every channel (sessions stay reattachable)"""
+        for task in list(self._opening.values()):
+            task.cancel()
+        for channel in list(self.channels):
+            self._release(channel, end_session=False)
+        self.scheduler.stop()
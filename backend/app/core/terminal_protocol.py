@@ -0,0 +1,205 @@
+"""Terminal WebSocket wire protocols (JSON and binary)"""
+import codecs
+import json
+import struct
+from typing import NamedTuple, Optional
+
+from fastapi import WebSocket
+
+from app.models.terminal import MuxMessage, TerminalMessage
+
+# Subprotocol name offered in Sec-WebSocket-Protocol to select binary framing
+BINARY_SUBPROTOCOL = "smart-terminal.binary.v1"
+
+# Binary frame opcodes (first byte of every binary message)
+OP_INPUT = 0x00
+OP_OUTPUT = 0x01
+OP_RESIZE = 0x02
+OP_CLOSE = 0x03
+OP_LEAVE = 0x04
+
+_RESIZE = struct.Struct(">HH")  # cols, rows
+_CHANNEL = struct.Struct(">H")  # multiplexed frames: channel id after the opcode
+
+
+class ClientEvent(NamedTuple):
+    """A decoded client → server message"""
+    type: str  # 'input', 'resize', 'close', 'leave'
+    data: bytes = b""
+    cols: Optional[int] = None
+    rows: Optional[int] = None
+
+
+class MuxEvent(NamedTuple):
+    """A decoded client → server message on the multiplexed endpoint"""
+    channel: int
+    type: str  # 'open', 'input', 'resize', 'detach', 'close'
+    data: bytes = b""
+    cols: Optional[int] = None
+    rows: Optional[int] = None
+    session_id: Optional[str] = None
+    offset: Optional[int] = None
+
+
+class JsonProtocol:
+    """Default protocol: JSON text frames.
+
+    Output is decoded with an incremental UTF-8 decoder so multi-byte
+    characters split across PTY reads are not mangled.
+    """
+
+    name = "json"
+
+    def __init__(self):
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+    async def send_output(
+        self, websocket: WebSocket, data: bytes, offset: int, snapshot: bool = False
+    ):
+        """Send a chunk of PTY output ending at the given stream offset.
+
+        A snapshot is a rendered screen that replaces the output up to offset.
+        """
+        if snapshot:
+            self._decoder.reset()
+            await self.send_control(websocket, {
+                "type": "output",
+                "data": data.decode("utf-8", errors="replace"),
+                "offset": offset,
+                "snapshot": True
+            })
+            return
+        text = self._decoder.decode(data)
+        if text:
+            # Bytes of a split character held by the decoder are not delivered yet
+            offset -= len(self._decoder.getstate()[0])
+            await self.send_control(
+                websocket, {"type": "output", "data": text, "offset": offset}
+            )
+
+    async def send_control(self, websocket: WebSocket, message: dict):
+        """Send a control message (session info, errors)"""
+        await websocket.send_text(json.dumps(message))
+
+    def decode(self, message: dict) -> Optional[ClientEvent]:
+        """Decode a raw ASGI websocket.receive message"""
+        if message.get("bytes") is not None:
+            return decode_binary(message["bytes"])
+        text = message.get("text")
+        if text is None:
+            return None
+        parsed = TerminalMessage.model_validate_json(text)
+        return ClientEvent(
+            type=parsed.type,
+            data=parsed.data.encode("utf-8") if parsed.data else b"",
+            cols=parsed.cols,
+            rows=parsed.rows,
+        )
+
+
+class BinaryProtocol(JsonProtocol):
+    """Binary protocol: one opcode byte followed by raw bytes.
+
+    Output is forwarded without decoding; control messages still travel as
+    JSON text frames since they are rare.
+    """
+
+    name = "binary"
+
+    async def send_output(
+        self, websocket: WebSocket, data: bytes, offset: int, snapshot: bool = False
+    ):
+        """Send a chunk of PTY output; clients track offsets by counting bytes.
+
+        A snapshot frame is announced by a ``snapshot`` control message that
+        carries the offset the client should continue counting from.
+        """
+        if snapshot:
+            await self.send_control(websocket, {"type": "snapshot", "offset": offset})
+        await websocket.send_bytes(self._frame(OP_OUTPUT, data))
+
+    def _frame(self, opcode: int, payload: bytes) -> bytes:
+        return bytes((opcode,)) + payload
+
+
+class _ChannelMixin:
+    """Tags every message of a protocol with a multiplexed channel id"""
+
+    def __init__(self, channel: int):
+        super().__init__()
+        self.channel = channel
+
+    async def send_control(self, websocket: WebSocket, message: dict):
+        await websocket.send_text(json.dumps({**message, "channel": self.channel}))
+
+    def _frame(self, opcode: int, payload: bytes) -> bytes:
+        return bytes((opcode,)) + _CHANNEL.pack(self.channel) + payload
+
+
+class ChannelJsonProtocol(_ChannelMixin, JsonProtocol):
+    """JSON protocol for one channel of a multiplexed connection"""
+
+
+class ChannelBinaryProtocol(_ChannelMixin, BinaryProtocol):
+    """Binary protocol for one channel: the opcode is followed by a uint16 channel id"""
+
+
+def decode_binary(frame: bytes) -> Optional[ClientEvent]:
+    """Decode a binary client frame"""
+    if not frame:
+        return None
+    opcode = frame[0]
+    if opcode == OP_INPUT:
+        return ClientEvent(type="input", data=frame[1:])
+    if opcode == OP_RESIZE and len(frame) >= 1 + _RESIZE.size:
+        cols, rows = _RESIZE.unpack_from(frame, 1)
+        return ClientEvent(type="resize", cols=cols, rows=rows)
+    if opcode == OP_CLOSE:
+        return ClientEvent(type="close")
+    if opcode == OP_LEAVE:
+        return ClientEvent(type="leave")
+    return None
+
+
+def decode_mux(message: dict) -> Optional[MuxEvent]:
+    """Decode a raw ASGI websocket.receive message on the multiplexed endpoint"""
+    frame = message.get("bytes")
+    if frame is not None:
+        if len(frame) < 1 + _CHANNEL.size:
+            return None
+        (channel,) = _CHANNEL.unpack_from(frame, 1)
+        event = decode_binary(frame[:1] + frame[1 + _CHANNEL.size:])
+        if event is None:
+            return None
+        return MuxEvent(channel, event.type, event.data, event.cols, event.rows)
+    text = message.get("text")
+    if text is None:
+        return None
+    parsed = MuxMessage.model_validate_json(text)
+    return MuxEvent(
+        channel=parsed.channel,
+        type=parsed.type,
+        data=parsed.data.encode("utf-8") if parsed.data else b"",
+        cols=parsed.cols,
+        rows=parsed.rows,
+        session_id=parsed.session_id,
+        offset=parsed.offset,
+    )
+
+
+def channel_protocol(protocol: JsonProtocol, channel: int) -> JsonProtocol:
+    """Per-channel variant of a negotiated protocol (each keeps its own decoder)"""
+    if isinstance(protocol, BinaryProtocol):
+        return ChannelBinaryProtocol(channel)
+    return ChannelJsonProtocol(channel)
+
+
+def negotiate_protocol(websocket: WebSocket) -> tuple[JsonProtocol, Optional[str]]:
+    """Pick the wire protocol from the client's offered subprotocols.
+
+    Returns the protocol and the subprotocol to echo back on accept.
+    """
+    offered = websocket.scope.get("subprotocols") or []
+    if BINARY_SUBPROTOCOL in offered:
+        return BinaryProtocol(), BINARY_SUBPROTOCOL
+    return JsonProtocol(), None
@@ -0,0 +1,44 @@
+"""Per-session output throughput governor"""
+
+
+class ThroughputGovernor:
+    """Decides when a session's output is too fast to stream in full.
+
+    The output rate is measured over fixed windows. A window at or above
+    ``limit`` bytes/sec (or one in which the PTY reader spent at least half
+    the time paused on a slow client) switches the session to summarised
+    mode; it switches back once a window drops below ``limit * resume_ratio``.
+    """
+
+    def __init__(self, limit: float, window: float = 0.5, resume_ratio: float = 0.5):
+        self.limit = limit
+        self.window = window
+        self.resume_ratio = resume_ratio
+        self.throttled = False
+        self.rate = 0.0
+        self.throttle_count = 0
+        self._window_start: float = -1.0
+        self._window_bytes = 0
+
+    def update(self, now: float, nbytes: int = 0, stalled: float = 0.0) -> bool:
+        """Account for nbytes of output; returns True when the mode changes"""
+        if self._window_start < 0:
+            self._window_start = now
+        self._window_bytes += nbytes
+        elapsed = now - self._window_start
+        if elapsed < self.window:
+            return False
+
+        self.rate = self._window_bytes / elapsed
+        self._window_start = now
+        self._window_bytes = 0
+
+        if not self.throttled:
+            if self.rate >= self.limit or stalled >= elapsed / 2:
+                self.throttled = True
+                self.throttle_count += 1
+                return True
+        elif self.rate < self.limit * self.resume_ratio:
+            self.throttled = False
+            return True
+        return False
@@ -6,6 +6,11 @@ from contextlib import asynccontextmanager
 from app.config import settings
 from app.api.routes import terminal, resources, ai, history
 from app.core.database import init_db
+from app.core.history_service import history_service
+from app.core.local_completion import local_completer
+from app.core.pty_manager import pty_manager
+from app.core.screen_model import is_available as screen_model_available
+from app.core.suggestion_cache import suggestion_cache
 
 
 @asynccontextmanager
@@ -13,11 +18,24 @@ async def lifespan(app: FastAPI):
     """Application lifespan events"""
     # Startup
     await init_db()
+    await history_service.start()
+    suggestion_cache.load()
+    local_completer.start()
+    if not settings.groq_api_key:
+        print("⚠️  GROQ_API_KEY is not set; only local autocomplete is available")
+    if settings.terminal_screen_model and not screen_model_available():
+        print("⚠️  terminal_screen_model is enabled but pyte is not installed; disabled")
+    pty_manager.start_reaper()
+    pty_manager.pool.start()
     print(f"🚀 {settings.app_name} starting...")
     print(f"📡 Backend running on {settings.backend_host}:{settings.backend_port}")
     yield
     # Shutdown
     print("👋 Shutting down...")
+    await pty_manager.shutdown()
+    local_completer.stop()
+    await history_service.close()
+    suggestion_cache.save()
 
 
 app = FastAPI(
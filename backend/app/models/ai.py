@@ -6,6 +6,7 @@ from typing import List, Optional
 class AutocompleteRequest(BaseModel):
     """Request model for autocomplete"""
     current_input: str
+    wait_for_ai: bool = False  # wait for the AI suggestions instead of returning local ones at once
 
 class CommandContext(BaseModel):
     """Context for AI command suggestions"""
@@ -13,6 +14,7 @@ class CommandContext(BaseModel):
     command_history: List[str] = []
     current_directory: str
     last_output: Optional[str] = None
+    last_output_hash: Optional[str] = None  # output store key, used when last_output is not sent
     git_status: Optional[str] = None
 
 
@@ -27,3 +29,4 @@ class SuggestionResponse(BaseModel):
     """Response containing command suggestions"""
     suggestions: List[CommandSuggestion]
     reasoning: Optional[str] = None
+    pending: bool = False  # AI suggestions still on their way: ask again with wait_for_ai
@@ -15,6 +15,7 @@ class CommandRecord(BaseModel):
     timestamp: datetime
     directory: str
     is_favorite: bool = False
+    output: Optional[str] = None
 
 
 class CommandSequence(BaseModel):
@@ -5,12 +5,20 @@ from typing import Optional
 
 class TerminalMessage(BaseModel):
     """WebSocket message model"""
-    type: str  # 'input', 'output', 'resize', 'close'
+    type: str  # 'input', 'output', 'resize', 'close', 'leave'
     data: Optional[str] = None
     cols: Optional[int] = None
     rows: Optional[int] = None
 
 
+class MuxMessage(TerminalMessage):
+    """Multiplexed WebSocket message model; ``channel`` selects the terminal"""
+    type: str  # 'open', 'input', 'resize', 'detach', 'close'
+    channel: int
+    session_id: Optional[str] = None  # open: reattach to this session
+    offset: Optional[int] = None  # open: output bytes already received
+
+
 class TerminalSession(BaseModel):
     """Terminal session information"""
     session_id: str
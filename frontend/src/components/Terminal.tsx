@@ -5,6 +5,10 @@ import { WebLinksAddon } from '@xterm/addon-web-links'
 import '@xterm/xterm/css/xterm.css'
 import { api } from '@/lib/api'
 
+const SESSION_STORAGE_KEY = 'terminal-session'
+const RECONNECT_MIN_MS = 500
+const RECONNECT_MAX_MS = 10000
+
 interface Suggestion {
   command: string
   description: string
@@ -21,6 +25,7 @@ export default function Terminal() {
   const [currentInput, setCurrentInput] = useState('')
   const [selectedIndex, setSelectedIndex] = useState(0)
   const debounceTimerRef = useRef<NodeJS.Timeout | null>(null)
+  const suggestionInputRef = useRef('')
 
   useEffect(() => {
     if (!terminalRef.current) {
@@ -55,48 +60,99 @@ export default function Terminal() {
     xtermRef.current = term
     fitAddonRef.current = fitAddon
 
-    // Connect WebSocket
-    const ws = new WebSocket(api.getTerminalWebSocketUrl())
+    // The tab's session outlives the socket: reconnect to it after a
+    // dropped connection (resuming at the last offset received) or a reload
+    const saved = JSON.parse(sessionStorage.getItem(SESSION_STORAGE_KEY) || 'null')
+    let sessionId: string | null = saved?.sessionId ?? null
+    let offset: number | null = null // a fresh terminal is empty: replay the scrollback
+    let leaving = false
+    let retryDelay = RECONNECT_MIN_MS
+    let retryTimer: ReturnType<typeof setTimeout> | null = null
 
-    ws.onopen = () => {
-      console.log('WebSocket connected')
-      setIsConnected(true)
-      // On connection, resize the terminal
-      setTimeout(() => handleResize(), 1)
+    const saveSession = () => {
+      if (sessionId) {
+        sessionStorage.setItem(SESSION_STORAGE_KEY, JSON.stringify({ sessionId, offset }))
+      }
     }
 
-    ws.onmessage = (event) => {
-      const data = JSON.parse(event.data)
-      
-      if (data.type === 'output') {
-        term.write(data.data)
-      } else if (data.type === 'connected') {
-        console.log('Terminal session:', data.session_id)
+    const connect = () => {
+      const ws = new WebSocket(api.getTerminalWebSocketUrl(sessionId, offset))
+
+      ws.onopen = () => {
+        console.log('WebSocket connected')
+        setIsConnected(true)
+        // On connection, resize the terminal
+        setTimeout(() => handleResize(), 1)
       }
-    }
 
-    ws.onclose = () => {
-      console.log('WebSocket disconnected')
-      setIsConnected(false)
-      term.writeln('\r\n\x1b[31mConnection closed\x1b[0m')
+      ws.onmessage = (event) => {
+        const data = JSON.parse(event.data)
+
+        if (data.type === 'output') {
+          if (data.snapshot) {
+            term.reset()
+          }
+          term.write(data.data)
+          offset = data.offset
+          saveSession()
+        } else if (data.type === 'connected') {
+          console.log('Terminal session:', data.session_id)
+          if (sessionId && !data.reattached) {
+            term.writeln('\r\n\x1b[33mPrevious session ended, started a new one\x1b[0m')
+          }
+          sessionId = data.session_id
+          offset = data.offset
+          retryDelay = RECONNECT_MIN_MS
+          saveSession()
+        } else if (data.type === 'error') {
+          console.error('Terminal error:', data.message)
+        }
+      }
+
+      ws.onclose = () => {
+        console.log('WebSocket disconnected')
+        setIsConnected(false)
+        if (leaving) {
+          return
+        }
+        term.writeln('\r\n\x1b[31mConnection closed, reconnecting...\x1b[0m')
+        retryTimer = setTimeout(connect, retryDelay)
+        retryDelay = Math.min(retryDelay * 2, RECONNECT_MAX_MS)
+      }
+
+      ws.onerror = (error) => {
+        console.error('WebSocket error:', error)
+      }
+
+      wsRef.current = ws
     }
 
-    ws.onerror = (error) => {
-      console.error('WebSocket error:', error)
+    const send = (message: object) => {
+      const ws = wsRef.current
+      if (ws && ws.readyState === WebSocket.OPEN) {
+        ws.send(JSON.stringify(message))
+      }
     }
 
-    wsRef.current = ws
+    // Leaving the page (closing the tab, navigating away or reloading):
+    // the server closes the session unless a reload reattaches within its grace period
+    const handlePageHide = (event: PageTransitionEvent) => {
+      if (event.persisted) {
+        return
+      }
+      leaving = true
+      send({ type: 'leave' })
+    }
 
     // Handle terminal input
     term.onData((data) => {
-      if (ws.readyState === WebSocket.OPEN) {
-        ws.send(JSON.stringify({ type: 'input', data }))
-      }
+      send({ type: 'input', data })
 
       // Track current input for suggestions
       if (data === '\r' || data === '\n') {
         setCurrentInput('')
         setSuggestions([])
+        suggestionInputRef.current = ''
         if (debounceTimerRef.current) {
           clearTimeout(debounceTimerRef.current)
         }
@@ -117,7 +173,7 @@ export default function Terminal() {
           const selected = suggestions[selectedIndex]
           const completion = selected.command.substring(currentInput.length)
           if (completion) {
-            ws.send(JSON.stringify({ type: 'input', data: completion }))
+            send({ type: 'input', data: completion })
             setCurrentInput(selected.command)
           }
           setSuggestions([])
@@ -143,15 +199,23 @@ export default function Terminal() {
 
     // Fetch AI suggestions
     const fetchSuggestions = async (input: string) => {
+      suggestionInputRef.current = input
       if (!input.trim() || input.endsWith('\n') || input.endsWith('\r')) {
         setSuggestions([])
         return
       }
 
       try {
+        // Local suggestions come back at once; AI ones follow if pending
         const response = await api.getAutocompleteSuggestions(input)
         setSuggestions(response.suggestions || [])
         setSelectedIndex(0)
+        if (response.pending) {
+          const merged = await api.getAutocompleteSuggestions(input, true)
+          if (suggestionInputRef.current === input) {
+            setSuggestions(merged.suggestions || [])
+          }
+        }
       } catch (error) {
         console.error('Failed to fetch suggestions:', error)
         setSuggestions([])
@@ -163,13 +227,11 @@ export default function Terminal() {
       if (fitAddonRef.current && xtermRef.current) {
         try {
           fitAddonRef.current.fit()
-          if (ws.readyState === WebSocket.OPEN) {
-            ws.send(JSON.stringify({
-              type: 'resize',
-              cols: xtermRef.current.cols,
-              rows: xtermRef.current.rows,
-            }))
-          }
+          send({
+            type: 'resize',
+            cols: xtermRef.current.cols,
+            rows: xtermRef.current.rows,
+          })
         } catch (e) {
           console.error("Failed to fit terminal:", e)
         }
@@ -177,17 +239,24 @@ export default function Terminal() {
     }
 
     window.addEventListener('resize', handleResize)
+    window.addEventListener('pagehide', handlePageHide)
+
+    connect()
 
-    // Cleanup
+    // Cleanup: the terminal is gone, so end its session
     return () => {
       window.removeEventListener('resize', handleResize)
+      window.removeEventListener('pagehide', handlePageHide)
       if (debounceTimerRef.current) {
         clearTimeout(debounceTimerRef.current)
       }
-      if (ws.readyState === WebSocket.OPEN) {
-        ws.send(JSON.stringify({ type: 'close' }))
-        ws.close()
+      leaving = true
+      if (retryTimer) {
+        clearTimeout(retryTimer)
       }
+      send({ type: 'close' })
+      wsRef.current?.close()
+      sessionStorage.removeItem(SESSION_STORAGE_KEY)
       term.dispose()
     }
   }, [])
@@ -3,14 +3,20 @@ const WS_BASE_URL = import.meta.env.VITE_WS_URL || 'ws://localhost:8000';
 
 export const api = {
   // Terminal
-  getTerminalWebSocketUrl: () => `${WS_BASE_URL}/api/terminal/ws`,
+  getTerminalWebSocketUrl: (sessionId?: string | null, offset?: number | null) => {
+    const params = new URLSearchParams();
+    if (sessionId) params.set('session_id', sessionId);
+    if (offset != null) params.set('offset', String(offset));
+    const query = params.toString();
+    return `${WS_BASE_URL}/api/terminal/ws${query ? `?${query}` : ''}`;
+  },
   
   // AI Suggestions
-  getAutocompleteSuggestions: async (currentInput: string) => {
+  getAutocompleteSuggestions: async (currentInput: string, waitForAi: boolean = false) => {
     const response = await fetch(`${API_BASE_URL}/api/ai/autocomplete`, {
       method: 'POST',
       headers: { 'Content-Type': 'application/json' },
-      body: JSON.stringify({ current_input: currentInput }),
+      body: JSON.stringify({ current_input: currentInput, wait_for_ai: waitForAi }),
     });
     return response.json();
   },
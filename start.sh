@@ -19,15 +19,14 @@ if [ ! -f .env ]; then
     exit 1
 fi
 
-# Check if GROQ_API_KEY is set
+# Check if GROQ_API_KEY is set (optional: without it only local autocomplete is offered)
 if ! grep -q "GROQ_API_KEY=gsk_" .env && ! grep -q "GROQ_API_KEY=.*[a-zA-Z0-9]" .env | grep -v "your_groq_api_key_here"; then
-    echo "❌ GROQ_API_KEY not set in .env file"
+    echo "⚠️  GROQ_API_KEY not set in .env file: AI suggestions are disabled"
     echo ""
-    echo "Please edit .env and add your Groq API key:"
+    echo "To enable them, edit .env and add your Groq API key:"
     echo "  GROQ_API_KEY=your_actual_api_key_here"
     echo ""
     echo "Get your API key from: https://console.groq.com"
-    exit 1
 fi
 
 # Check if dependencies are installed